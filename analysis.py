@@ -0,0 +1,315 @@
+# analysis.py — indicators, levels and BUY/SELL/HOLD scoring (no Telegram/Binance side effects)
+import math
+import bisect
+import traceback
+import numpy as np
+
+import params as signal_params
+from metrics import stats
+from klines import Klines
+from indicators import indicator_arrays
+
+# ---------------- Indicators & helpers ----------------
+def compute_indicators(df):
+    if isinstance(df, Klines):
+        # array path: indicator columns are added next to the (shared, uncopied) price columns
+        return df.assign(**indicator_arrays(df["high"], df["low"], df["close"], df["volume"]))
+    import ta  # deferred: pulls in pandas, only the DataFrame path needs it
+    d = df.copy()
+    # EMA
+    d["ema20"] = ta.trend.EMAIndicator(d["close"], window=20).ema_indicator()
+    d["ema50"] = ta.trend.EMAIndicator(d["close"], window=50).ema_indicator()
+    d["ema200"] = ta.trend.EMAIndicator(d["close"], window=200).ema_indicator()
+    # RSI
+    d["rsi"] = ta.momentum.RSIIndicator(d["close"], window=14).rsi()
+    # MACD
+    macd = ta.trend.MACD(d["close"], window_slow=26, window_fast=12, window_sign=9)
+    d["macd"] = macd.macd()
+    d["macd_signal"] = macd.macd_signal()
+    # ATR and volume MA
+    d["atr"] = ta.volatility.AverageTrueRange(d["high"], d["low"], d["close"], window=14).average_true_range()
+    d["vol_ma20"] = d["volume"].rolling(20).mean()
+    return d
+
+def detect_macd_cross(df):
+    if len(df) < 2: return None
+    p, l = df.iloc[-2], df.iloc[-1]
+    if p["macd"] < p["macd_signal"] and l["macd"] > l["macd_signal"]: return "up"
+    if p["macd"] > p["macd_signal"] and l["macd"] < l["macd_signal"]: return "down"
+    return None
+
+def detect_ema20_50_cross(df):
+    if len(df) < 2: return None
+    p, l = df.iloc[-2], df.iloc[-1]
+    if p["ema20"] <= p["ema50"] and l["ema20"] > l["ema50"]: return "up"
+    if p["ema20"] >= p["ema50"] and l["ema20"] < l["ema50"]: return "down"
+    return None
+
+# ---------------- Levels (support/resistance) ----------------
+def find_local_extrema(series, order=3):
+    """
+    Local minima/maxima finder. order=bars to each side.
+    Vectorized over sliding windows; same result as checking each bar against
+    series[i-order:i+order+1].min()/max() (ties count, NaN never matches).
+    """
+    arr = np.asarray(series)
+    n = len(arr)
+    w = 2 * order + 1
+    if n < w:
+        return [], []
+    win = np.lib.stride_tricks.sliding_window_view(arr, w)
+    mid = arr[order:n-order]
+    imin = np.flatnonzero(mid == win.min(axis=1)) + order
+    imax = np.flatnonzero(mid == win.max(axis=1)) + order
+    minima = [(int(i), arr[i]) for i in imin]
+    maxima = [(int(i), arr[i]) for i in imax]
+    return minima, maxima
+
+def cluster_levels(values, threshold=0.005):
+    """
+    Cluster similar levels (values list) into representative levels.
+    threshold — relative distance (e.g., 0.005 = 0.5%).
+    """
+    if not values:
+        return []
+    vals = sorted(values)
+    clusters = []
+    current = [vals[0]]
+    for v in vals[1:]:
+        if abs(v - current[-1]) / current[-1] <= threshold:
+            current.append(v)
+        else:
+            clusters.append(current)
+            current = [v]
+    clusters.append(current)
+    centers = [sum(c)/len(c) for c in clusters]
+    return centers
+
+def get_levels_from_df(df, order=4, cluster_threshold=0.006):
+    """
+    Return (supports, resistances) — lists of levels (floats).
+    order: window for local extrema
+    cluster_threshold: clustering threshold (relative)
+    """
+    closes = np.asarray(df["close"])
+    minima, maxima = find_local_extrema(closes, order=order)
+    min_vals = [v for i,v in minima]
+    max_vals = [v for i,v in maxima]
+    supports = cluster_levels(min_vals, threshold=cluster_threshold)
+    resistances = cluster_levels(max_vals, threshold=cluster_threshold)
+    # sort supports ascending, resistances descending
+    supports.sort()
+    resistances.sort(reverse=True)
+    return supports, resistances
+
+def nearest_level(levels, price):
+    """Level closest to price in a sorted list (ascending or descending) by bisection, or None."""
+    if not len(levels):
+        return None
+    if levels[0] > levels[-1]:
+        i = bisect.bisect_left(levels, -price, key=lambda x: -x)
+    else:
+        i = bisect.bisect_left(levels, price)
+    return min(levels[max(i - 1, 0):i + 1], key=lambda x: abs(x - price))
+
+# ---------------- Core analysis (BUY/SELL/HOLD + strength) ----------------
+def analyze_df_for_pair(df, pair_display=None, tf_display=None, scalp_mode=False, levels_mode=False, engine=None,
+                        known_levels=None, params=None, context=None):
+    """
+    returns (label, strength, report_text, details_dict)
+    label: "BUY"/"SELL"/"HOLD"
+    strength: 0..3 -> map later to stars
+    details_dict: useful info (levels if computed)
+    engine: optional IndicatorEngine already synced with df (skips full recomputation)
+    known_levels: optional precomputed (supports, resistances) for levels_mode (e.g. from a LevelIndex)
+    params: thresholds/weights (see params.py); default the live set params.current
+    context: optional context.Context (market breadth, correlation/beta vs BTC) from MarketContext;
+             a BUY against a weak market (or SELL against a strong one) loses score by the pair's correlation
+    """
+    p = params or signal_params.current
+    try:
+        t0 = stats.clock()
+        df = engine.annotate(df) if engine is not None else compute_indicators(df)
+        stats.observe("indicators", t0, pair_display, tf_display)
+        t0 = stats.clock()
+        if len(df) < 30:
+            return "HOLD", 0, f"Недостаточно данных для анализа (len={len(df)})", {}
+
+        last = df.iloc[-1]
+        prev = df.iloc[-2] if len(df) >= 2 else last
+
+        price = last["close"]
+        ema20 = last["ema20"]; ema50 = last["ema50"]; ema200 = last["ema200"]
+        rsi = last["rsi"]; macd = last["macd"]; macd_sig = last["macd_signal"]
+        atr = last["atr"]; vol = last["volume"]; vol_ma = last["vol_ma20"]
+
+        trend_up = (ema20 > ema50) and (ema50 > ema200)
+        trend_down = (ema20 < ema50) and (ema50 < ema200)
+
+        macd_cross = detect_macd_cross(df)
+        ema_cross = detect_ema20_50_cross(df)
+
+        vol_ok = (vol_ma is not None) and (not np.isnan(vol_ma)) and (vol > vol_ma)
+        price_above_ema20 = price > ema20
+        price_below_ema20 = price < ema20
+
+        # RSI thresholds (we keep moderately strict for strong)
+        rsi_buyish = rsi < p["rsi_buy"]
+        rsi_strong_buy = rsi < p["rsi_strong_buy"]
+        rsi_sellish = rsi > p["rsi_sell"]
+        rsi_strong_sell = rsi > p["rsi_strong_sell"]
+
+        buy_score = 0.0
+        sell_score = 0.0
+
+        # Trend weight
+        if trend_up: buy_score += 1.0
+        if trend_down: sell_score += 1.0
+
+        # EMA cross weight
+        if ema_cross == "up": buy_score += 1.0
+        if ema_cross == "down": sell_score += 1.0
+
+        # MACD cross weight
+        if macd_cross == "up": buy_score += 1.0
+        if macd_cross == "down": sell_score += 1.0
+
+        # RSI weight
+        if rsi_strong_buy: buy_score += 1.0
+        elif rsi_buyish: buy_score += 0.5
+        if rsi_strong_sell: sell_score += 1.0
+        elif rsi_sellish: sell_score += 0.5
+
+        # Volume & price confirmation
+        if vol_ok and price_above_ema20: buy_score += p["vol_weight"]
+        if vol_ok and price_below_ema20: sell_score += p["vol_weight"]
+
+        # market context: a pair that moves with BTC/the market rarely goes against it,
+        # so the leading side loses score when it points against a clearly weak/strong market
+        against_market = None
+        if context is not None and not math.isnan(context.breadth):
+            corr = context.corr_btc if not math.isnan(context.corr_btc) else context.corr_market
+            exposure = max(0.0, corr) if not math.isnan(corr) else 0.0
+            if context.breadth < p["breadth_low"] and exposure > 0 and buy_score > sell_score:
+                buy_score -= p["context_weight"] * exposure
+                against_market = "BUY"
+            elif context.breadth > p["breadth_high"] and exposure > 0 and sell_score > buy_score:
+                sell_score -= p["context_weight"] * exposure
+                against_market = "SELL"
+
+        # Map scores to strength 0..3
+        def to_strength(score):
+            if score >= p["strong_score"]: return 3
+            if score >= p["medium_score"]: return 2
+            if score > 0: return 1
+            return 0
+
+        b_str = to_strength(buy_score)
+        s_str = to_strength(sell_score)
+
+        if b_str > s_str and b_str > 0:
+            label = "BUY"; strength = b_str
+        elif s_str > b_str and s_str > 0:
+            label = "SELL"; strength = s_str
+        else:
+            label = "HOLD"; strength = 0
+
+        stats.observe("scoring", t0, pair_display, tf_display)
+
+        # compute levels optionally
+        t0 = stats.clock()
+        levels = {}
+        if levels_mode:
+            if known_levels is not None:
+                supports, resistances = known_levels
+            else:
+                supports, resistances = get_levels_from_df(df, order=p["level_order"],
+                                                           cluster_threshold=p["level_cluster"])
+            levels["supports"] = supports
+            levels["resistances"] = resistances
+
+            # extra logic: if price near support/resistance, may increase strength
+            # near = within level_atr_mult*ATR, or within 0.4% of the level when there is no ATR
+            def near_level(level):
+                # use absolute or relative threshold based on ATR
+                if math.isnan(atr) or atr == 0:
+                    rel = abs(price - level) / level
+                    return rel < 0.004  # 0.4%
+                else:
+                    return abs(price - level) <= p["level_atr_mult"] * atr
+            # if price near the closest resistance and label SELL (support and BUY), bump strength if possible
+            levels["nearest_support"] = nearest_level(supports, price)
+            levels["nearest_resistance"] = nearest_level(resistances, price)
+            r, s = levels["nearest_resistance"], levels["nearest_support"]
+            if r is not None and near_level(r) and label == "SELL":
+                strength = max(strength, min(3, strength+1))
+            if s is not None and near_level(s) and label == "BUY":
+                strength = max(strength, min(3, strength+1))
+
+        stats.observe("levels", t0, pair_display, tf_display)
+
+        # Prepare report text (card)
+        t0 = stats.clock()
+        stars_map = {0: "—", 1: "⭐", 2: "⭐⭐", 3: "⭐⭐⭐"}
+        strength_name = {0: "HOLD", 1: "Weak", 2: "Medium", 3: "Strong"}[strength]
+        emoji_label = "🟢 BUY" if label == "BUY" else ("🔴 SELL" if label == "SELL" else "⚪ HOLD")
+
+        report_lines = []
+        report_lines.append("━━━━━━━━━━━━━━━━━━━━━━━━")
+        report_lines.append(f"📊 Пара: {pair_display or '?'}")
+        report_lines.append(f"⏱ Таймфрейм: {tf_display or '?'}")
+        report_lines.append("")
+        report_lines.append(f"{emoji_label}  ({strength_name})")
+        report_lines.append(f"💵 Цена: {price:.6f}")
+        report_lines.append("")
+        # include the support/resistance closest to price if present
+        if levels_mode and levels.get("nearest_support") is not None:
+            report_lines.append(f"📈 Поддержка: {levels['nearest_support']:.6f}")
+        if levels_mode and levels.get("nearest_resistance") is not None:
+            report_lines.append(f"📉 Сопротивление: {levels['nearest_resistance']:.6f}")
+        report_lines.append("")
+        report_lines.append("🔎 Индикаторы:")
+        report_lines.append(f"• EMA20: {ema20:.6f} | EMA50: {ema50:.6f} | EMA200: {ema200:.6f}")
+        rsi_status = f"RSI = {rsi:.2f}"
+        report_lines.append(f"• {rsi_status} | MACD = {macd:.6f} | Signal = {macd_sig:.6f}")
+        report_lines.append(f"• ATR = {atr:.6f} | Vol = {vol:.4f} | VolMA20 = {vol_ma:.4f}")
+        if context is not None:
+            def fmt(x, spec=".2f"):
+                return "—" if math.isnan(x) else format(x, spec)
+            breadth = "—" if math.isnan(context.breadth) else f"{context.breadth * 100:.0f}%"
+            report_lines.append("")
+            report_lines.append(f"🌐 Рынок: {breadth} пар выше EMA200 (из {context.symbols})")
+            report_lines.append(f"• Корр. с BTC = {fmt(context.corr_btc)} | Бета = {fmt(context.beta_btc)} | "
+                                f"Корр. с рынком = {fmt(context.corr_market)}")
+            if against_market:
+                report_lines.append(f"⚠️ {against_market} против рынка — оценка снижена")
+        report_lines.append("")
+        # star rating 1..5 (map strength 0..3 -> 1..5 scale)
+        # 0->1,1->3,2->4,3->5
+        if strength == 0:
+            stars = "⚪ No signal"
+            score_val = "0/5"
+        else:
+            map_to = {1: "★★★ (3/5)", 2: "★★★★ (4/5)", 3: "★★★★★ (5/5)"}
+            stars = map_to[strength]
+            score_val = map_to[strength].split("(")[1].strip(")")
+        report_lines.append(f"⭐ Оценка сигнала: {stars}")
+        report_lines.append("")
+        report_lines.append(f"Детали: trend_up={trend_up}, ema_cross={ema_cross}, macd_cross={macd_cross}, vol_ok={vol_ok}")
+        report_lines.append("━━━━━━━━━━━━━━━━━━━━━━━━")
+        report = "\n".join(report_lines)
+        stats.observe("report", t0, pair_display, tf_display)
+
+        details = {"price": price, "ema20": ema20, "ema50": ema50, "ema200": ema200,
+                   "rsi": rsi, "macd": macd, "macd_signal": macd_sig, "atr": atr, "vol": vol}
+        if levels_mode:
+            details["levels"] = levels
+        if context is not None:
+            details["context"] = context._asdict()
+            details["against_market"] = against_market
+        return label, strength, report, details
+    except Exception as e:
+        stats.inc("errors", stage="analyze")
+        print("analyze_df_for_pair error:", e)
+        traceback.print_exc()
+        return "HOLD", 0, f"Ошибка анализа: {e}", {}
@@ -0,0 +1,293 @@
+# backtest.py — vectorized replay of the analyze_df_for_pair signal rules over local kline history
+#
+# usage: python backtest.py data/BTCUSDT-5m.csv data/ETHUSDT-1h.csv [--levels] [--horizons 1,3,12] [--check 20]
+#                           [--params best.json]
+# files: Binance kline CSV dumps (data.binance.vision, with or without header); symbol/tf from "SYMBOL-TF*.csv"
+#        or, with --store DIR, "SYMBOL-TF" keys read from a KlineStore
+import os
+import re
+import sys
+import math
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+import params as signal_params
+from analysis import analyze_df_for_pair, get_levels_from_df
+from batch import score_arrays
+from levels import LevelIndex
+from store import KlineStore
+
+KLINE_COLUMNS = ["open_time","open","high","low","close","volume","close_time","quote_av","trades","tb_base_av","tb_quote_av","ignore"]
+LIVE_WINDOW = 300      # candles the live bot analyzes (indicators and levels are taken from this window)
+
+
+# ---------------- data ----------------
+def load_klines_csv(path):
+    """Read a Binance kline CSV (header optional) into a numeric DataFrame sorted by open_time."""
+    with open(path, encoding="utf-8") as f:
+        first = f.readline()
+    has_header = not first[:1].isdigit()
+    df = pd.read_csv(path, header=0 if has_header else None)
+    if not has_header:
+        df.columns = KLINE_COLUMNS[:len(df.columns)]
+    df = df[["open_time","open","high","low","close","volume","close_time"]].astype(
+        {"open_time": "int64", "open": float, "high": float, "low": float, "close": float,
+         "volume": float, "close_time": "int64"})
+    # newer dumps are in microseconds
+    if len(df) and df["open_time"].iloc[0] > 10**14:
+        df["open_time"] //= 1000; df["close_time"] //= 1000
+    return df.sort_values("open_time").drop_duplicates("open_time", keep="last").reset_index(drop=True)
+
+
+def parse_name(path):
+    """'BTCUSDT-5m-2024-01.csv' -> ('BTCUSDT', '5m')."""
+    m = re.match(r"([A-Z0-9]+)-(\d+[mhdwM])", os.path.basename(path))
+    return (m.group(1), m.group(2)) if m else (os.path.basename(path), "?")
+
+
+# ---------------- vectorized indicators (full series) ----------------
+def indicator_frame(df, window=LIVE_WINDOW):
+    """
+    compute_indicators for a whole series with C-level pandas ops only
+    (ta's ATR is a Python loop; here Wilder smoothing is an ewm seeded with the first-14 mean).
+    Every bar gets the EMAs the live bot computes on its trailing `window` candles, seeded with
+    that window's first close: EMA(adjust=False) is linear in its seed, so the whole-series EMA
+    at bar j is corrected by (1-a)^(window-1) * (close[s] - ema[s]), s = j - window + 1.
+    RSI/MACD/ATR keep their whole-series seed (the gap is below 1e-8 after 300 candles).
+    """
+    c, h, l, v = df["close"], df["high"], df["low"], df["volume"]
+    out = {"close": c.values, "volume": v.values}
+    start = np.arange(len(df)) - window + 1 if window else np.zeros(len(df), dtype=int)
+    anchored = start > 0
+    for w in (20, 50, 200):
+        e = c.ewm(span=w, adjust=False).mean().to_numpy(copy=True)
+        s = start[anchored]
+        e[anchored] += (1 - 2.0 / (w + 1)) ** (window - 1) * (c.values[s] - e[s])
+        e[:w - 1] = np.nan
+        out[f"ema{w}"] = e
+    diff = c.diff(1)
+    up = diff.where(diff > 0, 0.0).ewm(alpha=1/14, min_periods=14, adjust=False).mean()
+    dn = (-diff.where(diff < 0, 0.0)).ewm(alpha=1/14, min_periods=14, adjust=False).mean()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out["rsi"] = np.where(dn == 0, 100, 100 - (100 / (1 + up / dn)))
+    macd = c.ewm(span=12, min_periods=12, adjust=False).mean() - c.ewm(span=26, min_periods=26, adjust=False).mean()
+    out["macd"] = macd.values
+    out["macd_signal"] = macd.ewm(span=9, min_periods=9, adjust=False).mean().values
+    pc = c.shift(1)
+    tr = pd.concat([h - l, (h - pc).abs(), (l - pc).abs()], axis=1).max(axis=1).values
+    atr = np.zeros(len(df))
+    if len(df) >= 14:
+        seeded = np.full(len(df), np.nan)
+        seeded[13] = tr[:14].mean()
+        seeded[14:] = tr[14:]
+        atr[13:] = pd.Series(seeded[13:]).ewm(alpha=1/14, adjust=False).mean().values
+    out["atr"] = atr
+    out["vol_ma20"] = v.rolling(20).mean().values
+    return out
+
+
+def _shift1(a):
+    return np.concatenate([[np.nan], a[:-1]]) if len(a) else a
+
+
+def shifted(ind):
+    """(prev, last, n) inputs of score_arrays for every bar: prev = bar j-1, last = bar j."""
+    prev = {k: _shift1(v) for k, v in ind.items()}
+    n = np.minimum(np.arange(1, len(ind["close"]) + 1), LIVE_WINDOW)
+    return prev, ind, n
+
+
+def score_series(ind, params=None):
+    """Score every bar at once. Returns label_code/strength arrays."""
+    prev, last, n = shifted(ind)
+    return score_arrays(prev, last, n, params)
+
+
+def apply_levels_bump(df, ind, scores, params=None):
+    """
+    levels_mode strength bump (price within level_atr_mult*ATR of the support closest to it for BUY /
+    resistance for SELL). Levels come from the trailing LIVE_WINDOW candles via an
+    incremental LevelIndex, evaluated only on bars where the bump can change the result.
+    """
+    p = params or signal_params.current
+    strength = scores["strength"].copy()
+    code = scores["label_code"]
+    times = df["open_time"].values; closes = df["close"].values; atr = ind["atr"]
+    idx = LevelIndex(p["level_order"], p["level_cluster"])
+    todo = np.flatnonzero((code != 0) & (strength < 3) & (np.arange(len(df)) >= LIVE_WINDOW - 1))
+    for j in todo:
+        lo = j - LIVE_WINDOW + 1
+        idx.update(times[lo:j + 1], closes[lo:j + 1])
+        price, a = closes[j], atr[j]
+        level = idx.nearest_resistance(price) if code[j] < 0 else idx.nearest_support(price)
+        if level is None:
+            continue
+        if math.isnan(a) or a == 0:
+            near = abs(price - level) / level < 0.004
+        else:
+            near = abs(price - level) <= p["level_atr_mult"] * a
+        if near:    # same as the scalar path: the closest level bumps once
+            strength[j] = min(3, strength[j] + 1)
+    scores = dict(scores)
+    scores["strength"] = strength
+    return scores
+
+
+# ---------------- outcomes ----------------
+def forward_returns(close, horizons):
+    """{h: close[j+h]/close[j]-1} (NaN where the future is not available)."""
+    out = {}
+    for h in horizons:
+        r = np.full(len(close), np.nan)
+        if h < len(close):
+            r[:-h] = close[h:] / close[:-h] - 1
+        out[h] = r
+    return out
+
+
+def adverse_excursion(df, horizon):
+    """Worst move against a BUY (low) and against a SELL (high) over the next `horizon` bars."""
+    n = len(df)
+    c, lo, hi = df["close"].values, df["low"].values, df["high"].values
+    mae_buy = np.full(n, np.nan); mae_sell = np.full(n, np.nan)
+    if horizon < n:
+        win_lo = np.lib.stride_tricks.sliding_window_view(lo[1:], horizon).min(axis=1)
+        win_hi = np.lib.stride_tricks.sliding_window_view(hi[1:], horizon).max(axis=1)
+        m = len(win_lo)
+        mae_buy[:m] = win_lo / c[:m] - 1
+        mae_sell[:m] = 1 - win_hi / c[:m]
+    return mae_buy, mae_sell
+
+
+def max_drawdown(returns):
+    """Max drawdown of the compounded equity curve of a return sequence."""
+    if not len(returns):
+        return 0.0
+    equity = np.cumprod(1 + returns)
+    peak = np.maximum.accumulate(np.concatenate([[1.0], equity]))[1:]
+    return float((equity / peak - 1).min())
+
+
+def run_backtest(df, symbol="?", tf="?", horizons=(1, 3, 12), levels=False, params=None):
+    """Returns (signals DataFrame, stats DataFrame, per-bar scores, timings dict)."""
+    timings = {}
+    t0 = time.perf_counter()
+    ind = indicator_frame(df)
+    timings["indicators"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    scores = score_series(ind, params)
+    if levels:
+        scores = apply_levels_bump(df, ind, scores, params)
+    timings["scoring"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    rets = forward_returns(df["close"].values, horizons)
+    hmax = max(horizons)
+    mae_buy, mae_sell = adverse_excursion(df, hmax)
+    sig = np.flatnonzero(scores["label_code"] != 0)
+    direction = scores["label_code"][sig]
+    signals = pd.DataFrame({
+        "symbol": symbol, "tf": tf, "bar": sig, "open_time": df["open_time"].values[sig],
+        "label": np.where(direction > 0, "BUY", "SELL"),
+        "strength": scores["strength"][sig], "price": df["close"].values[sig],
+    })
+    for h in horizons:
+        signals[f"ret_{h}"] = rets[h][sig] * direction
+    signals[f"mae_{hmax}"] = np.where(direction > 0, mae_buy[sig], mae_sell[sig])
+    stats = signal_stats(signals, horizons)
+    timings["outcomes"] = time.perf_counter() - t0
+    return signals, stats, scores, timings
+
+
+def signal_stats(signals, horizons):
+    """Hit rate / mean return per (symbol, tf, label, strength) plus drawdown of the longest horizon."""
+    hmax = max(horizons)
+    rows = []
+    for key, g in signals.groupby(["symbol", "tf", "label", "strength"]):
+        row = dict(zip(["symbol", "tf", "label", "strength"], key))
+        row["signals"] = len(g)
+        for h in horizons:
+            r = g[f"ret_{h}"].dropna()
+            row[f"hit_{h}"] = float((r > 0).mean()) if len(r) else np.nan
+            row[f"avg_{h}"] = float(r.mean()) if len(r) else np.nan
+        row[f"mae_{hmax}"] = float(g[f"mae_{hmax}"].mean())
+        # equity of non-overlapping hmax-bar trades in time order
+        g = g.dropna(subset=[f"ret_{hmax}"])
+        keep = _non_overlapping(g["bar"].values, hmax)
+        row["max_dd"] = max_drawdown(g[f"ret_{hmax}"].values[keep])
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def _non_overlapping(bars, gap):
+    keep, next_free = [], -1
+    for i, b in enumerate(bars):
+        if b >= next_free:
+            keep.append(i)
+            next_free = b + gap
+    return np.array(keep, dtype=int)
+
+
+# ---------------- cross-check ----------------
+def cross_check(df, scores, samples=20, levels=False, seed=0, params=None):
+    """
+    Re-score randomly sampled bars with the scalar analyze_df_for_pair on the trailing
+    LIVE_WINDOW candles, exactly what the live bot scores. Returns (mismatches, checked).
+    """
+    p = params or signal_params.current
+    candidates = np.arange(LIVE_WINDOW - 1, len(df))
+    if not len(candidates):
+        return [], 0
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(candidates, size=min(samples, len(candidates)), replace=False)
+    mismatches = []
+    for j in sorted(picks):
+        window = df.iloc[j - LIVE_WINDOW + 1:j + 1]
+        known = get_levels_from_df(window, p["level_order"], p["level_cluster"]) if levels else None
+        label, strength, _, _ = analyze_df_for_pair(window, levels_mode=levels, known_levels=known, params=p)
+        code = {"BUY": 1, "SELL": -1, "HOLD": 0}[label]
+        if code != scores["label_code"][j] or strength != scores["strength"][j]:
+            mismatches.append((int(j), label, strength, int(scores["label_code"][j]), int(scores["strength"][j])))
+    return mismatches, len(picks)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Backtest bot signals on local kline CSV files")
+    ap.add_argument("files", nargs="+")
+    ap.add_argument("--horizons", default="1,3,12", help="forward return horizons in bars")
+    ap.add_argument("--levels", action="store_true", help="apply the levels_mode strength bump")
+    ap.add_argument("--check", type=int, default=20, help="bars to cross-check with the scalar path")
+    ap.add_argument("--out", help="write per-signal rows to this CSV")
+    ap.add_argument("--store", help="read SYMBOL-TF keys from this KlineStore directory instead of CSV files")
+    ap.add_argument("--params", help="signal parameter JSON (e.g. from sweep.py --save) instead of the defaults")
+    args = ap.parse_args(argv)
+    horizons = [int(h) for h in args.horizons.split(",")]
+    params = signal_params.load(args.params) if args.params else None
+
+    all_signals, all_stats, bars, started = [], [], 0, time.perf_counter()
+    for path in args.files:
+        symbol, tf = parse_name(path)
+        df = KlineStore(args.store).to_frame(symbol, tf) if args.store else load_klines_csv(path)
+        bars += len(df)
+        signals, stats, scores, timings = run_backtest(df, symbol, tf, horizons, levels=args.levels, params=params)
+        print(f"{symbol} {tf}: {len(df)} bars, {len(signals)} signals "
+              + " ".join(f"{k}={v:.3f}s" for k, v in timings.items()))
+        if args.check:
+            mism, checked = cross_check(df, scores, samples=args.check, levels=args.levels, params=params)
+            rate = len(mism) / checked if checked else 0.0
+            print(f"  cross-check vs live {LIVE_WINDOW}-candle windows: {len(mism)}/{checked} sampled bars differ "
+                  f"(mismatch rate {rate:.1%})" + (f", first: {mism[:5]}" if mism else ""))
+        all_signals.append(signals); all_stats.append(stats)
+    elapsed = time.perf_counter() - started
+    stats = pd.concat(all_stats, ignore_index=True) if all_stats else pd.DataFrame()
+    with pd.option_context("display.width", 200, "display.max_rows", 500):
+        print(stats.to_string(index=False, float_format=lambda x: f"{x:.4f}"))
+    print(f"{bars} bars in {elapsed:.2f}s ({bars / max(elapsed, 1e-9):,.0f} bars/s)")
+    if args.out:
+        pd.concat(all_signals, ignore_index=True).to_csv(args.out, index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+# batch.py — vectorized multi-symbol scoring (same rules as analyze_df_for_pair, without levels)
+import numpy as np
+
+import params as signal_params
+from indicators import RSI_WINDOW, ATR_WINDOW, VOL_WINDOW, MACD_FAST, MACD_SLOW, MACD_SIGN
+
+MIN_ROWS = 30  # analyze_df_for_pair returns HOLD below this
+
+
+def stack_frames(dfs, columns=("close", "high", "low", "volume")):
+    """
+    Right-align a list of kline DataFrames into 2-D arrays (symbols x time),
+    left-padding shorter histories with NaN. Returns {column: array}.
+    """
+    t = max((len(df) for df in dfs), default=0)
+    out = {}
+    for col in columns:
+        arr = np.full((len(dfs), t), np.nan)
+        for i, df in enumerate(dfs):
+            if len(df):
+                arr[i, t - len(df):] = np.asarray(df[col])
+        out[col] = arr
+    return out
+
+
+def _ema_step(prev, x, a):
+    # seed with the first observation, like ewm(adjust=False)
+    return np.where(np.isnan(prev), x, a * x + (1 - a) * prev)
+
+
+def indicators_batch(close, high, low, volume):
+    """
+    Compute the analyze_df_for_pair indicators for N symbols at once.
+    Inputs are (N, T) float arrays, NaN-left-padded where history is shorter.
+    Recurrences run over T with N-wide vector ops; only the last two bars are kept.
+    Returns (prev, last, n): dicts of (N,) arrays and the per-symbol row count.
+    """
+    close = np.asarray(close, dtype=float); high = np.asarray(high, dtype=float)
+    low = np.asarray(low, dtype=float); volume = np.asarray(volume, dtype=float)
+    N, T = close.shape
+    nan = np.full(N, np.nan)
+    n = np.zeros(N, dtype=np.int64)
+    ema20, ema50, ema200 = nan.copy(), nan.copy(), nan.copy()
+    fast, slow, sig = nan.copy(), nan.copy(), nan.copy()
+    sig_n = np.zeros(N, dtype=np.int64)
+    up, dn = nan.copy(), nan.copy()
+    prev_close = nan.copy()
+    tr_sum = np.zeros(N); atr = np.zeros(N)
+    a20, a50, a200 = 2 / 21, 2 / 51, 2 / 201
+    af, asl, asg = 2 / (MACD_FAST + 1), 2 / (MACD_SLOW + 1), 2 / (MACD_SIGN + 1)
+    ar = 1.0 / RSI_WINDOW
+    snaps = []
+    for t in range(T):
+        c = close[:, t]; h = high[:, t]; l = low[:, t]
+        have = ~np.isnan(c)
+        n = n + have
+        ema20 = np.where(have, _ema_step(ema20, c, a20), ema20)
+        ema50 = np.where(have, _ema_step(ema50, c, a50), ema50)
+        ema200 = np.where(have, _ema_step(ema200, c, a200), ema200)
+        fast = np.where(have, _ema_step(fast, c, af), fast)
+        slow = np.where(have, _ema_step(slow, c, asl), slow)
+
+        first = have & np.isnan(prev_close)
+        diff = np.where(first, 0.0, c - prev_close)
+        up_i = np.where(diff > 0, diff, 0.0)
+        dn_i = np.where(diff < 0, -diff, 0.0)
+        up = np.where(have, np.where(first, up_i, ar * up_i + (1 - ar) * up), up)
+        dn = np.where(have, np.where(first, dn_i, ar * dn_i + (1 - ar) * dn), dn)
+
+        with np.errstate(invalid="ignore"):
+            tr = np.where(first, h - l, np.maximum(h - l, np.maximum(np.abs(h - prev_close), np.abs(l - prev_close))))
+        tr_sum = np.where(have & (n <= ATR_WINDOW), tr_sum + tr, tr_sum)
+        atr = np.where(have & (n == ATR_WINDOW), tr_sum / ATR_WINDOW, atr)
+        atr = np.where(have & (n > ATR_WINDOW), (atr * (ATR_WINDOW - 1) + tr) / ATR_WINDOW, atr)
+        prev_close = np.where(have, c, prev_close)
+
+        macd_ok = have & (n >= MACD_SLOW)
+        macd = np.where(n >= MACD_SLOW, fast - slow, np.nan)
+        sig = np.where(macd_ok, _ema_step(sig, macd, asg), sig)
+        sig_n = sig_n + macd_ok
+
+        if t >= T - 2:
+            if T >= VOL_WINDOW:
+                vwin = volume[:, t - VOL_WINDOW + 1:t + 1]
+                vol_ma = vwin.mean(axis=1)   # NaN where the window reaches into padding
+            else:
+                vol_ma = nan.copy()
+            with np.errstate(divide="ignore", invalid="ignore"):
+                rsi = np.where(dn == 0, 100.0, 100 - 100 / (1 + up / dn))
+            snaps.append({
+                "close": c.copy(), "volume": volume[:, t].copy(),
+                "ema20": np.where(n >= 20, ema20, np.nan),
+                "ema50": np.where(n >= 50, ema50, np.nan),
+                "ema200": np.where(n >= 200, ema200, np.nan),
+                "rsi": np.where(n >= RSI_WINDOW, rsi, np.nan),
+                "macd": macd,
+                "macd_signal": np.where(sig_n >= MACD_SIGN, sig, np.nan),
+                "atr": atr.copy(),
+                "vol_ma20": vol_ma,
+            })
+    if not snaps:
+        empty = {k: nan.copy() for k in ("close", "volume", "ema20", "ema50", "ema200", "rsi",
+                                         "macd", "macd_signal", "atr", "vol_ma20")}
+        return empty, empty, n
+    last = snaps[-1]
+    prev = snaps[-2] if len(snaps) == 2 else last
+    return prev, last, n
+
+
+def score_arrays(prev, last, n=None, params=None):
+    """
+    Vectorized BUY/SELL scoring of analyze_df_for_pair for any array shape.
+    prev/last: dicts with close, volume, ema20/50/200, rsi, macd, macd_signal, vol_ma20.
+    n: rows of history per element (HOLD below MIN_ROWS), None = enough history.
+    params: thresholds/weights (see params.py), default params.current.
+    Returns dict: buy_score, sell_score, strength (0..3), label_code (1 BUY, -1 SELL, 0 HOLD),
+    trend_up, trend_down, ema_cross, macd_cross (1 up, -1 down, 0 none), vol_ok.
+    """
+    p = params or signal_params.current
+    price = last["close"]
+    e20, e50, e200 = last["ema20"], last["ema50"], last["ema200"]
+    rsi, macd, sig = last["rsi"], last["macd"], last["macd_signal"]
+    vol, vol_ma = last["volume"], last["vol_ma20"]
+    pe20, pe50 = prev["ema20"], prev["ema50"]
+    pmacd, psig = prev["macd"], prev["macd_signal"]
+
+    trend_up = (e20 > e50) & (e50 > e200)
+    trend_down = (e20 < e50) & (e50 < e200)
+    ema_up = (pe20 <= pe50) & (e20 > e50)
+    ema_down = (pe20 >= pe50) & (e20 < e50)
+    macd_up = (pmacd < psig) & (macd > sig)
+    macd_down = (pmacd > psig) & (macd < sig)
+    vol_ok = ~np.isnan(vol_ma) & (vol > vol_ma)
+
+    buy = (trend_up * 1.0 + ema_up * 1.0 + macd_up * 1.0
+           + np.where(rsi < p["rsi_strong_buy"], 1.0, np.where(rsi < p["rsi_buy"], 0.5, 0.0))
+           + (vol_ok & (price > e20)) * p["vol_weight"])
+    sell = (trend_down * 1.0 + ema_down * 1.0 + macd_down * 1.0
+            + np.where(rsi > p["rsi_strong_sell"], 1.0, np.where(rsi > p["rsi_sell"], 0.5, 0.0))
+            + (vol_ok & (price < e20)) * p["vol_weight"])
+
+    def to_strength(score):
+        return np.where(score >= p["strong_score"], 3,
+                        np.where(score >= p["medium_score"], 2, np.where(score > 0, 1, 0)))
+
+    b_str, s_str = to_strength(buy), to_strength(sell)
+    is_buy = (b_str > s_str) & (b_str > 0)
+    is_sell = (s_str > b_str) & (s_str > 0)
+    if n is not None:
+        enough = np.asarray(n) >= MIN_ROWS
+        is_buy &= enough
+        is_sell &= enough
+    label_code = np.where(is_buy, 1, np.where(is_sell, -1, 0))
+    strength = np.where(is_buy, b_str, np.where(is_sell, s_str, 0))
+    return {"buy_score": buy, "sell_score": sell, "strength": strength, "label_code": label_code,
+            "trend_up": trend_up, "trend_down": trend_down,
+            "ema_cross": np.where(ema_up, 1, np.where(ema_down, -1, 0)),
+            "macd_cross": np.where(macd_up, 1, np.where(macd_down, -1, 0)),
+            "vol_ok": vol_ok}
+
+
+LABELS = np.array(["SELL", "HOLD", "BUY"])
+
+
+def analyze_batch(close, high, low, volume):
+    """
+    Score N symbols in one pass. Inputs: (N, T) arrays (see stack_frames).
+    Returns dict with per-symbol arrays: label ("BUY"/"SELL"/"HOLD"), strength,
+    buy_score, sell_score and the last-bar indicator values.
+    Labels match analyze_df_for_pair(levels_mode=False).
+    """
+    prev, last, n = indicators_batch(close, high, low, volume)
+    res = score_arrays(prev, last, n)
+    res["label"] = LABELS[res["label_code"] + 1]
+    res["rows"] = n
+    res["last"] = last
+    return res
@@ -0,0 +1,657 @@
+# bench.py — offline benchmarks for the analysis hot path (synthetic klines, fake Binance client, stub bot)
+#
+# usage: python bench.py                       quick sweep, prints a table
+#        python bench.py --full                windows up to 100k candles, up to 1000 symbols, 5000 chats
+#        python bench.py --save base.json      save results as a baseline
+#        python bench.py --compare base.json   flag p50 regressions (exit 1 if any)
+#        python bench.py --check               correctness checks: indicator parity, stream vs REST, ... (exit 1 on a failure)
+import sys
+import json
+import time
+import argparse
+import platform
+import numpy as np
+import pandas as pd
+
+from analysis import compute_indicators, get_levels_from_df, analyze_df_for_pair
+from batch import analyze_batch, stack_frames
+from klines import Klines
+from fakes import SyntheticMarket, FakeClient, StubBot, StubBinanceServer, load_bot_offline
+from touches import TouchEngine
+
+KLINE_COLUMNS = ["open_time","open","high","low","close","volume","close_time","quote_av","trades","tb_base_av","tb_quote_av","ignore"]
+
+
+def measure(fn, repeat, warmup=1):
+    """Run fn repeat times; returns list of seconds."""
+    for _ in range(warmup):
+        fn()
+    out = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        out.append(time.perf_counter() - t0)
+    return out
+
+
+def summarize(name, params, samples, items=1):
+    """Latency percentiles (ms) and throughput (items/s) for one benchmark case."""
+    a = np.array(samples) * 1000
+    return {"name": name, "params": params, "n": len(a),
+            "p50_ms": float(np.percentile(a, 50)), "p90_ms": float(np.percentile(a, 90)),
+            "p99_ms": float(np.percentile(a, 99)), "max_ms": float(a.max()),
+            "throughput": float(items / (np.median(a) / 1000)) if np.median(a) > 0 else float("inf")}
+
+
+def parse_rows(rows):
+    # the DataFrame build fetch_klines does for every response
+    df = pd.DataFrame(rows, columns=KLINE_COLUMNS)
+    return df.astype({"open": float, "high": float, "low": float, "close": float, "volume": float})
+
+
+# ---------------- benchmark cases ----------------
+def bench_window(market, windows, repeat):
+    results = []
+    for n in windows:
+        rows = market.rows("BTCUSDT", "5m", limit=n)
+        df = parse_rows(rows)
+        r = max(3, repeat if n <= 1000 else repeat // 5)
+        results.append(summarize("parse", {"window": n}, measure(lambda: parse_rows(rows), r), n))
+        results.append(summarize("compute_indicators", {"window": n}, measure(lambda: compute_indicators(df), r), n))
+        results.append(summarize("get_levels_from_df", {"window": n}, measure(lambda: get_levels_from_df(df), r), n))
+        results.append(summarize("analyze_df_for_pair", {"window": n},
+                                 measure(lambda: analyze_df_for_pair(df, "BTCUSDT", "5m", levels_mode=True), r), n))
+        results.append(summarize("parse+analyze_frame", {"window": n},
+                                 measure(lambda: analyze_df_for_pair(parse_rows(rows), "BTCUSDT", "5m", levels_mode=True), r), n))
+        # array-backed path (what fetch_klines returns)
+        k = Klines.from_rows(rows)
+        results.append(summarize("parse_klines", {"window": n}, measure(lambda: Klines.from_rows(rows), r), n))
+        results.append(summarize("compute_indicators_klines", {"window": n}, measure(lambda: compute_indicators(k), r), n))
+        results.append(summarize("parse+analyze_klines", {"window": n},
+                                 measure(lambda: analyze_df_for_pair(Klines.from_rows(rows), "BTCUSDT", "5m", levels_mode=True), r), n))
+        print(f"[memory] window {n}: DataFrame {df.memory_usage(deep=True).sum() / 1024:.0f} KiB, "
+              f"Klines {k.nbytes / 1024:.0f} KiB")
+    return results
+
+
+def bench_symbols(market, counts, repeat, window=300):
+    results = []
+    for count in counts:
+        dfs = [market.frame(f"SYM{i}USDT", "1h", window) for i in range(count)]
+        arrays = stack_frames(dfs)
+        r = max(3, repeat // max(1, count // 100))
+        results.append(summarize("analyze_batch", {"symbols": count, "window": window},
+                                 measure(lambda: analyze_batch(arrays["close"], arrays["high"], arrays["low"], arrays["volume"]), r),
+                                 count))
+        if count <= 100:
+            results.append(summarize("analyze_loop", {"symbols": count, "window": window},
+                                     measure(lambda: [analyze_df_for_pair(d, "X", "1h") for d in dfs], max(3, r // 3)),
+                                     count))
+    return results
+
+
+def bench_auto_scan(counts, repeat):
+    """One per-close batch over every auto market: background_auto_scan through bot.py with a FakeClient and StubBot."""
+    try:
+        client = FakeClient(SyntheticMarket(seed=1))
+        botmod = load_bot_offline(client=client, stub=StubBot())
+    except Exception as e:
+        print(f"[bench] skipping auto scan/fetch (bot import failed: {e})")
+        return []
+    results = []
+    botmod.subs.default_weak = True
+    cold_pairs = iter(f"COLD{i}USDT" for i in range(10**6))
+    results.append(summarize("fetch_klines_cold", {"window": 300},
+                             measure(lambda: botmod.fetch_klines(next(cold_pairs), "5m", 300), repeat), 300))
+    botmod.fetch_klines("BTCUSDT", "5m", 300)
+    results.append(summarize("fetch_klines_incremental", {"window": 300},
+                             measure(lambda: botmod.fetch_klines("BTCUSDT", "5m", 300), repeat), 300))
+    for count in counts:
+        botmod.PAIRS = [f"SYM{i}USDT" for i in range(count)]
+        botmod.subs.set_auto_markets([(p, t) for p in botmod.PAIRS for t in botmod.AUTO_SCAN_TFS])
+        botmod.subs.update(1, mode="auto")
+        botmod.candle_store.max_series = max(botmod.candle_store.max_series, count * len(botmod.AUTO_SCAN_TFS) + 16)
+        r = max(2, repeat // max(1, count // 10))
+        markets = list(botmod.subs.auto_markets)
+        results.append(summarize("background_auto_scan", {"symbols": count},
+                                 measure(lambda: botmod.background_auto_scan(markets), r), len(markets)))
+    return results
+
+
+def bench_fanout(counts, repeat):
+    """
+    Load test of the subscription fan-out: N simulated chats spread over all modes,
+    one candle-close cycle runs every scheduled job once. Analyses and API calls
+    should stay flat as N grows; only queued messages scale with chats.
+    """
+    try:
+        client = FakeClient(SyntheticMarket(seed=2))
+        botmod = load_bot_offline(client=client, stub=StubBot())
+    except Exception as e:
+        print(f"[bench] skipping fanout (bot import failed: {e})")
+        return []
+    rng = np.random.default_rng(0)
+    queued = [0]
+    botmod.safe_send = lambda chat_id, text, **kw: queued.__setitem__(0, queued[0] + 1) or True
+    tfs = ["5m", "15m", "1h", "4h"]
+    results = []
+    for count in counts:
+        for chat_id in botmod.subs.chats():
+            botmod.subs.remove(chat_id)
+        for chat_id in range(count):
+            mode = ["auto", "manual", "scalp", "levels"][chat_id % 4]
+            pair = botmod.PAIRS[int(rng.integers(len(botmod.PAIRS)))]
+            tf = tfs[int(rng.integers(len(tfs)))]
+            botmod.subs.update(chat_id, mode=mode, send_weak=bool(chat_id % 3 == 0),
+                               pair=pair if mode != "auto" else None,
+                               timeframe=tf if mode in ("manual", "levels") else None,
+                               scalp_enabled=mode == "scalp", levels_enabled=mode == "levels")
+        botmod.refresh_jobs()
+        jobs = [(job, key) for kind, (tag, job, trigger) in botmod.JOBS.items() for key in botmod.subs.markets(kind)]
+
+        def cycle():
+            botmod.analysis_cache.invalidate()
+            for chat_id in botmod.subs.chats():
+                botmod.subs.chat(chat_id)["last_weak"].clear()
+            for job, (pair, tf) in jobs:
+                job(pair, tf)
+
+        cycle()   # warm candle store
+        calls0, misses0, queued[0] = client.calls, botmod.analysis_cache.misses, 0
+        samples = measure(cycle, max(2, repeat // 5), warmup=0)
+        n = len(samples)
+        r = summarize("fanout_cycle", {"chats": count, "markets": len(jobs)}, samples, count)
+        r.update(analyses=(botmod.analysis_cache.misses - misses0) / n, api_calls=(client.calls - calls0) / n,
+                 messages=queued[0] / n)
+        print(f"[fanout] {count} chats, {len(jobs)} markets: {r['analyses']:.0f} analyses, "
+              f"{r['api_calls']:.0f} API calls, {r['messages']:.0f} messages per cycle")
+        results.append(r)
+    botmod.scheduler.stop()
+    return results
+
+
+def tick_feed(symbols, ticks, seed=0):
+    """Synthetic bookTicker frames: a random walk per symbol with occasional 1-tick wicks."""
+    rng = np.random.default_rng(seed)
+    mids = {s: 100.0 + 10 * i for i, s in enumerate(symbols)}
+    frames = []
+    for k in range(ticks):
+        s = symbols[k % len(symbols)]
+        mids[s] *= 1 + rng.normal(0, 0.0005)
+        mid = mids[s] * (1 + (rng.choice([-1, 1]) * 0.004 if rng.random() < 0.01 else 0))  # wick
+        frames.append(json.dumps({"stream": f"{s.lower()}@bookTicker",
+                                  "data": {"u": k, "s": s, "b": f"{mid * 0.9999:.6f}", "B": "1",
+                                           "a": f"{mid * 1.0001:.6f}", "A": "1"}}))
+    return frames, mids
+
+
+def touch_engine_for(symbols, levels_per_tf=8, tfs=("15m", "1h", "4h"), cooldown=60):
+    engine = TouchEngine(cooldown=cooldown)
+    for i, s in enumerate(symbols):
+        mid = 100.0 + 10 * i
+        for j, tf in enumerate(tfs):
+            grid = mid * (1 + np.linspace(-0.02, 0.02, 2 * levels_per_tf) + 0.0007 * j)
+            engine.set_levels(s, tf, grid[:levels_per_tf], grid[levels_per_tf:][::-1], band=mid * 0.0005)
+    return engine
+
+
+def bench_touches(counts, repeat, ticks=20000, replay_ticks=3000, replay_delay=0.001):
+    """
+    Tick-driven level touches: on_tick cost per quote (levels of 3 timeframes per symbol),
+    then touch-detection latency with the start of the same feed replayed over a local
+    websocket at ~1/replay_delay ticks/s (event time stamped by the server at send).
+    """
+    from stream import TickStream, serve_replay
+    results = []
+    for count in counts:
+        symbols = [f"SYM{i}USDT" for i in range(count)]
+        frames, _ = tick_feed(symbols, ticks)
+        quotes = []
+        for raw in frames:
+            d = json.loads(raw)["data"]
+            quotes.append((d["s"], float(d["b"]), float(d["a"])))
+
+        def run():
+            engine = touch_engine_for(symbols)
+            for q in quotes:
+                engine.on_tick(*q)
+            return engine
+
+        engine = run()
+        r = summarize("touch_on_tick", {"symbols": count, "ticks": ticks}, measure(run, max(3, repeat // 5)), ticks)
+        r.update(touches=engine.touches, suppressed=engine.suppressed)
+        results.append(r)
+
+        latencies = []
+        engine = touch_engine_for(symbols)
+        engine.on_touch = lambda t: latencies.append(t.detected - t.event_ms / 1000.0)
+        frames = frames[:replay_ticks]
+        server, loop, _, port = serve_replay(frames, delay=replay_delay, stamp=True)
+        stream = TickStream(engine, base_url=f"ws://127.0.0.1:{port}")
+        stream.set_subscriptions(symbols)
+        stream.start()
+        deadline = time.time() + 60
+        while stream.frames < len(frames) and time.time() < deadline:
+            time.sleep(0.05)
+        stream.stop()
+        loop.call_soon_threadsafe(server.close)
+        if latencies:
+            r = summarize("touch_latency_replay", {"symbols": count, "ticks": len(frames)}, latencies, 1)
+            r.update(touches=len(latencies), frames=stream.frames)
+            print(f"[touches] {count} symbols: {stream.frames} replayed ticks, {len(latencies)} touches, "
+                  f"latency p50 {r['p50_ms']:.2f}ms p99 {r['p99_ms']:.2f}ms")
+            results.append(r)
+    return results
+
+
+def bench_governor(repeat, symbols=60, workers=8):
+    """
+    Request governor against the local stub Binance server: pooled keep-alive session vs a
+    new connection per request, coalescing of identical concurrent requests, and a scan
+    with a weight limit low enough that an ungoverned client would hit 429s.
+    """
+    import requests
+    from concurrent.futures import ThreadPoolExecutor
+    from governor import BinanceClient
+    results = []
+    server = StubBinanceServer(FakeClient(SyntheticMarket(seed=4))).start()
+    client = BinanceClient(server.url, pool_size=workers)
+    params = {"symbol": "BTCUSDT", "interval": "1h", "limit": 100}
+    results.append(summarize("rest_pooled", {"limit": 100},
+                             measure(lambda: client.get_klines(**params), repeat)))
+    results.append(summarize("rest_new_connection", {"limit": 100},
+                             measure(lambda: requests.get(server.url + "/api/v3/klines", params=params).json(), repeat)))
+
+    hits0 = server.hits["/api/v3/klines"]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda _: client.get_klines(symbol="ETHUSDT", interval="1h", limit=300), range(workers * 4)))
+    print(f"[governor] {workers * 4} identical concurrent requests -> {server.hits['/api/v3/klines'] - hits0} upstream calls")
+    server.stop()
+
+    # 2 weight per klines call: `symbols` calls need 2*symbols, the stub allows a bit less per minute
+    limit = int(symbols * 2 * 0.9)
+    # server and client share a clock that jumps ahead whenever the client waits for the next window
+    now, waits = [time.time()], []
+
+    def skip(seconds):
+        waits.append(seconds)
+        now[0] += seconds
+
+    server = StubBinanceServer(FakeClient(SyntheticMarket(seed=5)), weight_limit=limit, clock=lambda: now[0]).start()
+    client = BinanceClient(server.url, weight_limit=limit, pool_size=workers, clock=lambda: now[0], sleep=skip)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda i: client.get_klines(symbol=f"SYM{i}USDT", interval="1h", limit=300), range(symbols)))
+    r = summarize("governed_scan", {"symbols": symbols, "weight_limit": limit}, [time.perf_counter() - t0], symbols)
+    r.update(rate_limited=server.statuses.get(429, 0), throttled=len(waits))
+    print(f"[governor] scan of {symbols} symbols under a {limit}/min weight limit: "
+          f"{r['rate_limited']} responses 429, {r['throttled']} waits for the next window")
+    results.append(r)
+    server.stop()
+    return results
+
+
+def bench_shards(counts, repeat, window=300):
+    """
+    One scan (every symbol analyzed once) in-process vs on ShardPool workers. Throughput
+    should grow with workers up to the core count; the table shows scans, the print the speedup.
+    """
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+    from shards import ShardPool
+    market = SyntheticMarket(seed=6)
+    cores = os.cpu_count() or 1
+    worker_counts = sorted({1, 2, *[w for w in (4, 8, 16) if w <= cores], cores})
+    results = []
+    for count in counts:
+        windows = {f"SYM{i}USDT": Klines.from_frame(market.frame(f"SYM{i}USDT", "1h", window)) for i in range(count)}
+        r = max(3, repeat // max(1, count // 50))
+        local = measure(lambda: [analyze_df_for_pair(k, p, "1h") for p, k in windows.items()], r)
+        results.append(summarize("scan_in_process", {"symbols": count}, local, count))
+        for workers in worker_counts:
+            pool = ShardPool(workers, slots=count, max_len=window).start()
+            try:
+                with ThreadPoolExecutor(max_workers=workers * 2) as threads:
+                    scan = lambda: list(threads.map(lambda p: pool.analyze(p, "1h", windows[p]), windows))
+                    samples = measure(scan, r, warmup=2)
+            finally:
+                pool.stop()
+            results.append(summarize("scan_sharded", {"symbols": count, "workers": workers}, samples, count))
+            print(f"[shards] {count} symbols, {workers} workers ({cores} cores): "
+                  f"{np.median(local) / np.median(samples):.2f}x in-process")
+    return results
+
+
+def context_market(count, window, closes, seed=7):
+    """count synthetic 1h series long enough for `closes` candle closes after the first window."""
+    market = SyntheticMarket(seed=seed)
+    return {f"SYM{i}USDT": Klines.from_frame(market.frame(f"SYM{i}USDT", "1h", window + closes))
+            for i in range(count)}
+
+
+def context_closes(ctx, series, window, order=None):
+    """A callable that plays the next candle close: every symbol's window observed, then one publish."""
+    from candles import INTERVAL_MS
+    first = next(iter(series.values()))
+    closes = iter(range(window, len(first) + 1))
+    now = [0]
+    ctx.clock = lambda: now[0] / 1000
+    pairs = list(order or series)
+
+    def candle_close():
+        n = next(closes)
+        now[0] = int(first["open_time"][n - 1]) + INTERVAL_MS["1h"]   # candle n-1 just closed
+        for pair in pairs:
+            ctx.observe(pair, "1h", series[pair][n - window:n])
+        ctx.publish("1h")
+    return candle_close
+
+
+def bench_context(counts, repeat, window=300):
+    """MarketContext on one timeframe, the live path of a candle close: every symbol observed, one publish."""
+    from context import MarketContext, BUDGET_MS
+    results = []
+    for count in counts:
+        series = context_market(count, window, repeat + 2)
+        ctx = MarketContext(window=100, reference="SYM0USDT")
+        samples = measure(context_closes(ctx, series, window), repeat)
+        results.append(summarize("context_candle_close", {"symbols": count}, samples, count))
+        publish = measure(lambda: ctx.publish("1h"), repeat)
+        results.append(summarize("context_publish", {"symbols": count}, publish, count))
+        p50 = float(np.median(samples)) * 1000
+        print(f"[context] {count} symbols: close {p50:.2f}ms (budget {BUDGET_MS}ms at 500"
+              f"{', OVER' if count <= 500 and p50 > BUDGET_MS else ''}), "
+              f"publish {np.median(publish) * 1000:.2f}ms")
+    return results
+
+
+# ---------------- checks (bench.py --check) ----------------
+def check_engine_parity(candles=1500, window=300, seed=0, tolerance=1e-6):
+    """
+    Incremental engine fed through EngineRegistry.sync on sliding windows, as the bot does,
+    against compute_indicators (`ta`) on each window: every column must match within
+    tolerance and the label/strength must be the same in every window. Returns (ok, report lines).
+    """
+    from indicators import EngineRegistry, COLUMNS, max_rel_diff
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, candles)))
+    wick = close * rng.uniform(0, 0.005, candles)
+    frame = pd.DataFrame({"open_time": np.arange(candles, dtype=np.int64) * 3_600_000,
+                          "open": np.r_[close[0], close[:-1]], "high": close + wick, "low": close - wick,
+                          "close": close, "volume": rng.uniform(10, 100, candles)})
+    engines = EngineRegistry()
+    worst = dict.fromkeys(COLUMNS, 0.0)
+    labels = 0
+    for end in range(window, candles + 1):
+        df = frame.iloc[end - window:end].reset_index(drop=True)
+        eng = engines.sync("X", "1h", df)
+        ind = compute_indicators(df)
+        mine = eng.annotate(df)
+        for name in COLUMNS:
+            for row in (-1, -2):
+                worst[name] = max(worst[name], max_rel_diff({name: mine[name].iloc[row]}, ind.iloc[row], [name]))
+        labels += analyze_df_for_pair(df, "X", "1h", engine=eng)[:2] != analyze_df_for_pair(df, "X", "1h")[:2]
+    over = [name for name in COLUMNS if worst[name] > tolerance]
+    lines = [f"[check] engine vs ta over {candles - window + 1} sliding {window}-row windows "
+             f"(last two rows, tolerance {tolerance:.0e}):"]
+    lines += [f"  {name:12s} max rel diff {worst[name]:.2e}{'  OVER' if name in over else ''}" for name in COLUMNS]
+    lines.append(f"  label/strength differs in {labels} windows{'  FAIL' if labels else ''}")
+    return not over and not labels, lines
+
+
+def check_stream_no_rest():
+    """A kline close merged from the stream must leave the next fetch of that series without REST calls."""
+    import types
+    import json as _json
+    import candles
+    from resample import Resampler
+    from stream import KlineStream
+    clock = [time.time()]
+    real_time = candles.time
+    candles.time = types.SimpleNamespace(time=lambda: clock[0])   # the store's clock: candles really close
+    try:
+        market = SyntheticMarket(seed=8, clock=lambda: clock[0])
+        calls = []
+
+        def fetch(symbol, interval, limit, start_time=None):
+            calls.append((symbol, interval))
+            return market.rows(symbol, interval, limit=limit, start_time=start_time)
+
+        store = candles.CandleStore(fetch, min_refresh=5)
+        source = Resampler(store, base="5m")
+        stream = KlineStream(store)
+        lines, ok = ["[check] stream-fed series skip REST:"], True
+        for interval in ("5m", "1h"):
+            source.get("BTCUSDT", interval, 300)
+            last = store.peek("BTCUSDT", interval, 1)[-1]
+            clock[0] = last[6] / 1000 + 1.0          # the open candle has just closed
+            t, o, h, l, c, v, ct = market.ohlcv("BTCUSDT", interval, last[0] // candles.INTERVAL_MS[interval],
+                                                last[0] // candles.INTERVAL_MS[interval])
+            k = {"s": "BTCUSDT", "i": interval, "t": int(t[0]), "T": int(ct[0]), "o": str(o[0]), "h": str(h[0]),
+                 "l": str(l[0]), "c": str(c[0]), "v": str(v[0]), "x": True}
+            stream.handle_frame(_json.dumps({"data": {"e": "kline", "k": k}}))
+            before = len(calls)
+            rows = source.get("BTCUSDT", interval, 300)
+            n = len(calls) - before
+            ok = ok and n == 0 and rows[-1][0] == last[0]
+            lines.append(f"  {interval}: {n} REST calls after the close ({'ok' if n == 0 else 'FAIL'})")
+        return ok, lines
+    finally:
+        candles.time = real_time
+
+
+def check_nearest_levels(markets=40, probes=200, seed=3):
+    """LevelIndex nearest-level queries (bisection) against a brute-force scan over real level sets."""
+    from levels import LevelIndex
+    rng = np.random.default_rng(seed)
+    wrong = queries = 0
+    for m in range(markets):
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, 300)))
+        idx = LevelIndex()
+        idx.update(np.arange(300, dtype=np.int64), close)
+        levels = [(lv, "support") for lv in idx.supports] + [(lv, "resistance") for lv in idx.resistances]
+        for price in np.r_[rng.uniform(close.min() * 0.9, close.max() * 1.1, probes), idx.supports, idx.resistances]:
+            queries += 1
+            got_s, got_r = idx.nearest_support(price), idx.nearest_resistance(price)
+            want_s = min(idx.supports, key=lambda x: abs(x - price), default=None)
+            want_r = min(idx.resistances, key=lambda x: abs(x - price), default=None)
+            level, side = idx.nearest(price)
+            want = min(levels, key=lambda lv: abs(lv[0] - price), default=(None, None))
+            same_distance = level is not None and abs(level - price) == abs(want[0] - price)
+            wrong += (got_s != want_s or got_r != want_r or not (level == want[0] or same_distance))
+    return not wrong, [f"[check] nearest levels vs brute force: {queries} queries, {wrong} wrong"]
+
+
+def check_context(symbols=500, window=300, closes=5):
+    """
+    MarketContext live path: a candle close of `symbols` (observe each + publish) within
+    context.BUDGET_MS, and the published contexts don't depend on the order symbols arrive in.
+    """
+    from context import MarketContext, BUDGET_MS
+    series = context_market(symbols, window, closes + 2)
+    ctx = MarketContext(window=100, reference="SYM0USDT")
+    p50 = float(np.median(measure(context_closes(ctx, series, window), closes))) * 1000
+    # same closes, symbols observed in reverse order
+    ctx2 = MarketContext(window=100, reference="SYM0USDT")
+    play = context_closes(ctx2, series, window, order=list(series)[::-1])
+    for _ in range(closes + 1):
+        play()
+    a = np.array([ctx.context(s, "1h") for s in series], dtype=float)
+    b = np.array([ctx2.context(s, "1h") for s in series], dtype=float)
+    same = a.shape == b.shape and np.allclose(a, b, equal_nan=True)
+    ok = p50 <= BUDGET_MS and same
+    return ok, [f"[check] market context, {symbols} symbols: close {p50:.2f}ms (budget {BUDGET_MS}ms)"
+                f"{'' if p50 <= BUDGET_MS else '  OVER'}, observe order {'irrelevant' if same else 'CHANGES contexts'}"]
+
+
+def check_webhook_secret():
+    """The webhook answers 403 to a missing or wrong secret header, accepts the right one, won't run without one."""
+    import urllib.request
+    import urllib.error
+    from dispatch import WebhookServer
+
+    class Sink:
+        def submit(self, key, update):
+            return True
+
+    try:
+        WebhookServer(Sink(), 0, "")
+        refused = False
+    except ValueError:
+        refused = True
+    server = WebhookServer(Sink(), 0, "s3cret").start()
+    statuses = {}
+    try:
+        for name, token in (("missing", None), ("wrong", "guess"), ("right", "s3cret")):
+            req = urllib.request.Request(f"http://127.0.0.1:{server.port}/telegram", data=b'{"update_id": 1}',
+                                         method="POST")
+            if token is not None:
+                req.add_header("X-Telegram-Bot-Api-Secret-Token", token)
+            try:
+                statuses[name] = urllib.request.urlopen(req, timeout=5).status
+            except urllib.error.HTTPError as e:
+                statuses[name] = e.code
+    finally:
+        server.stop()
+    ok = refused and statuses == {"missing": 403, "wrong": 403, "right": 200}
+    return ok, [f"[check] webhook secret: missing header {statuses['missing']}, wrong {statuses['wrong']}, "
+                f"right {statuses['right']}, no secret {'refused' if refused else 'ACCEPTED'}"]
+
+
+def check_governor_half_open():
+    """
+    A 200 whose body doesn't decode during the half-open trial is a failure: the breaker opens
+    again (not closed by a bogus success), and the next trial after open_for goes through.
+    """
+    import json as _json
+    from governor import BinanceClient, BinanceError, CircuitOpen
+
+    class Resp:
+        def __init__(self, status, text):
+            self.status_code, self.text, self.headers = status, text, {}
+
+        def json(self):
+            return _json.loads(self.text)
+
+    class Session:
+        def __init__(self, responses):
+            self.responses = list(responses)
+
+        def get(self, url, params=None, timeout=None):
+            return self.responses.pop(0)
+
+    now = [1000.0]
+    client = BinanceClient(retries=0, failure_threshold=2, open_for=10, clock=lambda: now[0], sleep=lambda s: None)
+    client.session = Session([Resp(500, "down"), Resp(500, "down"), Resp(200, '[{"torn'), Resp(200, "[]")])
+    steps = []
+    for advance in (0, 0, 11, 0, 11):
+        now[0] += advance
+        try:
+            client.ping()
+            steps.append("ok")
+        except CircuitOpen:
+            steps.append("circuit open")
+        except BinanceError as e:
+            steps.append(f"HTTP {e.status}")
+        except Exception as e:
+            steps.append(type(e).__name__)
+    ok = steps == ["HTTP 500", "HTTP 500", "HTTP 200", "circuit open", "ok"] and not client._trial
+    return ok, [f"[check] governor half-open decode error: {' -> '.join(steps)}{'' if ok else '  FAIL'}"]
+
+
+CHECKS = [check_engine_parity, check_stream_no_rest, check_nearest_levels, check_context, check_webhook_secret,
+          check_governor_half_open]
+
+
+# ---------------- baseline comparison ----------------
+def _key(r):
+    return r["name"] + json.dumps(r["params"], sort_keys=True)
+
+
+def compare(results, baseline, tolerance):
+    """Returns list of (name, params, base_p50, new_p50, ratio) slower than baseline by > tolerance."""
+    base = {_key(r): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        b = base.get(_key(r))
+        if b and b["p50_ms"] > 0:
+            ratio = r["p50_ms"] / b["p50_ms"]
+            r["vs_base"] = ratio
+            if ratio > 1 + tolerance:
+                regressions.append((r["name"], r["params"], b["p50_ms"], r["p50_ms"], ratio))
+    return regressions
+
+
+def print_table(results):
+    print(f"{'benchmark':<26}{'params':<30}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'items/s':>14}{'vs base':>9}")
+    for r in results:
+        params = ",".join(f"{k}={v}" for k, v in r["params"].items())
+        vs = f"{r['vs_base']:.2f}x" if "vs_base" in r else ""
+        print(f"{r['name']:<26}{params:<30}{r['p50_ms']:>10.3f}{r['p90_ms']:>10.3f}{r['p99_ms']:>10.3f}"
+              f"{r['throughput']:>14,.0f}{vs:>9}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Offline benchmarks for the analysis hot path")
+    ap.add_argument("--full", action="store_true", help="sweep windows to 100k and symbols to 1000")
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--only", help="comma list of groups: window,symbols,scan,fanout,touches,governor,shards,context")
+    ap.add_argument("--save", help="write results JSON (baseline)")
+    ap.add_argument("--compare", help="baseline JSON to compare p50 against")
+    ap.add_argument("--tolerance", type=float, default=0.15, help="allowed p50 slowdown vs baseline")
+    ap.add_argument("--check", action="store_true", help="only run the correctness checks (exit 1 on a failure)")
+    args = ap.parse_args(argv)
+
+    if args.check:
+        failed = 0
+        for check in CHECKS:
+            ok, lines = check()
+            print("\n".join(lines))
+            failed += not ok
+        return 1 if failed else 0
+
+    windows = [300, 1000, 10000, 100000] if args.full else [300, 1000, 10000]
+    symbols = [9, 100, 1000] if args.full else [9, 100]
+    scan_symbols = [9, 100] if args.full else [9]
+    fanout_chats = [100, 1000, 5000] if args.full else [100, 2000]
+    touch_symbols = [10, 100, 500] if args.full else [10, 100]
+    shard_symbols = [100, 500] if args.full else [100]
+    context_symbols = [100, 500, 1000] if args.full else [100, 500]
+    groups = set((args.only or "window,symbols,scan,fanout,touches,governor,shards,context").split(","))
+    market = SyntheticMarket(seed=0)
+
+    results = []
+    if "window" in groups:
+        results += bench_window(market, windows, args.repeat)
+    if "symbols" in groups:
+        results += bench_symbols(market, symbols, args.repeat)
+    if "scan" in groups:
+        results += bench_auto_scan(scan_symbols, args.repeat)
+    if "fanout" in groups:
+        results += bench_fanout(fanout_chats, args.repeat)
+    if "touches" in groups:
+        results += bench_touches(touch_symbols, args.repeat)
+    if "governor" in groups:
+        results += bench_governor(args.repeat)
+    if "shards" in groups:
+        results += bench_shards(shard_symbols, args.repeat)
+    if "context" in groups:
+        results += bench_context(context_symbols, args.repeat)
+
+    status = 0
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, params, b, n, ratio in regressions:
+            print(f"REGRESSION {name} {params}: p50 {b:.3f}ms -> {n:.3f}ms ({ratio:.2f}x)")
+        status = 1 if regressions else 0
+    print_table(results)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                       "created": int(time.time()), "results": results}, f, indent=1)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
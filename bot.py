@@ -1,444 +1,623 @@
 # bot.py — финальный: Manual / Auto / Scalp / Levels + красивые карточки (no images)
 import os
+import sys
 import time
 import threading
 import traceback
 import math
-import requests
+from urllib.parse import urlparse
+import atexit
+import signal
+from concurrent.futures import ThreadPoolExecutor
 import telebot
 from telebot import apihelper
-from binance.client import Client
-import pandas as pd
-import numpy as np
-import ta
-import schedule
+from metrics import stats
+from governor import BinanceClient
+from candles import CandleStore, INTERVAL_MS
+from klines import Klines
+from cache import ResultCache
+from resample import Resampler
+from subscriptions import SubscriptionRegistry
+from universe import Universe
+from scheduler import CandleScheduler, last_close
+from outbox import Outbox, PRIO_INTERACTIVE, PRIO_SCALP, PRIO_LEVELS, PRIO_SELECTED, PRIO_AUTO
+from store import KlineStore
+from stream import KlineStream, TickStream
+from touches import TouchEngine
+from shards import ShardPool, ShardError
+from context import MarketContext
+from dispatch import UpdateDispatcher, WebhookServer
+from indicators import EngineRegistry, IndicatorEngine
+from levels import LevelRegistry, LevelIndex
+import snapshot
+import params as signal_params
+from analysis import analyze_df_for_pair
 
 # ---------------- Config ----------------
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN") or os.getenv("BOT_TOKEN") or os.getenv("BOT")
 if not TELEGRAM_TOKEN:
     raise RuntimeError("TELEGRAM_TOKEN / BOT_TOKEN not set in env")
 
+# WEBHOOK_PORT: take updates from a Telegram webhook on this port instead of long polling.
+# WEBHOOK_URL is the public https address to register with Telegram (unset: registered elsewhere, e.g. behind
+# a proxy or a local stub); its path is the one served. Updates run on UPDATE_WORKERS threads, in order per chat.
+# WEBHOOK_SECRET is required (Telegram sends it with every update, anything without it gets 403);
+# WEBHOOK_HOST is the listen address, local by default (a proxy in front), 0.0.0.0 to take them directly.
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "0"))
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+if WEBHOOK_PORT and not WEBHOOK_SECRET:
+    raise RuntimeError("WEBHOOK_SECRET not set in env (required with WEBHOOK_PORT)")
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))
+
 # increase Telegram session timeout to reduce ReadTimeouts
 apihelper.SESSION_TIMEOUT = 60
-bot = telebot.TeleBot(TELEGRAM_TOKEN)
+# in webhook mode handlers run on our update dispatcher, not on telebot's own worker threads
+bot = telebot.TeleBot(TELEGRAM_TOKEN, threaded=not WEBHOOK_PORT)
+
+# Binance public REST (no API keys required for klines) through the request governor:
+# weight budget from X-MBX-USED-WEIGHT headers, shared in-flight calls, 429/418 backoff, circuit breaker.
+# Built on first use so importing the bot stays cheap; tests swap in a fake with client.use().
+BINANCE_API_URL = os.getenv("BINANCE_API_URL", "https://api.binance.com")
+BINANCE_WEIGHT_LIMIT = int(os.getenv("BINANCE_WEIGHT_LIMIT", "6000"))   # per minute per IP
+
+def api_state_changed(is_open, reason):
+    if is_open:
+        safe_send(USER_CHAT_ID, f"⚠️ Binance API на паузе: {reason}")
+    else:
+        safe_send(USER_CHAT_ID, "✅ Binance API снова доступен")
+
+class LazyClient:
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    def use(self, real):
+        self._client = real
 
-# Binance public client (no API keys required for klines)
-client = Client()
+    def __getattr__(self, name):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    real = BinanceClient(BINANCE_API_URL, weight_limit=BINANCE_WEIGHT_LIMIT,
+                                         pool_size=AUTO_SCAN_WORKERS + 4, on_state=api_state_changed)
+                    self._client = recorder.client(real) if recorder else real
+        return getattr(self._client, name)
+
+client = LazyClient()
 
 # only you (change if needed)
 USER_CHAT_ID = 1217715528
 
-# pairs and allowed timeframes
-PAIRS = ["BTCUSDT","ETHUSDT","BNBUSDT","XRPUSDT","ADAUSDT","DOGEUSDT","SOLUSDT","MATICUSDT","DOTUSDT"]
-TIMEFRAMES = {"5m":"5m","15m":"15m","1h":"1h","4h":"4h","1d":"1d"}
-
-# state
-state = {
-    "mode": None,        # None / "manual" / "auto" / "scalp" / "levels"
-    "pair": None,
-    "timeframe": None,
-    "scalp_enabled": False,
-    "levels_enabled": False,
-}
-
-# weak signals control
+# pairs and auto-scan timeframes (the timeframe keyboard lists its own)
+PAIRS = ["BTCUSDT","ETHUSDT","BNBUSDT","XRPUSDT","ADAUSDT","DOGEUSDT","SOLUSDT","POLUSDT","DOTUSDT"]
+AUTO_SCAN_TFS = ["15m","1h","4h"]
+# auto mode scans the top UNIVERSE_TOP_N USDT symbols by 24h volume/volatility/change (0 = just PAIRS)
+UNIVERSE_TOP_N = int(os.getenv("UNIVERSE_TOP_N", "30"))
+UNIVERSE_MIN_QUOTE_VOLUME = float(os.getenv("UNIVERSE_MIN_QUOTE_VOLUME", "5000000"))
+UNIVERSE_REFRESH_TF = "1h"  # re-ranked on every 1h close
+AUTO_SCAN_WORKERS = int(os.getenv("AUTO_SCAN_WORKERS", "6"))  # concurrent fetch+analyze jobs per scan
+# SHARD_WORKERS=N: analyses run in N worker processes (candle windows handed over in shared memory),
+# so a scan uses N cores instead of one; fetching stays here. 0 = analyze in-process
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "0"))
+# market context (breadth, correlation/beta vs BTC) over the last CONTEXT_WINDOW closed candles of the
+# auto scan's pairs, computed once per close; weighs BUYs in a falling market and SELLs in a rising one.
+# Opt-in (e.g. 100); 0 = off
+CONTEXT_WINDOW = int(os.getenv("CONTEXT_WINDOW", "0"))
+# jobs fire at each candle close + CANDLE_SETTLE seconds (lets Binance publish the closed candle)
+CANDLE_SETTLE = float(os.getenv("CANDLE_SETTLE", "3"))
+LEVELS_POLL_TF = "1m"  # levels watch price inside the candle, so they poll on every 1m close
+
+# STREAM_MODE=1: keep candles current from Binance kline websockets and analyze on candle close
+STREAM_MODE = os.getenv("STREAM_MODE", "0") == "1"
+# LEVEL_TICKS=1: level alerts from the best bid/ask websocket (every quote is checked, wicks included);
+# levels are then recomputed on candle close instead of polling price every LEVELS_POLL_TF
+LEVEL_TICKS = os.getenv("LEVEL_TICKS", "0") == "1"
+LEVEL_TOUCH_COOLDOWN = int(os.getenv("LEVEL_TOUCH_COOLDOWN", str(30 * 60)))  # per level
+# INDICATOR_ENGINE=1: incremental per-(pair, tf) indicators instead of full `ta` recomputation
+USE_INDICATOR_ENGINE = os.getenv("INDICATOR_ENGINE", "1" if STREAM_MODE else "0") == "1"
+
+# other chats allowed to use the bot besides USER_CHAT_ID (comma-separated ids, "*" = anyone)
+ALLOWED_CHATS = {c.strip() for c in os.getenv("ALLOWED_CHATS", "").split(",") if c.strip()}
+
+# METRICS=1: per-stage timing, counters and scheduler lag; METRICS_PORT serves /metrics (Prometheus text)
+stats.enabled = os.getenv("METRICS", "0") == "1"
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# SNAPSHOT_PATH=file: warm state (chats, schedules, candles, indicator/level state) is saved there every 5m
+# and on exit, and restored at boot; unset = off. Snapshots older than SNAPSHOT_MAX_AGE seconds, or written
+# by a bot whose snapshotted classes differ, are ignored. The file is a pickle and loading it runs code:
+# keep it where only the bot's user can write it.
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "")
+SNAPSHOT_MAX_AGE = int(os.getenv("SNAPSHOT_MAX_AGE", str(24 * 60 * 60)))
+
+# RECORD_DIR: append every Binance REST response and outgoing message there (loadtest.py replays them)
+RECORD_DIR = os.getenv("RECORD_DIR", "")
+recorder = None
+if RECORD_DIR:
+    from loadtest import Recorder
+    recorder = Recorder(RECORD_DIR)
+
+# SIGNAL_PARAMS: JSON with scoring thresholds/weights and level settings (see params.py, sweep.py --save)
+SIGNAL_PARAMS = os.getenv("SIGNAL_PARAMS", "")
+if SIGNAL_PARAMS:
+    signal_params.use(signal_params.load(SIGNAL_PARAMS))
+    print(f"[params] loaded {SIGNAL_PARAMS}")
+
+# weak signals control (default for new chats; each chat toggles its own)
 SEND_WEAK_SIGNALS = False
-WEAK_SEND_COOLDOWN = 60 * 60  # 1 hour per (pair,tf)
-_last_weak_sent = {}  # {(pair,tf): timestamp}
-
-# small helper to throttle debug prints in heavy loops
-def now_ts():
-    return int(time.time())
+WEAK_SEND_COOLDOWN = 60 * 60  # 1 hour per (chat, pair, tf)
 
 # ---------------- Safe send ----------------
-def safe_send(chat_id, text, max_retries=3, delay=4):
-    """Send message with retries on transient errors (timeout etc)."""
-    for attempt in range(1, max_retries+1):
+# outgoing messages go through a queue drained by its own worker (retries, 429 retry_after, pacing)
+def _send_message(chat_id, text, edit_message_id=None, **kw):
+    if edit_message_id is not None:
+        return bot.edit_message_text(text, chat_id, edit_message_id, **kw)
+    return bot.send_message(chat_id, text, **kw)
+
+outbox = Outbox(recorder.sends(_send_message) if recorder else _send_message,
+                per_chat_interval=1.0, global_rate=25, coalesce_delay=2.0, max_retries=3, retry_delay=4)
+
+def safe_send(chat_id, text, priority=PRIO_INTERACTIVE, coalesce=None, **kwargs):
+    """
+    Queue a message (non-blocking). Higher priority (lower number) goes first;
+    messages with the same coalesce key for a chat are merged into one digest.
+    kwargs go to bot.send_message (e.g. reply_markup); edit_message_id=... edits that message instead.
+    """
+    return outbox.put(chat_id, text, priority=priority, coalesce=coalesce, **kwargs)
+
+# first analyses requested from the menu run here, so handlers answer at once
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "4"))
+analysis_pool = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="analysis")
+
+def reply_later(chat_id, placeholder, work):
+    """
+    Acknowledge with `placeholder` now, run work() -> text on analysis_pool and edit
+    the placeholder into that text (sent as a new message if the placeholder wasn't).
+    """
+    lock = threading.Lock()
+    state = {}
+
+    def finish(msg, text):
+        message_id = getattr(msg, "message_id", None)
+        if message_id is None:
+            safe_send(chat_id, text)
+        else:
+            safe_send(chat_id, text, edit_message_id=message_id)
+
+    def arrived(key, value):
+        with lock:
+            state[key] = value
+            ready = len(state) == 2
+        if ready:
+            finish(state["msg"], state["text"])
+
+    def run():
+        t0 = stats.clock()
         try:
-            bot.send_message(chat_id, text)
-            return True
-        except requests.exceptions.ReadTimeout:
-            print(f"[safe_send] ReadTimeout attempt {attempt}, retry in {delay}s")
-            time.sleep(delay)
+            text = work()
         except Exception as e:
-            print(f"[safe_send] Exception while sending (attempt {attempt}): {e}")
-            time.sleep(delay)
-    print("[safe_send] Failed to send message after retries.")
-    return False
+            stats.inc("errors", stage="reply_later")
+            traceback.print_exc()
+            text = f"❌ Ошибка анализа: {e}"
+        stats.observe("reply_later", t0)
+        arrived("text", text)
+
+    safe_send(chat_id, placeholder, on_sent=lambda msg: arrived("msg", msg))
+    analysis_pool.submit(run)
 
 # ---------------- Data fetch ----------------
+def _get_klines_raw(symbol, interval, limit, start_time=None):
+    params = {"symbol": symbol, "interval": interval, "limit": limit}
+    if start_time is not None:
+        params["startTime"] = start_time
+    t0 = stats.clock()
+    try:
+        rows = client.get_klines(**params)
+    except Exception:
+        stats.inc("errors", stage="kline_fetch")
+        raise
+    stats.observe("kline_fetch", t0, symbol, interval)
+    return rows
+
+def api_note():
+    """Suffix for "could not load" replies while the governor holds requests back."""
+    retry_in = getattr(client, "retry_in", None)
+    wait = retry_in() if retry_in else 0
+    return f" (Binance API на паузе ещё {wait:.0f} с)" if wait else ""
+
+# optional on-disk history (KLINE_STORE_DIR): warm starts read from it, closed candles are appended
+KLINE_STORE_DIR = os.getenv("KLINE_STORE_DIR")
+kline_history = KlineStore(KLINE_STORE_DIR) if KLINE_STORE_DIR else None
+
+# history is loaded once per (pair, tf), then only new/open candles are fetched
+# modes hitting the same series within a few seconds (same candle close) share one fetch
+# room for base + derived series of every scanned symbol, so the LRU doesn't thrash
+candle_store = CandleStore(_get_klines_raw, max_len=1000, max_series=max(64, (UNIVERSE_TOP_N + len(PAIRS)) * 5),
+                           history=kline_history, min_refresh=5)
+# RESAMPLE_BASE (default 5m): 15m/1h/4h/1d are rebuilt from the base series after their first load; "" disables
+RESAMPLE_BASE = os.getenv("RESAMPLE_BASE", "5m")
+klines_source = Resampler(candle_store, base=RESAMPLE_BASE) if RESAMPLE_BASE else candle_store
+kline_stream = KlineStream(candle_store, base_url=os.getenv("BINANCE_WS_URL", "wss://stream.binance.com:9443"))
+
 def fetch_klines(symbol, interval, limit=300):
-    """Get klines from Binance public endpoint and return DataFrame or None."""
+    """Get klines (via incremental candle store) as a Klines column set, or None. .to_frame() for pandas."""
     try:
-        klines = client.get_klines(symbol=symbol, interval=interval, limit=limit)
-        df = pd.DataFrame(klines, columns=[
-            "open_time","open","high","low","close","volume","close_time","quote_av","trades","tb_base_av","tb_quote_av","ignore"
-        ])
-        df = df.astype({"open": float, "high": float, "low": float, "close": float, "volume": float})
-        return df
+        rows = klines_source.get(symbol, interval, limit=limit)
+        t0 = stats.clock()
+        k = Klines.from_rows(rows)
+        stats.observe("parse", t0, symbol, interval)
+        return k
     except Exception as e:
+        stats.inc("errors", stage="fetch_klines")
         print(f"[fetch_klines] error {symbol} {interval}: {e}")
         return None
 
-# ---------------- Indicators & helpers ----------------
-def compute_indicators(df):
-    d = df.copy()
-    # EMA
-    d["ema20"] = ta.trend.EMAIndicator(d["close"], window=20).ema_indicator()
-    d["ema50"] = ta.trend.EMAIndicator(d["close"], window=50).ema_indicator()
-    d["ema200"] = ta.trend.EMAIndicator(d["close"], window=200).ema_indicator()
-    # RSI
-    d["rsi"] = ta.momentum.RSIIndicator(d["close"], window=14).rsi()
-    # MACD
-    macd = ta.trend.MACD(d["close"], window_slow=26, window_fast=12, window_sign=9)
-    d["macd"] = macd.macd()
-    d["macd_signal"] = macd.macd_signal()
-    # ATR and volume MA
-    d["atr"] = ta.volatility.AverageTrueRange(d["high"], d["low"], d["close"], window=14).average_true_range()
-    d["vol_ma20"] = d["volume"].rolling(20).mean()
-    return d
-
-def detect_macd_cross(df):
-    if len(df) < 2: return None
-    p, l = df.iloc[-2], df.iloc[-1]
-    if p["macd"] < p["macd_signal"] and l["macd"] > l["macd_signal"]: return "up"
-    if p["macd"] > p["macd_signal"] and l["macd"] < l["macd_signal"]: return "down"
-    return None
-
-def detect_ema20_50_cross(df):
-    if len(df) < 2: return None
-    p, l = df.iloc[-2], df.iloc[-1]
-    if p["ema20"] <= p["ema50"] and l["ema20"] > l["ema50"]: return "up"
-    if p["ema20"] >= p["ema50"] and l["ema20"] < l["ema50"]: return "down"
-    return None
-
-# ---------------- Levels (support/resistance) ----------------
-def find_local_extrema(series, order=3):
-    """Simple local minima/maxima finder. order=bars to each side."""
-    minima = []
-    maxima = []
-    n = len(series)
-    for i in range(order, n-order):
-        window = series[i-order:i+order+1]
-        val = series[i]
-        if val == window.min():
-            minima.append((i, val))
-        if val == window.max():
-            maxima.append((i, val))
-    return minima, maxima
-
-def cluster_levels(values, threshold=0.005):
-    """
-    Cluster similar levels (values list) into representative levels.
-    threshold — relative distance (e.g., 0.005 = 0.5%).
-    """
-    if not values:
-        return []
-    vals = sorted(values)
-    clusters = []
-    current = [vals[0]]
-    for v in vals[1:]:
-        if abs(v - current[-1]) / current[-1] <= threshold:
-            current.append(v)
-        else:
-            clusters.append(current)
-            current = [v]
-    clusters.append(current)
-    centers = [sum(c)/len(c) for c in clusters]
-    return centers
+indicator_engines = EngineRegistry()
+# support/resistance per (pair, tf), updated incrementally as candles close
+level_indexes = LevelRegistry(order=signal_params.current["level_order"],
+                              cluster_threshold=signal_params.current["level_cluster"])
 
-def get_levels_from_df(df, order=4, cluster_threshold=0.006):
-    """
-    Return (supports, resistances) — lists of levels (floats).
-    order: window for local extrema
-    cluster_threshold: clustering threshold (relative)
-    """
-    closes = df["close"].values
-    minima, maxima = find_local_extrema(closes, order=order)
-    min_vals = [v for i,v in minima]
-    max_vals = [v for i,v in maxima]
-    supports = cluster_levels(min_vals, threshold=cluster_threshold)
-    resistances = cluster_levels(max_vals, threshold=cluster_threshold)
-    # sort supports ascending, resistances descending
-    supports.sort()
-    resistances.sort(reverse=True)
-    return supports, resistances
-
-# ---------------- Core analysis (BUY/SELL/HOLD + strength) ----------------
-def analyze_df_for_pair(df, pair_display=None, tf_display=None, scalp_mode=False, levels_mode=False):
+# started by start_bot (never at import: spawned workers import this module too)
+shard_pool = None
+
+def start_shards():
+    global shard_pool
+    shard_pool = ShardPool(SHARD_WORKERS, slots=candle_store.max_series, max_len=candle_store.max_len,
+                           params=signal_params.current, use_engine=USE_INDICATOR_ENGINE).start()
+    atexit.register(shard_pool.stop)
+    print(f"[shards] {SHARD_WORKERS} analysis worker processes")
+
+def analyze_pair(df, pair, tf, **kwargs):
+    """analyze_df_for_pair on a shard worker, or here, fed by the incremental indicator engine when enabled."""
+    if shard_pool is not None and kwargs.get("known_levels") is None:
+        try:
+            return shard_pool.analyze(pair, tf, df, **kwargs)
+        except ShardError as e:
+            print(f"[shards] {pair} {tf}: {e}; analyzing in-process")
+    engine = indicator_engines.sync(pair, tf, df) if USE_INDICATOR_ENGINE else None
+    return analyze_df_for_pair(df, pair, tf, engine=engine, **kwargs)
+
+# cross-pair context, fed with the auto scan's windows and published once per close (update_context)
+market_context = MarketContext(window=CONTEXT_WINDOW) if CONTEXT_WINDOW else None
+
+# results shared by auto/selected/scalp/levels: one analysis per (pair, tf, candle state, options)
+analysis_cache = ResultCache(max_entries=256, ttl=15 * 60)
+
+def analyze_cached(df, pair, tf, scalp_mode=False, levels_mode=False, known_levels=None):
     """
-    returns (label, strength, report_text, details_dict)
-    label: "BUY"/"SELL"/"HOLD"
-    strength: 0..3 -> map later to stars
-    details_dict: useful info (levels if computed)
+    analyze_pair through analysis_cache; the key covers the last candle, so an updated open candle misses,
+    and the published market context version, so a result never outlives the context it was scored with.
     """
-    try:
-        df = compute_indicators(df)
-        if len(df) < 30:
-            return "HOLD", 0, f"Недостаточно данных для анализа (len={len(df)})", {}
-
-        last = df.iloc[-1]
-        prev = df.iloc[-2] if len(df) >= 2 else last
-
-        price = last["close"]
-        ema20 = last["ema20"]; ema50 = last["ema50"]; ema200 = last["ema200"]
-        rsi = last["rsi"]; macd = last["macd"]; macd_sig = last["macd_signal"]
-        atr = last["atr"]; vol = last["volume"]; vol_ma = last["vol_ma20"]
-
-        trend_up = (ema20 > ema50) and (ema50 > ema200)
-        trend_down = (ema20 < ema50) and (ema50 < ema200)
-
-        macd_cross = detect_macd_cross(df)
-        ema_cross = detect_ema20_50_cross(df)
-
-        vol_ok = (vol_ma is not None) and (not np.isnan(vol_ma)) and (vol > vol_ma)
-        price_above_ema20 = price > ema20
-        price_below_ema20 = price < ema20
-
-        # RSI thresholds (we keep moderately strict for strong)
-        rsi_buyish = rsi < 45
-        rsi_strong_buy = rsi < 35
-        rsi_sellish = rsi > 55
-        rsi_strong_sell = rsi > 65
-
-        buy_score = 0.0
-        sell_score = 0.0
-
-        # Trend weight
-        if trend_up: buy_score += 1.0
-        if trend_down: sell_score += 1.0
-
-        # EMA cross weight
-        if ema_cross == "up": buy_score += 1.0
-        if ema_cross == "down": sell_score += 1.0
-
-        # MACD cross weight
-        if macd_cross == "up": buy_score += 1.0
-        if macd_cross == "down": sell_score += 1.0
-
-        # RSI weight
-        if rsi_strong_buy: buy_score += 1.0
-        elif rsi_buyish: buy_score += 0.5
-        if rsi_strong_sell: sell_score += 1.0
-        elif rsi_sellish: sell_score += 0.5
-
-        # Volume & price confirmation
-        if vol_ok and price_above_ema20: buy_score += 0.7
-        if vol_ok and price_below_ema20: sell_score += 0.7
-
-        # Map scores to strength 0..3
-        def to_strength(score):
-            if score >= 4: return 3
-            if score >= 2: return 2
-            if score > 0: return 1
-            return 0
-
-        b_str = to_strength(buy_score)
-        s_str = to_strength(sell_score)
-
-        if b_str > s_str and b_str > 0:
-            label = "BUY"; strength = b_str
-        elif s_str > b_str and s_str > 0:
-            label = "SELL"; strength = s_str
-        else:
-            label = "HOLD"; strength = 0
-
-        # compute levels optionally
-        levels = {}
-        if levels_mode:
-            supports, resistances = get_levels_from_df(df, order=4, cluster_threshold=0.006)
-            levels["supports"] = supports
-            levels["resistances"] = resistances
-
-            # extra logic: if price near support/resistance, may increase strength
-            # near = within atr*0.7 relative or within 0.5% absolute approx
-            def near_level(level):
-                # use absolute or relative threshold based on ATR
-                if math.isnan(atr) or atr == 0:
-                    rel = abs(price - level) / level
-                    return rel < 0.004  # 0.4%
-                else:
-                    return abs(price - level) <= 0.7 * atr
-            # if price near top resistance and label SELL, bump strength if possible
-            for r in levels["resistances"][:3]:
-                if near_level(r) and label == "SELL":
-                    strength = max(strength, min(3, strength+1))
-            for s in levels["supports"][:3]:
-                if near_level(s) and label == "BUY":
-                    strength = max(strength, min(3, strength+1))
-
-        # Prepare report text (card)
-        stars_map = {0: "—", 1: "⭐", 2: "⭐⭐", 3: "⭐⭐⭐"}
-        strength_name = {0: "HOLD", 1: "Weak", 2: "Medium", 3: "Strong"}[strength]
-        emoji_label = "🟢 BUY" if label == "BUY" else ("🔴 SELL" if label == "SELL" else "⚪ HOLD")
-
-        report_lines = []
-        report_lines.append("━━━━━━━━━━━━━━━━━━━━━━━━")
-        report_lines.append(f"📊 Пара: {pair_display or state.get('pair','?')}")
-        report_lines.append(f"⏱ Таймфрейм: {tf_display or state.get('timeframe','?')}")
-        report_lines.append("")
-        report_lines.append(f"{emoji_label}  ({strength_name})")
-        report_lines.append(f"💵 Цена: {price:.6f}")
-        report_lines.append("")
-        # include top 1 support/resistance if present
-        if levels_mode and levels.get("supports"):
-            report_lines.append(f"📈 Поддержка: {levels['supports'][0]:.6f}")
-        if levels_mode and levels.get("resistances"):
-            report_lines.append(f"📉 Сопротивление: {levels['resistances'][0]:.6f}")
-        report_lines.append("")
-        report_lines.append("🔎 Индикаторы:")
-        report_lines.append(f"• EMA20: {ema20:.6f} | EMA50: {ema50:.6f} | EMA200: {ema200:.6f}")
-        rsi_status = f"RSI = {rsi:.2f}"
-        report_lines.append(f"• {rsi_status} | MACD = {macd:.6f} | Signal = {macd_sig:.6f}")
-        report_lines.append(f"• ATR = {atr:.6f} | Vol = {vol:.4f} | VolMA20 = {vol_ma:.4f}")
-        report_lines.append("")
-        # star rating 1..5 (map strength 0..3 -> 1..5 scale)
-        # 0->1,1->3,2->4,3->5
-        if strength == 0:
-            stars = "⚪ No signal"
-            score_val = "0/5"
+    last = df.iloc[-1]
+    context, version = None, None
+    if market_context is not None:
+        version = market_context.version(tf)
+        context = market_context.context(pair, tf)
+    key = (pair, tf, len(df), int(last["close_time"]), float(last["close"]), float(last["volume"]),
+           scalp_mode, levels_mode, version)
+    return analysis_cache.get(key, lambda: analyze_pair(df, pair, tf, scalp_mode=scalp_mode, levels_mode=levels_mode,
+                                                          known_levels=known_levels, context=context))
+
+# ---------------- Subscriptions ----------------
+# every chat has its own mode/pair/tf and weak setting; each (pair, tf) is analyzed once and fanned out
+subs = SubscriptionRegistry([(p, t) for p in PAIRS for t in AUTO_SCAN_TFS],
+                            weak_cooldown=WEAK_SEND_COOLDOWN, default_weak=SEND_WEAK_SIGNALS)
+
+def allowed(chat_id):
+    return chat_id == USER_CHAT_ID or "*" in ALLOWED_CHATS or str(chat_id) in ALLOWED_CHATS
+
+def deliver_signal(kind, pair, tf, result, prefix, weak_prefix, priority, coalesce=None):
+    """Send a BUY/SELL result to every subscriber of (kind, pair, tf); weak ones only to chats that opted in."""
+    if result is None:
+        return 0
+    label, strength, report, details = result
+    if label not in ("BUY","SELL") or strength < 1:
+        print(f"[{kind}] {pair} {tf} -> {label} (strength {strength})")
+        return 0
+    sent = 0
+    for chat_id in subs.subscribers(kind, pair, tf):
+        if strength >= 2:
+            safe_send(chat_id, prefix + report, priority=priority, coalesce=coalesce)
+        elif subs.should_send_weak(chat_id, kind, pair, tf):
+            safe_send(chat_id, weak_prefix + report, priority=priority, coalesce=coalesce)
         else:
-            map_to = {1: "★★★ (3/5)", 2: "★★★★ (4/5)", 3: "★★★★★ (5/5)"}
-            stars = map_to[strength]
-            score_val = map_to[strength].split("(")[1].strip(")")
-        report_lines.append(f"⭐ Оценка сигнала: {stars}")
-        report_lines.append("")
-        report_lines.append(f"Детали: trend_up={trend_up}, ema_cross={ema_cross}, macd_cross={macd_cross}, vol_ok={vol_ok}")
-        report_lines.append("━━━━━━━━━━━━━━━━━━━━━━━━")
-        report = "\n".join(report_lines)
-
-        details = {"price": price, "ema20": ema20, "ema50": ema50, "ema200": ema200,
-                   "rsi": rsi, "macd": macd, "macd_signal": macd_sig, "atr": atr, "vol": vol}
-        if levels_mode:
-            details["levels"] = levels
-        return label, strength, report, details
-    except Exception as e:
-        print("analyze_df_for_pair error:", e)
-        traceback.print_exc()
-        return "HOLD", 0, f"Ошибка анализа: {e}", {}
-
-# ---------------- Weak throttling ----------------
-def should_send_weak(pair, tf):
-    key = (pair, tf)
-    last = _last_weak_sent.get(key)
-    if last is None:
-        _last_weak_sent[key] = time.time()
-        return True
-    if time.time() - last > WEAK_SEND_COOLDOWN:
-        _last_weak_sent[key] = time.time()
-        return True
-    return False
+            continue
+        sent += 1
+    return sent
 
 # ---------------- Tasks: selected/auto/scalp/levels ----------------
-def first_analysis_selected():
-    pair = state.get("pair"); tf = state.get("timeframe")
+def first_analysis_selected(chat_id):
+    st = subs.chat(chat_id)
+    pair = st["pair"]; tf = st["timeframe"]
     if not pair or not tf:
         return
     df = fetch_klines(pair, tf, limit=300)
     if df is None:
-        safe_send(USER_CHAT_ID, f"❌ Не удалось загрузить данные для {pair} [{tf}]")
+        safe_send(chat_id, f"❌ Не удалось загрузить данные для {pair} [{tf}]" + api_note())
         return
-    label, strength, report, details = analyze_df_for_pair(df, pair, tf, levels_mode=state.get("levels_enabled", False))
-    safe_send(USER_CHAT_ID, report)
+    label, strength, report, details = analyze_cached(df, pair, tf, levels_mode=st["levels_enabled"])
+    safe_send(chat_id, report)
 
-def periodic_selected_check():
-    pair = state.get("pair"); tf = state.get("timeframe")
-    if not pair or not tf:
-        return
+def periodic_selected_check(pair, tf):
     df = fetch_klines(pair, tf, limit=300)
     if df is None:
         print(f"[periodic_selected_check] no data {pair} {tf}")
         return
-    label, strength, report, details = analyze_df_for_pair(df, pair, tf, levels_mode=state.get("levels_enabled", False))
-    if label in ("BUY","SELL"):
-        if strength >= 2:
-            safe_send(USER_CHAT_ID, "(Selected) " + report)
-        elif strength == 1 and SEND_WEAK_SIGNALS and should_send_weak(pair, tf):
-            safe_send(USER_CHAT_ID, "(Selected) ⚠ Weak:\n" + report)
-        else:
-            print(f"[selected {pair} {tf}] weak suppressed or HOLD")
-    else:
-        print(f"[selected {pair} {tf}] {label} (strength {strength})")
+    result = analyze_cached(df, pair, tf)
+    deliver_signal("selected", pair, tf, result, "(Selected) ", "(Selected) ⚠ Weak:\n", PRIO_SELECTED)
 
-def background_auto_scan():
-    scan_tfs = ["15m","1h","4h"]
-    for pair in PAIRS:
-        for tf in scan_tfs:
-            df = fetch_klines(pair, tf, limit=300)
-            if df is None:
-                continue
-            label, strength, report, details = analyze_df_for_pair(df, pair, tf, levels_mode=False)
-            if label in ("BUY","SELL"):
-                if strength >= 2:
-                    safe_send(USER_CHAT_ID, "🔔 AUTO:\n" + report)
-                elif strength == 1 and SEND_WEAK_SIGNALS and should_send_weak(pair, tf):
-                    safe_send(USER_CHAT_ID, "🔔 AUTO ⚠ Weak:\n" + report)
-                else:
-                    print(f"[auto] {pair} {tf} -> weak suppressed")
-            else:
-                print(f"[auto] {pair} {tf} -> HOLD")
-
-def background_scalp_scan():
-    if not state.get("scalp_enabled"):
-        return
-    pair = state.get("pair")
-    if not pair:
-        return
-    df = fetch_klines(pair, "5m", limit=200)
+def auto_analyze(pair, tf, df=None):
+    """Fetch (unless df is given) + analyze one (pair, tf); returns (label, strength, report, details) or None."""
     if df is None:
-        return
-    label, strength, report, details = analyze_df_for_pair(df, pair, "5m", scalp_mode=True)
-    if label in ("BUY","SELL"):
-        if strength >= 2:
-            safe_send(USER_CHAT_ID, "⚡ SCALP:\n" + report)
-        elif strength == 1 and SEND_WEAK_SIGNALS and should_send_weak(pair, "5m"):
-            safe_send(USER_CHAT_ID, "⚡ SCALP ⚠ Weak:\n" + report)
-        else:
-            print(f"[scalp] {pair} 5m -> weak suppressed")
-    else:
-        print(f"[scalp] {pair} 5m -> HOLD")
+        df = fetch_klines(pair, tf, limit=300)
+    if df is None:
+        return None
+    return analyze_cached(df, pair, tf, levels_mode=False)
+
+def auto_deliver(pair, tf, result):
+    deliver_signal("auto", pair, tf, result, "🔔 AUTO:\n", "🔔 AUTO ⚠ Weak:\n", PRIO_AUTO, coalesce="auto")
+
+_auto_pool = ThreadPoolExecutor(max_workers=AUTO_SCAN_WORKERS, thread_name_prefix="auto_scan")
+
+def _auto_job(pair, tf, df=None):
+    try:
+        return auto_analyze(pair, tf, df)
+    except Exception as e:
+        stats.inc("errors", stage="auto_scan")
+        print(f"[auto] {pair} {tf} failed: {e}")
+        return None
 
-def background_levels_monitor():
-    """Monitor levels for selected pair+tf, send when price near support/resistance"""
-    if not state.get("levels_enabled"):
+def update_context(markets, frames):
+    """Fold a close's windows into the market context, then publish it once per timeframe."""
+    for (pair, tf), df in zip(markets, frames):
+        if df is not None:
+            market_context.observe(pair, tf, df)
+    for tf in dict.fromkeys(tf for _, tf in markets):
+        market_context.publish(tf)
+
+def background_auto_scan(markets):
+    """
+    Fetch+analyze markets concurrently on the bounded pool, deliver results in the given order.
+    With the market context on, every window is fetched first and the context published from all
+    of them, so each analysis of the close sees the same complete market.
+    """
+    started = time.time()
+    frames = [None] * len(markets)
+    if market_context is not None:
+        frames = list(_auto_pool.map(lambda m: fetch_klines(m[0], m[1], limit=300), markets))
+        update_context(markets, frames)
+    jobs = [(pair, tf, _auto_pool.submit(_auto_job, pair, tf, df)) for (pair, tf), df in zip(markets, frames)]
+    failed = 0
+    for pair, tf, fut in jobs:
+        result = fut.result()
+        if result is None:
+            failed += 1
+        auto_deliver(pair, tf, result)
+    elapsed = time.time() - started
+    stats.observe_value("auto_scan_seconds", elapsed)
+    print(f"[auto] scan of {len(jobs)} pair/tf done in {elapsed:.2f}s ({failed} without data)")
+
+def auto_scan_close(_, tf):
+    """Scheduler job for auto mode: on a `tf` close, one batch over every auto market whose candle closed with it."""
+    close_ms = last_close(tf, int((scheduler.clock() - scheduler.settle) * 1000))
+    background_auto_scan([(p, t) for p, t in subs.auto_markets if last_close(t, close_ms + 1) == close_ms])
+
+def background_scalp_scan(pair, tf="5m"):
+    df = fetch_klines(pair, tf, limit=200)
+    if df is None:
         return
-    pair = state.get("pair")
-    tf = state.get("timeframe")
-    if not pair or not tf:
+    result = analyze_cached(df, pair, tf, scalp_mode=True)
+    deliver_signal("scalp", pair, tf, result, "⚡ SCALP:\n", "⚡ SCALP ⚠ Weak:\n", PRIO_SCALP)
+
+def send_level_alert(pair, tf, side, label, report, head):
+    wanted = "BUY" if side == "support" else "SELL"
+    if label != wanted and label != "HOLD":
+        print(f"[levels] {pair} {tf} {side} near but label {label}")
         return
+    for chat_id in subs.subscribers("levels", pair, tf):
+        # HOLD at a level -> special message only for chats with weak signals on
+        if label == wanted or subs.chat(chat_id)["send_weak"]:
+            safe_send(chat_id, head + report, priority=PRIO_LEVELS)
+
+def background_levels_monitor(pair, tf):
+    """Monitor levels for pair+tf, send to its subscribers when price near support/resistance"""
     df = fetch_klines(pair, tf, limit=300)
     if df is None:
         return
-    supports, resistances = get_levels_from_df(df, order=4, cluster_threshold=0.006)
+    t0 = stats.clock()
+    idx = level_indexes.sync(pair, tf, df)
+    stats.observe("levels", t0, pair, tf)
+    supports, resistances = idx.supports, idx.resistances
     if not supports and not resistances:
         return
+    # one (cached) analysis gives both the report and the ATR used for the "near" test
+    label, strength, report, details = analyze_cached(df, pair, tf, levels_mode=True, known_levels=(supports, resistances))
     price = df.iloc[-1]["close"]
-    atr = ta.volatility.AverageTrueRange(df["high"], df["low"], df["close"], window=14).average_true_range().iloc[-1]
-    # thresholds: near if within 0.7*ATR or within 0.4% if atr nan
+    atr = details.get("atr", float("nan"))
+    mult = signal_params.current["level_atr_mult"]
+    # thresholds: near if within mult*ATR or within 0.4% if atr nan
     def near(lvl):
         if not (isinstance(atr, float) and not math.isnan(atr) and atr>0):
             return abs(price - lvl)/lvl < 0.004
-        return abs(price - lvl) <= 0.7*atr
-    # check supports (buy)
-    for s in supports[:3]:
-        if near(s):
-            # build report including levels
-            label, strength, report, details = analyze_df_for_pair(df, pair, tf, levels_mode=True)
-            # If label is HOLD but price touches support -> we can send special BUY-from-level message
-            if label == "BUY" or (label == "HOLD" and SEND_WEAK_SIGNALS):
-                safe_send(USER_CHAT_ID, "🎯 LEVELS (support) detected:\n" + report)
-            else:
-                print(f"[levels] support near but label {label}")
-            return
-    # check resistances (sell)
-    for r in resistances[:3]:
-        if near(r):
-            label, strength, report, details = analyze_df_for_pair(df, pair, tf, levels_mode=True)
-            if label == "SELL" or (label == "HOLD" and SEND_WEAK_SIGNALS):
-                safe_send(USER_CHAT_ID, "🎯 LEVELS (resistance) detected:\n" + report)
-            else:
-                print(f"[levels] resistance near but label {label}")
-            return
+        return abs(price - lvl) <= mult*atr
+    # the closest support (buy) first, then the closest resistance (sell)
+    side = None
+    s, r = idx.nearest_support(price), idx.nearest_resistance(price)
+    if s is not None and near(s):
+        side = "support"
+    elif r is not None and near(r):
+        side = "resistance"
+    if side is None:
+        return
+    send_level_alert(pair, tf, side, label, report, f"🎯 LEVELS ({side}) detected:\n")
+
+# ---------------- Tick-driven level touches ----------------
+# the touch engine holds every watched (pair, tf)'s levels; the tick stream checks each quote against them
+touch_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="level_touch")
+
+def on_level_touch(touch):
+    # called on the stream thread: hand the report/fan-out off so the next tick isn't delayed
+    touch_pool.submit(deliver_level_touch, touch)
+
+touch_engine = TouchEngine(on_touch=on_level_touch, cooldown=LEVEL_TOUCH_COOLDOWN)
+tick_stream = TickStream(touch_engine, base_url=os.getenv("BINANCE_WS_URL", "wss://stream.binance.com:9443"))
+
+def refresh_level_alerts(pair, tf):
+    """Tick mode levels job: on every (pair, tf) close rebuild its levels and ATR band in the touch engine."""
+    df = fetch_klines(pair, tf, limit=300)
+    if df is None:
+        return
+    t0 = stats.clock()
+    idx = level_indexes.sync(pair, tf, df)
+    stats.observe("levels", t0, pair, tf)
+    _, _, _, details = analyze_cached(df, pair, tf, levels_mode=True, known_levels=(idx.supports, idx.resistances))
+    atr = details.get("atr", float("nan"))
+    band = signal_params.current["level_atr_mult"] * atr if atr > 0 else None   # NaN > 0 is False
+    touch_engine.set_levels(pair, tf, idx.supports, idx.resistances, band)
+
+def deliver_level_touch(touch):
+    df = fetch_klines(touch.symbol, touch.tf, limit=300)
+    if df is None:
+        return
+    idx = level_indexes.sync(touch.symbol, touch.tf, df)
+    label, strength, report, details = analyze_cached(df, touch.symbol, touch.tf, levels_mode=True,
+                                                      known_levels=(idx.supports, idx.resistances))
+    head = f"🎯 LEVELS ({touch.side}) касание {touch.level:.6f}, цена {touch.price:.6f}:\n"
+    send_level_alert(touch.symbol, touch.tf, touch.side, label, report, head)
+
+def sync_level_alerts():
+    """Keep the touch engine and tick stream on the markets chats watch; new markets get their levels now."""
+    if not LEVEL_TICKS:
+        return
+    markets = set(subs.markets("levels"))
+    touch_engine.retain(markets)
+    for pair, tf in markets - touch_engine.markets():
+        touch_pool.submit(refresh_level_alerts, pair, tf)
+    tick_stream.set_subscriptions({pair for pair, _ in markets})
+
+# ---------------- Candle-close scheduling ----------------
+scheduler = CandleScheduler(settle=CANDLE_SETTLE, workers=AUTO_SCAN_WORKERS)
+
+# subscription kind -> (scheduler tag, job(pair, tf), trigger interval)
+JOBS = {
+    "auto": ("auto_scan", auto_scan_close, None),
+    "selected": ("selected", periodic_selected_check, None),
+    "scalp": ("scalp", background_scalp_scan, None),
+    "levels": ("levels", refresh_level_alerts, None) if LEVEL_TICKS
+              else ("levels", background_levels_monitor, LEVELS_POLL_TF),
+}
+
+def stream_subscriptions():
+    """(pair, tf) set needed by all chats' active modes."""
+    markets = set()
+    for kind in JOBS:
+        markets.update(subs.markets(kind))
+    return markets
+
+def sync_stream():
+    if STREAM_MODE:
+        kline_stream.set_subscriptions(stream_subscriptions())
+
+def refresh_jobs():
+    """One scheduler job per kind covering the distinct markets any chat watches."""
+    for kind, (tag, job, trigger) in JOBS.items():
+        keys = subs.markets(kind)
+        if kind == "auto" and keys:
+            # one batch per close of the shortest auto tf, covering every auto market that closed with it
+            keys = [("*", min({tf for _, tf in keys}, key=INTERVAL_MS.get))]
+        if keys:
+            scheduler.set_job(tag, job, keys, trigger=trigger)
+        else:
+            scheduler.clear(tag)
+    sync_stream()
+    sync_level_alerts()
+    watched = {pair for kind in JOBS for pair, _ in subs.markets(kind)}
+    if shard_pool is not None:
+        shard_pool.retain(watched)
+    if market_context is not None:
+        market_context.retain(watched)
+
+def set_chat(chat_id, **fields):
+    """Change a chat's subscription state and reschedule."""
+    st = subs.update(chat_id, **fields)
+    refresh_jobs()
+    return st
+
+# ---------------- Universe (scan prefilter) ----------------
+# stage one: one bulk 24h-ticker request ranks all USDT symbols; stage two analyzes only the top N
+universe = Universe(client, top_n=UNIVERSE_TOP_N, min_quote_volume=UNIVERSE_MIN_QUOTE_VOLUME, fallback=PAIRS)
+
+def refresh_universe(*_):
+    if not UNIVERSE_TOP_N:
+        return
+    added, removed = universe.refresh()
+    if added or removed:
+        print(f"[universe] +{len(added)} -{len(removed)}: now {len(universe.symbols)} symbols")
+    for sym in removed:
+        if not universe.is_tradable(sym):
+            candle_store.evict(sym)   # stopped trading: free its history
+    subs.set_auto_markets([(p, t) for p in universe.symbols for t in AUTO_SCAN_TFS])
+    refresh_jobs()
+
+# ---------------- Warm-state snapshots ----------------
+# what a restart would otherwise rebuild from scratch (chat settings, weak cooldowns, processed candles,
+# candle history, indicator/level state); restored before the first job so nothing replays or re-alerts
+_snapshot_lock = threading.Lock()
+# the classes pickled by value: a snapshot from a build where their state differs is refused unread
+SNAPSHOT_LAYOUT = snapshot.fingerprint(IndicatorEngine(), LevelIndex())
+
+def save_state(*_):
+    if not SNAPSHOT_PATH:
+        return
+    with _snapshot_lock:
+        try:
+            size = snapshot.save(SNAPSHOT_PATH, {
+                "chats": subs.export(),
+                "processed": scheduler.export(),
+                "universe": universe.export(),
+                "candles": candle_store.export(),
+                "indicators": indicator_engines.export(),
+                "levels": level_indexes.export(),
+            }, layout=SNAPSHOT_LAYOUT)
+            print(f"[snapshot] saved {len(subs)} chats, {size // 1024} KiB")
+        except Exception as e:
+            stats.inc("errors", stage="snapshot")
+            print("[snapshot] save failed:", e)
+
+def restore_state():
+    """Returns True if a snapshot was loaded."""
+    parts, saved_at = snapshot.load(SNAPSHOT_PATH, max_age=SNAPSHOT_MAX_AGE, layout=SNAPSHOT_LAYOUT)
+    if parts is None:
+        return False
+    try:
+        universe.restore(parts["universe"])
+        if UNIVERSE_TOP_N:
+            subs.set_auto_markets([(p, t) for p in universe.symbols for t in AUTO_SCAN_TFS])
+        subs.restore(parts["chats"])
+        candle_store.restore(parts["candles"])
+        indicator_engines.restore(parts["indicators"])
+        level_indexes.restore(parts["levels"])
+        scheduler.restore(parts["processed"])
+    except Exception as e:
+        stats.inc("errors", stage="snapshot")
+        print("[snapshot] restore failed, starting cold:", e)
+        return False
+    print(f"[snapshot] restored {len(subs)} chats, {len(parts['candles'])} series "
+          f"from {int(time.time() - saved_at)}s ago")
+    return True
+
+def stream_loop():
+    """Stream mode: closes seen on the websocket fire jobs right away (the timer then skips them)."""
+    while True:
+        try:
+            pair, tf, close_time = kline_stream.closed.get()
+            scheduler.candle_closed(pair, tf, close_time)
+        except Exception as e:
+            stats.inc("errors", stage="stream")
+            print("stream_loop error:", e)
+            traceback.print_exc()
 
 # ---------------- Telegram UI ----------------
 def main_menu_kb():
@@ -465,133 +644,133 @@ def tf_kb():
 
 @bot.message_handler(commands=["start"])
 def cmd_start(m):
-    if m.chat.id != USER_CHAT_ID:
-        bot.send_message(m.chat.id, "⛔ Доступ запрещён")
+    if not allowed(m.chat.id):
+        safe_send(m.chat.id, "⛔ Доступ запрещён")
         return
     # reset selection
-    state["mode"] = None; state["pair"] = None; state["timeframe"] = None
-    state["scalp_enabled"] = False; state["levels_enabled"] = False
+    set_chat(m.chat.id, mode=None, pair=None, timeframe=None, scalp_enabled=False, levels_enabled=False)
     safe_send(m.chat.id, "👋 Мир вам дорогие друзья!\nВыберите режим работы бота:")
-    bot.send_message(m.chat.id, "Режимы:", reply_markup=main_menu_kb())
+    safe_send(m.chat.id, "Режимы:", reply_markup=main_menu_kb())
+
+@bot.message_handler(commands=["stats"])
+def cmd_stats(m):
+    if m.chat.id != USER_CHAT_ID: return
+    markets = sum(len(subs.markets(kind)) for kind in JOBS)
+    safe_send(m.chat.id, stats.summary() + "\n" + analysis_cache.summary() +
+              f"\nchats: {len(subs)}, watched markets: {markets}" +
+              ("\n" + touch_engine.summary() if LEVEL_TICKS else "") +
+              ("\n" + updates.summary() if WEBHOOK_PORT else "") +
+              ("\n" + shard_pool.summary() if shard_pool is not None else "") +
+              ("\n" + market_context.summary() if market_context is not None else "") +
+              ("\n" + client.summary() if hasattr(client, "summary") else ""))
+
+@bot.message_handler(commands=["universe"])
+def cmd_universe(m):
+    if not allowed(m.chat.id): return
+    safe_send(m.chat.id, universe.summary())
 
 @bot.message_handler(func=lambda m: m.text == "🧭 Manual (ручной)")
 def choose_manual(m):
-    if m.chat.id != USER_CHAT_ID: return
-    state["mode"] = "manual"; state["scalp_enabled"] = False; state["levels_enabled"] = False
+    if not allowed(m.chat.id): return
+    set_chat(m.chat.id, mode="manual", scalp_enabled=False, levels_enabled=False)
     safe_send(m.chat.id, "Ручной режим включён. Выберите торговую пару:")
-    bot.send_message(m.chat.id, "Пара:", reply_markup=pair_kb())
+    safe_send(m.chat.id, "Пара:", reply_markup=pair_kb())
 
 @bot.message_handler(func=lambda m: m.text == "🤖 Auto (авто)")
 def choose_auto(m):
-    if m.chat.id != USER_CHAT_ID: return
-    state["mode"] = "auto"; state["pair"] = None; state["timeframe"] = None
-    state["scalp_enabled"] = False; state["levels_enabled"] = False
-    safe_send(m.chat.id, "Авто-режим включён. Буду сканировать пары (15m/1h/4h) и присылать medium/strong (и weak по настройке).")
-    schedule.clear('auto_scan'); schedule.every(5).minutes.do(background_auto_scan).tag('auto_scan')
+    if not allowed(m.chat.id): return
+    set_chat(m.chat.id, mode="auto", pair=None, timeframe=None, scalp_enabled=False, levels_enabled=False)
+    safe_send(m.chat.id, f"Авто-режим включён. Буду сканировать {len(universe.symbols)} пар (15m/1h/4h) и присылать medium/strong (и weak по настройке).")
 
 @bot.message_handler(func=lambda m: m.text == "⚡ Scalp (скальпинг 5m)")
 def choose_scalp(m):
-    if m.chat.id != USER_CHAT_ID: return
-    state["mode"] = "scalp"
+    if not allowed(m.chat.id): return
+    set_chat(m.chat.id, mode="scalp")
     safe_send(m.chat.id, "Скальпинг выбран. Выберите пару для скальпинга (5m):")
-    bot.send_message(m.chat.id, "Пара для скальпа:", reply_markup=pair_kb())
+    safe_send(m.chat.id, "Пара для скальпа:", reply_markup=pair_kb())
 
 @bot.message_handler(func=lambda m: m.text == "🎯 Levels (уровни)")
 def choose_levels(m):
-    if m.chat.id != USER_CHAT_ID: return
-    state["mode"] = "levels"
+    if not allowed(m.chat.id): return
+    set_chat(m.chat.id, mode="levels")
     safe_send(m.chat.id, "Режим уровней выбран. Выберите пару, затем таймфрейм:")
-    bot.send_message(m.chat.id, "Пара:", reply_markup=pair_kb())
+    safe_send(m.chat.id, "Пара:", reply_markup=pair_kb())
 
 @bot.message_handler(func=lambda m: m.text == "🛑 Stop (выключить автоскан/скальп)")
 def stop_scans(m):
-    if m.chat.id != USER_CHAT_ID: return
-    state["mode"] = None; state["pair"] = None; state["timeframe"] = None
-    state["scalp_enabled"] = False; state["levels_enabled"] = False
-    schedule.clear('auto_scan'); schedule.clear('selected'); schedule.clear('scalp'); schedule.clear('levels')
+    if not allowed(m.chat.id): return
+    set_chat(m.chat.id, mode=None, pair=None, timeframe=None, scalp_enabled=False, levels_enabled=False)
     safe_send(m.chat.id, "Автосканы, скальп и уровни отключены. Возвращаю меню.")
-    bot.send_message(m.chat.id, "Главное меню:", reply_markup=main_menu_kb())
+    safe_send(m.chat.id, "Главное меню:", reply_markup=main_menu_kb())
 
 @bot.message_handler(func=lambda m: m.text == "🧰 Toggle Weak (вкл/выкл weak)")
 def toggle_weak(m):
-    if m.chat.id != USER_CHAT_ID: return
-    global SEND_WEAK_SIGNALS
-    SEND_WEAK_SIGNALS = not SEND_WEAK_SIGNALS
-    safe_send(m.chat.id, f"Weak signals now {'ENABLED' if SEND_WEAK_SIGNALS else 'DISABLED'}")
+    if not allowed(m.chat.id): return
+    st = set_chat(m.chat.id, send_weak=not subs.chat(m.chat.id)["send_weak"])
+    safe_send(m.chat.id, f"Weak signals now {'ENABLED' if st['send_weak'] else 'DISABLED'}")
 
 @bot.message_handler(func=lambda m: m.text in PAIRS)
 def handle_pair_choice(m):
-    if m.chat.id != USER_CHAT_ID: return
+    if not allowed(m.chat.id): return
     pair = m.text
-    mode = state.get("mode")
+    mode = subs.chat(m.chat.id)["mode"]
     if mode == "manual":
-        state["pair"] = pair
+        set_chat(m.chat.id, pair=pair)
         safe_send(m.chat.id, f"Пара {pair} выбрана. Выберите таймфрейм:")
-        bot.send_message(m.chat.id, "ТФ:", reply_markup=tf_kb())
+        safe_send(m.chat.id, "ТФ:", reply_markup=tf_kb())
     elif mode == "scalp":
-        state["pair"] = pair
-        state["scalp_enabled"] = True
+        set_chat(m.chat.id, pair=pair, scalp_enabled=True)
         safe_send(m.chat.id, f"Скальпинг включён для {pair} (5m). Бот будет анализировать 5m.")
-        schedule.clear('scalp'); schedule.every(1).minutes.do(background_scalp_scan).tag('scalp')
         # immediate scalp analysis
-        df = fetch_klines(pair, "5m", limit=200)
-        if df is not None:
-            lab,strg,rep,det = analyze_df_for_pair(df, pair, "5m", scalp_mode=True)
-            safe_send(m.chat.id, "Первый SCALP-анализ:\n" + rep)
-        else:
-            safe_send(m.chat.id, f"Не удалось загрузить 5m данные для {pair}")
+        def first_scalp():
+            df = fetch_klines(pair, "5m", limit=200)
+            if df is None:
+                return f"Не удалось загрузить 5m данные для {pair}" + api_note()
+            lab,strg,rep,det = analyze_cached(df, pair, "5m", scalp_mode=True)
+            return "Первый SCALP-анализ:\n" + rep
+        reply_later(m.chat.id, f"⏳ Первый SCALP-анализ {pair}...", first_scalp)
     elif mode == "levels":
-        state["pair"] = pair
+        set_chat(m.chat.id, pair=pair)
         safe_send(m.chat.id, f"Пара {pair} выбрана для уровней. Выберите таймфрейм:")
-        bot.send_message(m.chat.id, "ТФ:", reply_markup=tf_kb())
+        safe_send(m.chat.id, "ТФ:", reply_markup=tf_kb())
     else:
         safe_send(m.chat.id, "Сначала выберите режим: Manual / Auto / Scalp / Levels")
-        bot.send_message(m.chat.id, "Режимы:", reply_markup=main_menu_kb())
+        safe_send(m.chat.id, "Режимы:", reply_markup=main_menu_kb())
 
 @bot.message_handler(func=lambda m: m.text in ["5m","15m","1h","4h","1d"])
 def handle_tf_choice(m):
-    if m.chat.id != USER_CHAT_ID: return
+    if not allowed(m.chat.id): return
     tf = m.text
-    mode = state.get("mode")
+    st = subs.chat(m.chat.id)
+    pair, mode = st["pair"], st["mode"]
     if mode == "manual":
-        if not state.get("pair"):
+        if not pair:
             safe_send(m.chat.id, "Сначала выберите пару.")
-            bot.send_message(m.chat.id, "Пара:", reply_markup=pair_kb())
-            return
-        state["timeframe"] = tf
-        safe_send(m.chat.id, f"Manual: {state['pair']} [{tf}] выбран. Пришлю первый анализ...")
-        df = fetch_klines(state["pair"], tf, limit=300)
-        if df is None:
-            safe_send(m.chat.id, f"Ошибка загрузки данных для {state['pair']} [{tf}]")
+            safe_send(m.chat.id, "Пара:", reply_markup=pair_kb())
             return
-        lab,strg,rep,det = analyze_df_for_pair(df, state["pair"], tf)
-        safe_send(m.chat.id, rep)
-        schedule.clear('selected')
-        # schedule periodic selected checks
-        if tf == "5m":
-            schedule.every(5).minutes.do(periodic_selected_check).tag('selected')
-        elif tf == "15m":
-            schedule.every(15).minutes.do(periodic_selected_check).tag('selected')
-        elif tf == "1h":
-            schedule.every().hour.do(periodic_selected_check).tag('selected')
-        elif tf == "4h":
-            schedule.every(4).hours.do(periodic_selected_check).tag('selected')
-        elif tf == "1d":
-            schedule.every().day.do(periodic_selected_check).tag('selected')
+        # from now on re-checked on every close of the selected timeframe
+        set_chat(m.chat.id, timeframe=tf)
+        def first_manual():
+            df = fetch_klines(pair, tf, limit=300)
+            if df is None:
+                return f"Ошибка загрузки данных для {pair} [{tf}]" + api_note()
+            lab,strg,rep,det = analyze_cached(df, pair, tf)
+            return rep
+        reply_later(m.chat.id, f"Manual: {pair} [{tf}] выбран. Пришлю первый анализ...", first_manual)
     elif mode == "levels":
-        if not state.get("pair"):
+        if not pair:
             safe_send(m.chat.id, "Сначала выберите пару.")
-            bot.send_message(m.chat.id, "Пара:", reply_markup=pair_kb())
+            safe_send(m.chat.id, "Пара:", reply_markup=pair_kb())
             return
-        state["timeframe"] = tf
-        state["levels_enabled"] = True
-        safe_send(m.chat.id, f"Levels: {state['pair']} [{tf}] выбран. Я буду отслеживать уровни и отправлять уведомления при касании.")
-        schedule.clear('levels')
-        schedule.every(2).minutes.do(background_levels_monitor).tag('levels')
+        set_chat(m.chat.id, timeframe=tf, levels_enabled=True)
+        safe_send(m.chat.id, f"Levels: {pair} [{tf}] выбран. Я буду отслеживать уровни и отправлять уведомления при касании.")
         # immediate first levels analysis
-        df = fetch_klines(state["pair"], tf, limit=300)
-        if df is not None:
-            supports, resistances = get_levels_from_df(df, order=4, cluster_threshold=0.006)
+        def first_levels():
+            df = fetch_klines(pair, tf, limit=300)
+            if df is None:
+                return f"Не удалось загрузить данные для {pair} [{tf}]" + api_note()
+            idx = level_indexes.sync(pair, tf, df)
+            supports, resistances = idx.supports, idx.resistances
             text = "Первый анализ уровней:\n"
             if supports:
                 text += f"Поддержки: {', '.join([f'{s:.6f}' for s in supports[:3]])}\n"
@@ -599,34 +778,58 @@ def handle_tf_choice(m):
                 text += f"Сопротивления: {', '.join([f'{r:.6f}' for r in resistances[:3]])}\n"
             if not supports and not resistances:
                 text += "Не найдено явных уровней (нужно больше исторических экстремумов).\n"
-            safe_send(m.chat.id, text)
-        else:
-            safe_send(m.chat.id, f"Не удалось загрузить данные для {state['pair']} [{tf}]")
+            return text
+        reply_later(m.chat.id, f"⏳ Ищу уровни {pair} [{tf}]...", first_levels)
     else:
         safe_send(m.chat.id, "Выбор таймфрейма доступен только в Manual или Levels режиме.")
-        bot.send_message(m.chat.id, "Главное меню:", reply_markup=main_menu_kb())
+        safe_send(m.chat.id, "Главное меню:", reply_markup=main_menu_kb())
 
 @bot.message_handler(func=lambda m: m.text == "🔙 Назад")
 def handle_back(m):
-    if m.chat.id != USER_CHAT_ID: return
+    if not allowed(m.chat.id): return
     safe_send(m.chat.id, "Возврат в главное меню")
-    bot.send_message(m.chat.id, "Главное меню:", reply_markup=main_menu_kb())
+    safe_send(m.chat.id, "Главное меню:", reply_markup=main_menu_kb())
+
+# ---------------- Webhook ----------------
+def handle_update(update):
+    """One Bot API update (JSON dict) through the registered handlers, on the calling thread."""
+    bot.process_new_updates([telebot.types.Update.de_json(update)])
+
+updates = UpdateDispatcher(handle_update, workers=UPDATE_WORKERS)
 
-# ---------------- schedule loop ----------------
-def schedule_loop():
-    # ensure auto-scan tags work
+def run_webhook():
+    path = urlparse(WEBHOOK_URL).path or "/telegram"
+    server = WebhookServer(updates, WEBHOOK_PORT, WEBHOOK_SECRET, host=WEBHOOK_HOST, path=path).start()
+    if WEBHOOK_URL:
+        bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET, max_connections=UPDATE_WORKERS * 5)
+    print(f"[webhook] listening on {WEBHOOK_HOST}:{server.port}{path} ({UPDATE_WORKERS} update workers)")
     while True:
-        try:
-            schedule.run_pending()
-            time.sleep(1)
-        except Exception as e:
-            print("schedule_loop error:", e)
-            time.sleep(3)
+        time.sleep(3600)
 
 # ---------------- start ----------------
 def start_bot():
-    t = threading.Thread(target=schedule_loop, daemon=True)
-    t.start()
+    if SHARD_WORKERS:
+        start_shards()
+    restore_state()
+    refresh_jobs()
+    scheduler.set_job("universe", refresh_universe, [("*", UNIVERSE_REFRESH_TF)])
+    if SNAPSHOT_PATH:
+        scheduler.set_job("snapshot", save_state, [("*", "5m")])
+        atexit.register(save_state)
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))   # run atexit on `docker stop` / systemd too
+    scheduler.start()
+    # the first universe ranking needs two Binance requests; don't hold up polling for it
+    threading.Thread(target=refresh_universe, name="universe_boot", daemon=True).start()
+    if stats.enabled and METRICS_PORT:
+        stats.serve(METRICS_PORT, host=os.getenv("METRICS_HOST", "127.0.0.1"))
+    if STREAM_MODE:
+        kline_stream.start()
+        threading.Thread(target=stream_loop, daemon=True).start()
+    if LEVEL_TICKS:
+        tick_stream.start()
+    if WEBHOOK_PORT:
+        run_webhook()
+        return
     try:
         bot.polling(non_stop=True, timeout=60)
     except Exception as e:
@@ -0,0 +1,85 @@
+# cache.py — shared TTL/LRU cache for analysis results, one computation per key even under concurrency
+import time
+import threading
+from collections import OrderedDict
+
+from metrics import stats
+
+
+class ResultCache:
+    """
+    get(key, compute) returns the cached value for key or stores compute().
+    Concurrent callers asking for the same missing key wait for the first one
+    instead of computing it again. Entries expire after `ttl` seconds and the
+    least recently used are dropped beyond `max_entries`.
+    """
+
+    def __init__(self, max_entries=256, ttl=15 * 60, name="analysis"):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.name = name
+        self._data = OrderedDict()   # {key: (stored_ts, value)}
+        self._lock = threading.Lock()
+        self._key_locks = {}         # {key: Lock} while a value is being computed
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        found, value = self._lookup(key)
+        if found:
+            return value
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # someone else may have filled it while we waited
+            found, value = self._lookup(key, count=False)
+            if found:
+                self._count(hit=True)
+                return value
+            self._count(hit=False)
+            try:
+                value = compute()
+                with self._lock:
+                    self._data[key] = (time.time(), value)
+                    self._data.move_to_end(key)
+                    while len(self._data) > self.max_entries:
+                        self._data.popitem(last=False)
+            finally:
+                with self._lock:
+                    self._key_locks.pop(key, None)
+            return value
+
+    def invalidate(self, match=None):
+        """Drop entries whose key satisfies match(key), or everything."""
+        with self._lock:
+            for key in [k for k in self._data if match is None or match(k)]:
+                del self._data[key]
+
+    def __len__(self):
+        return len(self._data)
+
+    def summary(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return f"{self.name} cache: {len(self)} entries, hits {self.hits}, misses {self.misses} ({rate:.0f}% hit)"
+
+    def _lookup(self, key, count=True):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (not self.ttl or time.time() - entry[0] <= self.ttl):
+                self._data.move_to_end(key)
+                if count:
+                    self.hits += 1
+                    stats.inc("cache_hits", cache=self.name)
+                return True, entry[1]
+            if entry is not None:
+                del self._data[key]
+        return False, None
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        stats.inc("cache_hits" if hit else "cache_misses", cache=self.name)
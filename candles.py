@@ -0,0 +1,253 @@
+# candles.py — in-memory kline history per (symbol, interval) with incremental refresh
+import time
+import threading
+from collections import OrderedDict, deque
+
+# Binance interval -> milliseconds
+INTERVAL_MS = {
+    "1m": 60_000, "3m": 180_000, "5m": 300_000, "15m": 900_000, "30m": 1_800_000,
+    "1h": 3_600_000, "2h": 7_200_000, "4h": 14_400_000, "6h": 21_600_000,
+    "8h": 28_800_000, "12h": 43_200_000, "1d": 86_400_000, "3d": 259_200_000,
+    "1w": 604_800_000,
+}
+
+# raw kline row layout (as returned by Binance)
+OPEN_TIME, CLOSE_TIME = 0, 6
+
+
+def merge_rows(rows, new_rows):
+    """
+    Merge freshly fetched kline rows into rows (list/deque sorted by open_time).
+    Rows with open_time >= first new open_time are replaced, so the still-open
+    last candle is updated in place instead of duplicated.
+    """
+    if not new_rows:
+        return
+    first_open = new_rows[0][OPEN_TIME]
+    while rows and rows[-1][OPEN_TIME] >= first_open:
+        rows.pop()
+    rows.extend(new_rows)
+
+
+class CandleStore:
+    """
+    Per-(symbol, interval) candle history.
+    First request loads full history, later requests only fetch candles starting
+    from the last stored open_time (which re-reads the still-open candle).
+    fetch(symbol, interval, limit, start_time=None) -> list of raw kline rows.
+    history: optional KlineStore; full loads start from disk and closed candles are persisted.
+    min_refresh: a series refreshed less than this many seconds ago is served from memory,
+    unless its last candle has closed since (so each closed candle is fetched once).
+    stream_fresh: a series a live stream merged rows into (update(..., fresh=True)) within
+    this many seconds is served from memory while its last row is the open or the
+    just-closed candle -- the stream replaces polling instead of adding to it.
+    """
+
+    def __init__(self, fetch, max_len=1000, max_series=64, ttl=6 * 60 * 60, step_limit=99, history=None,
+                 min_refresh=0.0, stream_fresh=60.0):
+        self.fetch = fetch
+        self.history = history
+        self.max_len = max_len          # bounded history per series
+        self.max_series = max_series    # LRU bound on number of series
+        self.ttl = ttl                  # drop series not touched for ttl seconds
+        self.step_limit = step_limit    # rows per incremental request
+        self.min_refresh = min_refresh
+        self.stream_fresh = stream_fresh
+        self._series = OrderedDict()    # {(symbol, interval): deque of rows}
+        self._touched = {}              # {(symbol, interval): last access ts}
+        self._depth = {}                # {(symbol, interval): history depth requested}
+        self._refreshed = {}            # {(symbol, interval): last network refresh ts}
+        self._streamed = {}             # {(symbol, interval): last stream merge ts}
+        self._lock = threading.RLock()
+        self._key_locks = {}            # {(symbol, interval): Lock} serializing fetches per series
+        self.full_loads = 0
+        self.incremental_loads = 0
+        self.memory_hits = 0
+
+    def get(self, symbol, interval, limit=300):
+        """Return the last `limit` raw rows for symbol/interval (refreshing first)."""
+        key = (symbol, interval)
+        # network calls happen under the per-series lock only, so different series load concurrently
+        with self._series_lock(key):
+            with self._lock:
+                self._evict_idle()
+                rows = self._series.get(key)
+                depth = self._depth.get(key, 0)
+                full = not rows or depth < min(limit, self.max_len) or self._gap_too_big(rows, interval)
+                if not full and self._fresh(key, rows):
+                    self.memory_hits += 1
+                    self._touched[key] = time.time()
+                    return list(rows)[-limit:]
+            if full:
+                rows = self._load_full(key, max(limit, depth))
+            else:
+                self._load_incremental(key, rows)
+            if self.history is not None:
+                self._persist(key, rows)
+            with self._lock:
+                self._series[key] = rows
+                self._series.move_to_end(key)
+                self._touched[key] = self._refreshed[key] = time.time()
+                self._evict_lru()
+                return list(rows)[-limit:]
+
+    def update(self, symbol, interval, new_rows, fresh=False):
+        """
+        Merge externally received rows into a loaded series. fresh=True: they come from a
+        live stream, which keeps the series current (get() skips REST, see stream_fresh).
+        """
+        key = (symbol, interval)
+        with self._lock:
+            rows = self._series.get(key)
+            if rows is None:
+                return False
+            merge_rows(rows, new_rows)
+            self._touched[key] = now = time.time()
+            if fresh:
+                self._streamed[key] = now
+            return True
+
+    def streamed(self, symbol, interval):
+        """True while a live stream keeps (symbol, interval) current (get() won't call REST)."""
+        key = (symbol, interval)
+        with self._lock:
+            rows = self._series.get(key)
+            return bool(rows) and self._stream_current(key, rows, time.time())
+
+    def peek(self, symbol, interval, limit=300):
+        """Last `limit` stored rows without any network refresh, or None if the series isn't loaded."""
+        with self._lock:
+            rows = self._series.get((symbol, interval))
+            if not rows:
+                return None
+            self._touched[(symbol, interval)] = time.time()
+            return list(rows)[-limit:]
+
+    def last_close_time(self, symbol, interval):
+        with self._lock:
+            rows = self._series.get((symbol, interval))
+            return rows[-1][CLOSE_TIME] if rows else None
+
+    def evict(self, symbol=None, interval=None):
+        """Drop one series, all series of a symbol, or everything."""
+        with self._lock:
+            for key in list(self._series):
+                if (symbol is None or key[0] == symbol) and (interval is None or key[1] == interval):
+                    self._drop(key)
+
+    def __len__(self):
+        return len(self._series)
+
+    def export(self):
+        """{(symbol, interval): (rows, depth)} for snapshots."""
+        with self._lock:
+            return {key: (list(rows), self._depth.get(key, len(rows))) for key, rows in self._series.items()}
+
+    def restore(self, series):
+        """Load exported series; the next get() catches each one up incrementally."""
+        now = time.time()
+        with self._lock:
+            for key, (rows, depth) in series.items():
+                self._series[key] = deque(rows, maxlen=self.max_len)
+                self._depth[key] = depth
+                self._touched[key] = now
+            self._evict_lru()
+
+    # ---------------- internals ----------------
+    def _series_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _load_full(self, key, limit):
+        limit = min(max(limit, 1), self.max_len)
+        rows = self._load_from_history(key, limit)
+        if rows is not None:
+            return rows
+        new_rows = self.fetch(key[0], key[1], limit)
+        rows = deque(new_rows, maxlen=self.max_len)
+        with self._lock:
+            self._depth[key] = limit
+            self.full_loads += 1
+        return rows
+
+    def _load_incremental(self, key, rows):
+        # start from the last stored open_time: returns the (maybe updated) last candle + newer ones
+        while True:
+            start = rows[-1][OPEN_TIME]
+            new_rows = self.fetch(key[0], key[1], self.step_limit, start_time=start)
+            with self._lock:
+                merge_rows(rows, new_rows)
+                self.incremental_loads += 1
+            if len(new_rows) < self.step_limit or new_rows[-1][OPEN_TIME] == start:
+                break
+
+    def _load_from_history(self, key, limit):
+        # warm start: disk history + incremental catch-up, if the disk copy is recent enough
+        if self.history is None:
+            return None
+        try:
+            disk = self.history.tail_rows(key[0], key[1], limit)
+        except Exception as e:
+            print(f"[candles] history read error {key}: {e}")
+            return None
+        if not disk or self._gap_too_big(disk, key[1]):
+            return None
+        rows = deque(disk, maxlen=self.max_len)
+        self._load_incremental(key, rows)
+        if len(rows) < limit:
+            return None
+        with self._lock:
+            self._depth[key] = limit
+            self.full_loads += 1
+        return rows
+
+    def _persist(self, key, rows):
+        # closed candles newer than what is on disk
+        now = int(time.time() * 1000)
+        try:
+            last = self.history.last_open_time(key[0], key[1])
+            closed = [r for r in rows if r[CLOSE_TIME] < now and (last is None or r[OPEN_TIME] > last)]
+            if closed:
+                self.history.write(key[0], key[1], closed)
+        except Exception as e:
+            print(f"[candles] history write error {key}: {e}")
+
+    def _stream_current(self, key, rows, now):
+        ts = self._streamed.get(key)
+        step = INTERVAL_MS.get(key[1])
+        return (ts is not None and step is not None and now - ts < self.stream_fresh
+                and rows[-1][CLOSE_TIME] >= now * 1000 - step)
+
+    def _fresh(self, key, rows):
+        now = time.time()
+        if self._stream_current(key, rows, now):
+            return True
+        if not self.min_refresh:
+            return False
+        return now - self._refreshed.get(key, 0) < self.min_refresh and rows[-1][CLOSE_TIME] >= now * 1000
+
+    def _gap_too_big(self, rows, interval):
+        # when more than max_len candles are missing a full reload is cheaper
+        step = INTERVAL_MS.get(interval)
+        if not step or not rows:
+            return False
+        missing = (int(time.time() * 1000) - rows[-1][CLOSE_TIME]) // step
+        return missing >= self.max_len
+
+    def _evict_idle(self):
+        if not self.ttl:
+            return
+        cutoff = time.time() - self.ttl
+        for key in [k for k, ts in self._touched.items() if ts < cutoff]:
+            self._drop(key)
+
+    def _evict_lru(self):
+        while len(self._series) > self.max_series:
+            self._drop(next(iter(self._series)))
+
+    def _drop(self, key):
+        self._series.pop(key, None)
+        self._touched.pop(key, None)
+        self._depth.pop(key, None)
+        self._refreshed.pop(key, None)
+        self._streamed.pop(key, None)
@@ -0,0 +1,242 @@
+# context.py — cross-pair market context: breadth, return correlations and BTC beta for all watched symbols
+import time
+import math
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from candles import INTERVAL_MS
+from metrics import stats
+
+# what one pair's analysis gets; NaN where there is not enough overlapping history
+# breadth: share of symbols above their EMA200; market_return: equal-weight return of the last closed candle
+Context = namedtuple("Context", "symbols breadth market_return corr_market corr_btc beta_btc")
+
+EMA_SPAN = 200
+BUDGET_MS = 25.0  # one candle close of 500 symbols: observe each + publish (bench.py --check gates it)
+
+
+def corr_beta(R, x):
+    """
+    Correlation and beta of each row of R (n, w) against x (w,), NaN-aware: every row
+    uses only the columns where both it and x are finite. One pass of column sums, O(n*w).
+    Also one series R (w,) against several x (n, w) -- the shapes just broadcast.
+    """
+    m = np.isfinite(R) & np.isfinite(x)
+    cnt = m.sum(axis=1).astype(float)
+    Rm = np.where(m, R, 0.0)
+    xm = np.where(m, x, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mr = Rm.sum(axis=1) / cnt
+        mx = xm.sum(axis=1) / cnt
+        cov = (Rm * xm).sum(axis=1) / cnt - mr * mx
+        vr = (Rm * Rm).sum(axis=1) / cnt - mr * mr
+        vx = (xm * xm).sum(axis=1) / cnt - mx * mx
+        corr = cov / np.sqrt(vr * vx)
+        beta = cov / vx
+    few = cnt < 3
+    corr[few] = np.nan
+    beta[few] = np.nan
+    return corr, beta
+
+
+class _Frame:
+    """Log closes of every symbol on one timeframe, aligned so the last column is candle `end`."""
+
+    def __init__(self, step, window, capacity=64):
+        self.step = step
+        self.window = window
+        self.end = None                                     # open_time of the last column
+        self.logs = np.full((capacity, window + 1), np.nan)
+        self.ema = np.full(capacity, np.nan)                # EMA200 of closes up to ema_time
+        self.ema_time = np.full(capacity, -1, dtype=np.int64)
+        self.ema_n = np.zeros(capacity, dtype=np.int64)     # closes folded into ema
+        self.above = np.full(capacity, np.nan)              # last close > EMA200 (1/0), NaN until 200 closes
+        self.rows = {}                                      # {symbol: row}
+        self.free = list(range(capacity - 1, -1, -1))
+
+    def row(self, symbol):
+        r = self.rows.get(symbol)
+        if r is None:
+            if not self.free:
+                self._grow()
+            r = self.rows[symbol] = self.free.pop()
+        return r
+
+    def _grow(self):
+        n = len(self.logs)
+        self.logs = np.vstack([self.logs, np.full((n, self.window + 1), np.nan)])
+        self.ema = np.concatenate([self.ema, np.full(n, np.nan)])
+        self.ema_time = np.concatenate([self.ema_time, np.full(n, -1, dtype=np.int64)])
+        self.ema_n = np.concatenate([self.ema_n, np.zeros(n, dtype=np.int64)])
+        self.above = np.concatenate([self.above, np.full(n, np.nan)])
+        self.free = list(range(2 * n - 1, n - 1, -1))
+
+    def drop(self, symbol):
+        r = self.rows.pop(symbol, None)
+        if r is not None:
+            self.logs[r] = np.nan
+            self.ema[r] = self.above[r] = np.nan
+            self.ema_time[r], self.ema_n[r] = -1, 0
+            self.free.append(r)
+
+    def advance(self, end):
+        """Move the grid to a newer candle: shift every row left, the new columns wait for their symbols."""
+        k = (end - self.end) // self.step if self.end is not None else self.window + 1
+        if k > self.window:
+            self.logs[:] = np.nan
+        elif k > 0:
+            self.logs[:, :-k] = self.logs[:, k:]
+            self.logs[:, -k:] = np.nan
+        self.end = end
+
+    def write(self, r, open_times, closes):
+        """Row r from closed candles (ascending open_times); older than `end` lands left of it."""
+        last = int(open_times[-1])
+        if self.ema_time[r] == last:
+            return                                          # nothing new since the last observe
+        off = (self.end - last) // self.step
+        self.logs[r] = np.nan
+        n = min(len(closes), self.window + 1 - off)
+        if n > 0:
+            self.logs[r, self.window + 1 - off - n:self.window + 1 - off] = np.log(closes[len(closes) - n:])
+        # EMA200 (same recurrence as the indicators): fold in only candles after the last one seen
+        if self.ema_time[r] >= 0 and open_times[0] <= self.ema_time[r] <= last:
+            start = int(np.searchsorted(open_times, self.ema_time[r], side="right"))
+            e, count = float(self.ema[r]), int(self.ema_n[r])
+        else:
+            start, e, count = 0, None, 0
+        a = 2.0 / (EMA_SPAN + 1)
+        for x in closes[start:].tolist():
+            e = x if e is None else a * x + (1 - a) * e
+            count += 1
+        self.ema[r], self.ema_n[r], self.ema_time[r] = e, count, last
+        self.above[r] = float(closes[-1] > e) if count >= EMA_SPAN else np.nan
+
+
+class MarketContext:
+    """
+    Cross-pair context per timeframe from the candles the bot fetches anyway. Once per
+    candle close, after every symbol of the scan was observed:
+
+        market.observe("ETHUSDT", "1h", klines)   # per symbol: fold its closed candles in, O(window)
+        market.publish("1h")                      # all symbols at once (vectorized), once per close
+        market.context("ETHUSDT", "1h")           # the published Context, O(1)
+
+    Each symbol has a row of its last `window` closed-candle log returns, aligned on the
+    timeframe's candle grid; a candle close shifts the grid once. publish() computes the
+    equal-weight market index, breadth and every symbol's correlation/beta in one
+    O(symbols * window) pass with no pairwise loops. Until the next publish, context() returns
+    that snapshot, so every analysis of a close sees the same complete market whatever order
+    the jobs finish in. version(tf) changes with each publish (for cache keys).
+    `reference` is the beta/correlation benchmark. A Context needs at least `min_symbols`
+    symbols on the timeframe.
+    """
+
+    def __init__(self, window=100, reference="BTCUSDT", min_symbols=5, clock=time.time):
+        self.window = window
+        self.reference = reference
+        self.min_symbols = min_symbols
+        self.clock = clock
+        self._frames = {}     # {tf: _Frame}
+        self._published = {}  # {tf: {symbol: Context}}
+        self._versions = {}   # {tf: publish count}
+        self._lock = threading.Lock()
+
+    def observe(self, symbol, tf, k):
+        """Fold the closed candles of k (Klines or DataFrame) into symbol's row (seen by the next publish)."""
+        step = INTERVAL_MS.get(tf)
+        if step is None or k is None or not len(k):
+            return False
+        open_times = np.asarray(k["open_time"], dtype=np.int64)
+        closes = np.asarray(k["close"], dtype=np.float64)
+        closed = int(np.searchsorted(np.asarray(k["close_time"]), self.clock() * 1000))   # drop the open candle
+        if not closed:
+            return False
+        open_times, closes = open_times[:closed], closes[:closed]
+        with self._lock:
+            frame = self._frames.get(tf)
+            if frame is None:
+                frame = self._frames[tf] = _Frame(step, self.window)
+            last = int(open_times[-1])
+            if frame.end is None or last > frame.end:
+                frame.advance(last)
+            frame.write(frame.row(symbol), open_times, closes)
+        return True
+
+    def publish(self, tf):
+        """Compute every symbol's Context on tf from the rows observed so far; returns how many."""
+        t0 = stats.clock()
+        t = self.table(tf)
+        published = {}
+        if t is not None and len(t["symbols"]) >= self.min_symbols:
+            n = len(t["symbols"])
+            for symbol, cm, cb, bb in zip(t["symbols"], t["corr_market"].tolist(), t["corr_btc"].tolist(),
+                                          t["beta_btc"].tolist()):
+                published[symbol] = Context(n, t["breadth"], t["market_return"], cm, cb, bb)
+        with self._lock:
+            self._published[tf] = published
+            self._versions[tf] = self._versions.get(tf, 0) + 1
+        stats.observe("market_context", t0, None, tf)
+        return len(published)
+
+    def context(self, symbol, tf):
+        """symbol's Context from the last publish(tf), or None."""
+        with self._lock:
+            return self._published.get(tf, {}).get(symbol)
+
+    def version(self, tf):
+        with self._lock:
+            return self._versions.get(tf, 0)
+
+    def table(self, tf):
+        """
+        {"symbols", "corr_market", "corr_btc", "beta_btc", "above", "breadth", "market_return"}
+        for every symbol on tf at once.
+        """
+        with self._lock:
+            frame = self._frames.get(tf)
+            if frame is None or not frame.rows:
+                return None
+            symbols = list(frame.rows)
+            rows = np.fromiter(frame.rows.values(), dtype=np.int64, count=len(symbols))
+            live = np.diff(frame.logs[rows], axis=1)
+            ref = frame.rows.get(self.reference)
+            ref_returns = np.diff(frame.logs[ref]) if ref is not None else None
+            above = frame.above[rows]
+        ok = np.isfinite(live)
+        cnt = ok.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            index = np.where(cnt > 0, np.where(ok, live, 0.0).sum(axis=0) / cnt, np.nan)   # equal-weight
+        corr_m, _ = corr_beta(live, index)
+        if ref_returns is None:
+            corr_b = beta_b = np.full(len(rows), np.nan)
+        else:
+            corr_b, beta_b = corr_beta(live, ref_returns)
+        known = above[np.isfinite(above)]
+        finite = index[np.isfinite(index)]
+        return {"symbols": symbols, "corr_market": corr_m, "corr_btc": corr_b, "beta_btc": beta_b, "above": above,
+                "breadth": float(known.mean()) if len(known) else math.nan,
+                "market_return": float(finite[-1]) if len(finite) else math.nan}
+
+    def retain(self, symbols):
+        """Forget symbols no longer watched (they stop counting in breadth and the index)."""
+        keep = set(symbols)
+        with self._lock:
+            for tf, frame in self._frames.items():
+                for symbol in [s for s in frame.rows if s not in keep]:
+                    frame.drop(symbol)
+                    self._published.get(tf, {}).pop(symbol, None)
+
+    def summary(self):
+        parts = []
+        for tf in sorted(self._frames, key=lambda t: INTERVAL_MS.get(t, 0)):
+            t = self.table(tf)
+            if t is None:
+                continue
+            corr = t["corr_btc"][np.isfinite(t["corr_btc"])]
+            breadth = f"{t['breadth'] * 100:.0f}%" if not math.isnan(t["breadth"]) else "—"
+            parts.append(f"{tf}: {len(t['symbols'])} pairs, breadth {breadth}"
+                         + (f", corr BTC {np.median(corr):.2f}" if len(corr) else ""))
+        return "🌐 Market context: " + ("; ".join(parts) if parts else "no data yet")
@@ -0,0 +1,190 @@
+# dispatch.py — Telegram webhook receiver and a concurrent update dispatcher that keeps per-chat order
+import hmac
+import json
+import time
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from metrics import stats
+
+
+def update_chat_id(update):
+    """Chat an update (dict from the Bot API) belongs to (the user for chat-less ones), or None."""
+    for kind in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        if kind in update:
+            return update[kind]["chat"]["id"]
+    for kind in ("callback_query", "inline_query", "chosen_inline_result", "my_chat_member", "chat_member"):
+        if kind in update:
+            obj = update[kind]
+            chat = (obj.get("message") or obj).get("chat") or obj.get("from") or {}
+            return chat.get("id")
+    return None
+
+
+class UpdateDispatcher:
+    """
+    Runs updates on `workers` threads. Updates of one chat are handled one at a time,
+    in arrival order; different chats run in parallel, so a slow handler only holds
+    up its own chat. At most `max_pending` updates wait: submit() returns False
+    beyond that (the webhook then answers 503 and Telegram redelivers later).
+    handle(update) does the work; its exceptions are logged and counted.
+    """
+
+    def __init__(self, handle, workers=8, max_pending=1000, clock=time.time):
+        self.handle = handle
+        self.workers = workers
+        self.max_pending = max_pending
+        self.clock = clock
+        self._queues = {}          # {chat: deque([(update, received)])}, present while the chat has work
+        self._ready = deque()      # chats with queued updates and no worker on them
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stop = False
+        self.handled = 0
+        self.dropped = 0
+
+    def submit(self, chat, update):
+        with self._cond:
+            if self._pending >= self.max_pending:
+                self.dropped += 1
+                stats.inc("updates_dropped")
+                return False
+            queue = self._queues.get(chat)
+            if queue is None:
+                queue = self._queues[chat] = deque()
+                self._ready.append(chat)
+                self._cond.notify()
+            queue.append((update, self.clock()))
+            self._pending += 1
+            stats.set("updates_queue", self._pending)
+        self.start()
+        return True
+
+    def pending(self):
+        with self._cond:
+            return self._pending
+
+    def flush(self, timeout=30.0):
+        """Wait until every submitted update was handled (or timeout). Returns True if idle."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if not self.pending():
+                return True
+            time.sleep(0.02)
+        return not self.pending()
+
+    def summary(self):
+        with self._cond:
+            return (f"📨 Updates: {self.handled} handled, {self._pending} queued "
+                    f"({len(self._queues)} chats), {self.dropped} dropped")
+
+    def start(self):
+        if self._threads:
+            return
+        with self._cond:
+            if self._threads:
+                return
+            self._stop = False
+            self._threads = [threading.Thread(target=self._run, name=f"updates_{i}", daemon=True)
+                             for i in range(self.workers)]
+        for t in self._threads:
+            t.start()
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        self._threads = []
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._ready and not self._stop:
+                    self._cond.wait()
+                if self._stop:
+                    return
+                chat = self._ready.popleft()
+                update, received = self._queues[chat].popleft()
+            stats.observe_value("update_wait_seconds", max(0.0, self.clock() - received))
+            t0 = stats.clock()
+            try:
+                self.handle(update)
+            except Exception as e:
+                stats.inc("errors", stage="update")
+                print(f"[updates] chat {chat} handler failed: {e}")
+            stats.observe("update_handle", t0)
+            with self._cond:
+                self.handled += 1
+                self._pending -= 1
+                stats.set("updates_queue", self._pending)
+                # the chat's next update goes to the back of the line: busy chats can't starve others
+                if self._queues[chat]:
+                    self._ready.append(chat)
+                    self._cond.notify()
+                else:
+                    del self._queues[chat]
+
+
+class WebhookServer:
+    """
+    Receives Telegram updates as HTTPS POSTs (TLS terminated by a proxy in front, or
+    a certificate via set_webhook) on `path` and submits them to the dispatcher by
+    chat. `secret` is required: only requests carrying it in X-Telegram-Bot-Api-Secret-Token
+    are accepted (403 otherwise), so nobody else can post updates. Answers at once; the
+    handler runs on the dispatcher's workers.
+    """
+
+    def __init__(self, dispatcher, port, secret, host="127.0.0.1", path="/telegram"):
+        if not secret:
+            raise ValueError("WebhookServer needs a secret token")
+        self.dispatcher = dispatcher
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self.received = 0
+        self._server = None
+
+    def start(self):
+        """Serve on a daemon thread; returns self (port 0 picks a free one, see .port)."""
+        hook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                status = hook._handle(self.path, self.headers, self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name="webhook_http", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _handle(self, path, headers, body):
+        if path.split("?")[0] != self.path:
+            return 404
+        token = headers.get("X-Telegram-Bot-Api-Secret-Token") or ""
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            stats.inc("webhook_rejected")
+            return 403
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return 400
+        self.received += 1
+        stats.inc("webhook_updates")
+        chat = update_chat_id(update)
+        return 200 if self.dispatcher.submit(chat if chat is not None else update.get("update_id"), update) else 503
@@ -0,0 +1,326 @@
+# fakes.py — offline stand-ins for Binance and Telegram (benchmarks, load tests, replays)
+import os
+import sys
+import time
+import json
+import zlib
+import importlib
+import threading
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+import pandas as pd
+
+from candles import INTERVAL_MS
+
+
+def _hash_uniform(seed, k):
+    """Deterministic uniform(0,1) per integer index (splitmix64), vectorized."""
+    with np.errstate(over="ignore"):
+        z = (np.asarray(k, dtype=np.uint64) + np.uint64(seed)) * np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+
+class SyntheticMarket:
+    """
+    Deterministic synthetic klines for any (symbol, interval): the candle with
+    open_time k*step always has the same OHLCV, so repeated/incremental fetches
+    are consistent. The candle containing `now` is open and moves with time.
+    """
+
+    def __init__(self, seed=0, clock=time.time):
+        self.seed = seed
+        self.clock = clock
+
+    def _params(self, symbol, interval):
+        h = zlib.crc32(f"{symbol}:{interval}:{self.seed}".encode())
+        base = 1 + (h % 50000) / 10.0
+        return h, base
+
+    def ohlcv(self, symbol, interval, first, last):
+        """Arrays (open_time, open, high, low, close, volume, close_time) for candle indices first..last."""
+        step = INTERVAL_MS[interval]
+        h, base = self._params(symbol, interval)
+        k = np.arange(first, last + 1, dtype=np.int64)
+        u = _hash_uniform(h, k)
+        close = base * (1 + 0.08 * np.sin(k / 97.0 + h % 7) + 0.03 * np.sin(k / 13.0) + 0.01 * (u - 0.5))
+        u_prev = _hash_uniform(h, k - 1)
+        open_ = base * (1 + 0.08 * np.sin((k - 1) / 97.0 + h % 7) + 0.03 * np.sin((k - 1) / 13.0) + 0.01 * (u_prev - 0.5))
+        wick = base * 0.004 * _hash_uniform(h + 1, k)
+        high = np.maximum(open_, close) + wick
+        low = np.minimum(open_, close) - wick
+        volume = 10 + 90 * _hash_uniform(h + 2, k)
+        t = k * step
+        # still-open candle: drift the close with elapsed time inside the candle
+        now = int(self.clock() * 1000)
+        if len(k) and t[-1] <= now < t[-1] + step:
+            frac = (now - t[-1]) / step
+            close = close.copy(); volume = volume.copy()
+            close[-1] = open_[-1] + (close[-1] - open_[-1]) * frac
+            high[-1] = max(high[-1], close[-1]); low[-1] = min(low[-1], close[-1])
+            volume[-1] *= frac
+        return t, open_, high, low, close, volume, t + step - 1
+
+    def rows(self, symbol, interval, limit=500, start_time=None, end_time=None):
+        """get_klines-style rows (strings for prices, like the REST API)."""
+        step = INTERVAL_MS[interval]
+        now_k = int(self.clock() * 1000) // step
+        last = now_k if end_time is None else min(now_k, end_time // step)
+        first = last - limit + 1 if start_time is None else -(-start_time // step)
+        last = min(last, first + limit - 1)
+        if last < first:
+            return []
+        t, o, h, l, c, v, ct = self.ohlcv(symbol, interval, first, last)
+        return [[int(t[i]), f"{o[i]:.8f}", f"{h[i]:.8f}", f"{l[i]:.8f}", f"{c[i]:.8f}", f"{v[i]:.8f}",
+                 int(ct[i]), "0", 0, "0", "0", "0"] for i in range(len(t))]
+
+    def frame(self, symbol, interval, n):
+        """fetch_klines-shaped DataFrame with n candles ending now (numeric OHLCV)."""
+        step = INTERVAL_MS[interval]
+        last = int(self.clock() * 1000) // step
+        t, o, h, l, c, v, ct = self.ohlcv(symbol, interval, last - n + 1, last)
+        return pd.DataFrame({"open_time": t, "open": o, "high": h, "low": l, "close": c,
+                             "volume": v, "close_time": ct})
+
+
+class FakeClient:
+    """
+    BinanceClient (governor.py) stand-in serving a SyntheticMarket (optional fixed latency).
+    symbols: the listed universe for get_ticker/get_exchange_info; delisted ones are BREAK.
+    """
+
+    def __init__(self, market=None, latency=0.0, symbols=None, delisted=(), *args, **kwargs):
+        self.market = market or SyntheticMarket()
+        self.latency = latency
+        self.symbols = list(symbols) if symbols is not None else [f"SYM{i}USDT" for i in range(400)]
+        self.delisted = set(delisted)
+        self.calls = 0
+        self.rows_served = 0
+        self._lock = threading.Lock()
+
+    def get_klines(self, symbol, interval, limit=500, startTime=None, endTime=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        rows = self.market.rows(symbol, interval, limit=limit, start_time=startTime, end_time=endTime)
+        with self._lock:
+            self.calls += 1
+            self.rows_served += len(rows)
+        return rows
+
+    def get_ticker(self, **kwargs):
+        """24h tickers for every listed symbol (from the synthetic 1h candles of the last day)."""
+        with self._lock:
+            self.calls += 1
+        out = []
+        for sym in self.symbols:
+            h, base = self.market._params(sym, "1h")
+            last = int(self.market.clock() * 1000) // INTERVAL_MS["1h"]
+            t, o, hi, lo, c, v, ct = self.market.ohlcv(sym, "1h", last - 23, last)
+            vol_scale = 1 + h % 1000
+            out.append({"symbol": sym, "lastPrice": f"{c[-1]:.8f}", "openPrice": f"{o[0]:.8f}",
+                        "highPrice": f"{hi.max():.8f}", "lowPrice": f"{lo.min():.8f}",
+                        "priceChangePercent": f"{(c[-1] / o[0] - 1) * 100:.3f}",
+                        "volume": f"{v.sum() * vol_scale:.8f}",
+                        "quoteVolume": f"{v.sum() * vol_scale * c[-1] * 100:.8f}",
+                        "count": 0 if sym in self.delisted else int(v.sum() * 10)})
+        return out
+
+    def get_exchange_info(self):
+        with self._lock:
+            self.calls += 1
+        return {"symbols": [{"symbol": s, "status": "BREAK" if s in self.delisted else "TRADING",
+                             "quoteAsset": "USDT", "isSpotTradingAllowed": True} for s in self.symbols]}
+
+    def ping(self):
+        return {}
+
+
+class StubBinanceServer:
+    """
+    Local HTTP stand-in for the Binance REST API (klines, ticker/24hr, exchangeInfo, ping)
+    backed by a FakeClient. Sends X-MBX-USED-WEIGHT-1M like Binance and answers 429 with
+    Retry-After once `weight_limit` is spent in the current minute. fail(status, n) scripts
+    the next n responses (429/418/500...). hits counts requests per path.
+
+        server = StubBinanceServer().start()
+        client = BinanceClient(base_url=server.url)
+    """
+
+    def __init__(self, fake=None, weight_limit=6000, latency=0.0, weights=None, clock=time.time):
+        from governor import WEIGHTS
+        self.fake = fake or FakeClient()
+        self.weight_limit = weight_limit
+        self.latency = latency
+        self.weights = weights or WEIGHTS
+        self.clock = clock   # weight windows (share a fake clock with the client to skip the waits)
+        self.hits = Counter()
+        self.statuses = Counter()
+        self.used = 0
+        self._window = None
+        self._script = deque()    # [(status, retry_after)]
+        self._lock = threading.Lock()
+        self._httpd = None
+        self.url = None
+
+    def fail(self, status, count=1, retry_after=None):
+        with self._lock:
+            self._script.extend([(status, retry_after)] * count)
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"   # keep-alive, as Binance
+            disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+            def do_GET(self):
+                status, headers, body = stub._handle(self.path)
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+        threading.Thread(target=self._httpd.serve_forever, name="stub_binance", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+
+    def _handle(self, raw_path):
+        parts = urlsplit(raw_path)
+        path, q = parts.path, {k: v[0] for k, v in parse_qs(parts.query).items()}
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.hits[path] += 1
+            now = self.clock()
+            window = int(now // 60)
+            if window != self._window:
+                self._window, self.used = window, 0
+            self.used += self.weights.get(path, 1) if path != "/api/v3/ticker/24hr" or "symbol" not in q else 2
+            scripted = self._script.popleft() if self._script else None
+            over = self.used > self.weight_limit
+            headers = {"X-MBX-USED-WEIGHT-1M": str(self.used)}
+        if scripted or over:
+            status, retry_after = scripted or (429, int((window + 1) * 60 - now) + 1)
+            if retry_after is not None:
+                headers["Retry-After"] = str(retry_after)
+            self.statuses[status] += 1
+            return status, headers, {"code": -1003 if status in (418, 429) else -1000, "msg": f"stub {status}"}
+        try:
+            if path == "/api/v3/klines":
+                body = self.fake.get_klines(q["symbol"], q["interval"], limit=int(q.get("limit", 500)),
+                                            startTime=int(q["startTime"]) if "startTime" in q else None,
+                                            endTime=int(q["endTime"]) if "endTime" in q else None)
+            elif path == "/api/v3/ticker/24hr":
+                body = self.fake.get_ticker()
+            elif path == "/api/v3/exchangeInfo":
+                body = self.fake.get_exchange_info()
+            elif path == "/api/v3/ping":
+                body = {}
+            else:
+                self.statuses[404] += 1
+                return 404, headers, {"code": -1000, "msg": "not found"}
+        except KeyError as e:
+            self.statuses[400] += 1
+            return 400, headers, {"code": -1102, "msg": f"missing {e}"}
+        self.statuses[200] += 1
+        return 200, headers, body
+
+
+class _Msg:
+    def __init__(self, chat_id, message_id, text):
+        self.chat = type("Chat", (), {"id": chat_id})()
+        self.message_id = message_id
+        self.text = text
+
+
+class StubBot:
+    """telebot.TeleBot stand-in that records outgoing messages instead of sending them."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.sent = []          # [(ts, chat_id, text)], edits included
+        self.edits = 0
+        self.message_handlers = []
+        self._lock = threading.Lock()
+
+    def press(self, chat_id, text):
+        """Deliver a user message (command or menu button) to the first matching handler, like polling would."""
+        m = _Msg(chat_id, 0, text)
+        for h in self.message_handlers:
+            f = h["filters"]
+            if f.get("commands"):
+                ok = text.startswith("/") and text[1:].split("@")[0].split()[0] in f["commands"]
+            else:
+                ok = f.get("func") is None or f["func"](m)
+            if ok:
+                h["function"](m)
+                return True
+        return False
+
+    def send_message(self, chat_id, text, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.sent.append((time.time(), chat_id, text))
+            return _Msg(chat_id, len(self.sent), text)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        """Recorded like a send (the user sees the new text at this moment); counted in .edits."""
+        with self._lock:
+            self.edits += 1
+            self.sent.append((time.time(), chat_id, text))
+            return _Msg(chat_id, message_id, text)
+
+    def process_new_updates(self, updates):
+        """Webhook path: telebot Update objects with a text message go through press()."""
+        for u in updates:
+            if u.message is not None and u.message.text is not None:
+                self.press(u.message.chat.id, u.message.text)
+
+    def __getattr__(self, name):
+        # any other Bot API call is a no-op offline
+        return lambda *args, **kwargs: None
+
+
+def telegram_update(update_id, chat_id, text):
+    """Bot API Update JSON for a user typing/pressing `text` in a private chat (webhook tests)."""
+    user = {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"}
+    return {"update_id": update_id,
+            "message": {"message_id": update_id, "date": int(time.time()), "text": text, "from": user,
+                        "chat": {"id": chat_id, "type": "private", "first_name": user["first_name"]}}}
+
+
+def load_bot_offline(client=None, stub=None, env=None):
+    """
+    Import bot.py with a FakeClient instead of the Binance REST client and route sends to a StubBot.
+    Returns the (freshly imported) module. Needs pyTelegramBotAPI installed.
+    """
+    os.environ.setdefault("TELEGRAM_TOKEN", "0:offline")
+    for k, v in (env or {}).items():
+        os.environ[k] = v
+    client = client or FakeClient()
+    sys.modules.pop("bot", None)
+    botmod = importlib.import_module("bot")
+    botmod.client.use(client)
+    stub = stub or StubBot()
+    stub.message_handlers = botmod.bot.message_handlers   # so stub.press() reaches the bot's handlers
+    botmod.bot = stub
+    return botmod
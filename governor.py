@@ -0,0 +1,287 @@
+# governor.py — Binance public REST client with weight budgeting, request coalescing, backoff and a circuit breaker
+import time
+import random
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import stats
+
+BINANCE_API_URL = "https://api.binance.com"
+WEIGHT_LIMIT_1M = 6000   # spot REQUEST_WEIGHT per minute per IP (exchangeInfo rateLimits)
+
+# request weight per endpoint (klines: 2 for any limit; 24h ticker for all symbols: 80)
+WEIGHTS = {"/api/v3/klines": 2, "/api/v3/ticker/24hr": 80, "/api/v3/exchangeInfo": 20, "/api/v3/ping": 1}
+
+
+class BinanceError(Exception):
+    def __init__(self, status, msg, code=None, retry_after=None):
+        super().__init__(f"HTTP {status}: {msg}")
+        self.status = status
+        self.code = code
+        self.retry_after = retry_after
+
+
+class CircuitOpen(BinanceError):
+    """Raised without a request while the breaker is open (repeated failures or a 418 ban)."""
+
+    def __init__(self, retry_after):
+        super().__init__(503, f"Binance API paused for {retry_after:.0f}s", retry_after=retry_after)
+
+
+class WeightBudget:
+    """
+    Token bucket over Binance's fixed 1-minute weight window. acquire() reserves the
+    weight of a request and waits for the next window when it would exceed
+    limit * safety; sync() adopts the X-MBX-USED-WEIGHT-1M the server reports, so
+    weight spent by anything else on the same IP counts too.
+    """
+
+    def __init__(self, limit=WEIGHT_LIMIT_1M, safety=0.8, clock=time.time, sleep=time.sleep):
+        self.limit = limit
+        self.safety = safety
+        self.clock = clock
+        self.sleep = sleep
+        self.used = 0
+        self._window = None
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def _roll(self, now):
+        window = int(now // 60)
+        if window != self._window:
+            self._window, self.used = window, 0
+
+    def acquire(self, weight):
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._roll(now)
+                if self.used + weight <= self.limit * self.safety or self.used == 0:
+                    self.used += weight
+                    return
+                wait = (self._window + 1) * 60 - now + 0.05
+            stats.inc("api_throttled")
+            self.waited += wait
+            self.sleep(wait)
+
+    def sync(self, used, at=None):
+        with self._lock:
+            self._roll(self.clock() if at is None else at)
+            self.used = max(self.used, used)
+
+    @property
+    def remaining(self):
+        with self._lock:
+            self._roll(self.clock())
+            return max(0, self.limit - self.used)
+
+
+class BinanceClient:
+    """
+    The part of binance.client.Client the bot uses (get_klines, get_ticker,
+    get_exchange_info, ping), over one pooled keep-alive session:
+
+    * every request reserves its weight in a WeightBudget (resynced from response headers);
+    * concurrent identical requests share one in-flight call (coalescing);
+    * 429 pauses all requests for Retry-After, 5xx/connection errors retry with jittered
+      exponential backoff, 418 (IP ban) opens the breaker for its Retry-After;
+    * `failure_threshold` consecutive failures open the breaker for `open_for` seconds,
+      during which calls raise CircuitOpen at once; then one trial call decides.
+    on_state(is_open, reason) is called when the breaker opens or closes.
+    """
+
+    def __init__(self, base_url=BINANCE_API_URL, weight_limit=WEIGHT_LIMIT_1M, pool_size=16, timeout=10,
+                 retries=3, backoff=0.5, max_backoff=30, failure_threshold=5, open_for=60,
+                 on_state=None, clock=time.time, sleep=time.sleep):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.open_for = open_for
+        self.on_state = on_state
+        self.clock = clock
+        self.sleep = sleep
+        self.budget = WeightBudget(weight_limit, clock=clock, sleep=sleep)
+        self.session = requests.Session()
+        # connections are reused across scan workers; no urllib3 retries, we handle them here
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept": "application/json", "User-Agent": "ta-bot"})
+        self._inflight = {}          # {request key: _Call}
+        self._lock = threading.Lock()
+        self._paused_until = 0.0     # 429: every request waits until then
+        self._open_until = 0.0       # breaker open until then
+        self._failures = 0
+        self._trial = False          # a half-open trial call is running
+        self.requests = 0
+        self.coalesced = 0
+
+    # ---------------- endpoints ----------------
+    def get_klines(self, **params):
+        return self._get("/api/v3/klines", params)
+
+    def get_ticker(self, **params):
+        return self._get("/api/v3/ticker/24hr", params, weight=2 if "symbol" in params else None)
+
+    def get_exchange_info(self):
+        return self._get("/api/v3/exchangeInfo", {})
+
+    def ping(self):
+        return self._get("/api/v3/ping", {})
+
+    # ---------------- state ----------------
+    @property
+    def is_open(self):
+        return self.clock() < self._open_until
+
+    def retry_in(self):
+        """Seconds until requests go out again (breaker or 429 pause), 0 if they do now."""
+        return max(0.0, self._open_until - self.clock(), self._paused_until - self.clock())
+
+    def summary(self):
+        state = f"paused {self.retry_in():.0f}s" if self.retry_in() else "ok"
+        return (f"🌐 Binance API: {state}, weight left {self.budget.remaining}/{self.budget.limit}, "
+                f"{self.requests} requests, {self.coalesced} coalesced, throttled {self.budget.waited:.0f}s")
+
+    # ---------------- internals ----------------
+    def _get(self, path, params, weight=None):
+        key = (path, tuple(sorted((k, v) for k, v in params.items() if v is not None)))
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            stats.inc("api_coalesced")
+            return call.wait()
+        try:
+            call.result = self._request(path, dict(key[1]), WEIGHTS.get(path, 1) if weight is None else weight)
+        except Exception as e:
+            call.error = e
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.done.set()
+        return call.wait()
+
+    def _admit(self):
+        """Breaker check before a request: raise CircuitOpen, or allow (as the half-open trial if due)."""
+        with self._lock:
+            now = self.clock()
+            if now < self._open_until:
+                raise CircuitOpen(self._open_until - now)
+            if self._failures >= self.failure_threshold:
+                if self._trial:
+                    raise CircuitOpen(1)
+                self._trial = True
+
+    def _request(self, path, params, weight):
+        self._admit()
+        attempt = 0
+        while True:
+            pause = self._paused_until - self.clock()
+            if pause > 0:
+                self.sleep(pause)
+            self.budget.acquire(weight)
+            t0 = stats.clock()
+            try:
+                resp = self.session.get(self.base_url + path, params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                err, retry_after = BinanceError(0, str(e)), None
+            else:
+                self.requests += 1
+                stats.inc("api_requests", endpoint=path.rsplit("/", 1)[-1])
+                stats.observe("api_" + path.rsplit("/", 1)[-1], t0)
+                used = resp.headers.get("X-MBX-USED-WEIGHT-1M")
+                if used is not None:
+                    self.budget.sync(int(used))
+                    stats.set("api_used_weight_1m", float(used))
+                stats.set("api_weight_remaining", float(self.budget.remaining))
+                if resp.status_code == 200:
+                    try:
+                        data = resp.json()
+                    except ValueError as e:
+                        # a torn or non-JSON body is a failed call like a 5xx (and ends a half-open trial)
+                        err, retry_after = BinanceError(200, f"undecodable response: {e}"), None
+                    else:
+                        self._success()
+                        return data
+                else:
+                    err = _error(resp)
+                    retry_after = err.retry_after
+                if resp.status_code == 418:
+                    self._trip(retry_after or self.open_for, f"IP banned (418), retry after {retry_after}s")
+                    raise err
+                if resp.status_code == 429:
+                    stats.inc("api_rate_limited")
+                    with self._lock:
+                        self._paused_until = max(self._paused_until, self.clock() + (retry_after or 1))
+                elif 400 <= resp.status_code < 500:
+                    self._success()   # our request was bad, the API is fine
+                    raise err
+            attempt += 1
+            if attempt > self.retries:
+                self._failure(err)
+                raise err
+            if retry_after is None:
+                delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+                self.sleep(delay * (0.5 + random.random()))   # jitter keeps workers from retrying in lockstep
+
+    def _success(self):
+        with self._lock:
+            was_open = self._failures >= self.failure_threshold
+            self._failures, self._trial, self._open_until = 0, False, 0.0
+        stats.set("api_circuit_open", 0)
+        if was_open and self.on_state:
+            self.on_state(False, "recovered")
+
+    def _failure(self, err):
+        with self._lock:
+            self._failures += 1
+            trip = self._failures >= self.failure_threshold
+            self._trial = False
+        if trip:
+            self._trip(self.open_for, f"{self._failures} failures, last: {err}")
+
+    def _trip(self, seconds, reason):
+        with self._lock:
+            self._open_until = self.clock() + seconds
+            self._failures = max(self._failures, self.failure_threshold)
+            self._trial = False
+        stats.set("api_circuit_open", 1)
+        stats.inc("api_circuit_trips")
+        print(f"[binance] circuit open for {seconds:.0f}s: {reason}")
+        if self.on_state:
+            self.on_state(True, reason)
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def _error(resp):
+    retry_after = resp.headers.get("Retry-After")
+    try:
+        body = resp.json()
+        msg, code = body.get("msg", resp.text), body.get("code")
+    except (ValueError, AttributeError):
+        msg, code = resp.text[:200], None
+    return BinanceError(resp.status_code, msg, code, float(retry_after) if retry_after else None)
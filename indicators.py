@@ -0,0 +1,325 @@
+# indicators.py — streaming O(1) indicator engine (same formulas as the `ta` path in compute_indicators)
+import copy
+import math
+import threading
+from collections import deque
+import numpy as np
+
+NAN = float("nan")
+COLUMNS = ["ema20", "ema50", "ema200", "rsi", "macd", "macd_signal", "atr", "vol_ma20"]
+
+RSI_WINDOW = 14
+ATR_WINDOW = 14
+VOL_WINDOW = 20
+MACD_FAST, MACD_SLOW, MACD_SIGN = 12, 26, 9
+EMA_SPANS = {"ema20": 20, "ema50": 50, "ema200": 200}
+HISTORY = 1000      # rows of raw EMA state kept to re-anchor on a window start (CandleStore max_len)
+
+
+def _ema_step(prev, x, span):
+    # ewm(span, adjust=False): first value seeds the average
+    if prev is None:
+        return x
+    a = 2.0 / (span + 1)
+    return a * x + (1 - a) * prev
+
+
+def indicator_arrays(high, low, close, volume):
+    """
+    Full indicator columns for one series without pandas (same values as
+    compute_indicators' `ta` path): {name: float64 array} for COLUMNS.
+    The recurrences run as plain float loops, which beats Series overhead
+    at bot window sizes.
+    """
+    h = np.asarray(high, dtype=float).tolist(); l = np.asarray(low, dtype=float).tolist()
+    c = np.asarray(close, dtype=float).tolist()
+    n = len(c)
+    out = {name: np.full(n, NAN) for name in COLUMNS}
+    if not n:
+        return out
+    for name, span in EMA_SPANS.items():
+        a = 2.0 / (span + 1); e = c[0]; col = out[name]
+        for i in range(n):
+            e = c[i] if i == 0 else a * c[i] + (1 - a) * e
+            if i >= span - 1:
+                col[i] = e
+    af, asl, asg = 2.0 / (MACD_FAST + 1), 2.0 / (MACD_SLOW + 1), 2.0 / (MACD_SIGN + 1)
+    ar = 1.0 / RSI_WINDOW
+    fast = slow = c[0]; sig = None; sig_n = 0
+    up = dn = 0.0; tr_sum = 0.0; atr = 0.0
+    rsi, macd_col, sig_col, atr_col = out["rsi"], out["macd"], out["macd_signal"], out["atr"]
+    for i in range(n):
+        x = c[i]
+        if i:
+            fast = af * x + (1 - af) * fast
+            slow = asl * x + (1 - asl) * slow
+            pc = c[i - 1]
+            diff = x - pc
+            up = ar * (diff if diff > 0 else 0.0) + (1 - ar) * up
+            dn = ar * (-diff if diff < 0 else 0.0) + (1 - ar) * dn
+            tr = max(h[i] - l[i], abs(h[i] - pc), abs(l[i] - pc))
+        else:
+            tr = h[i] - l[i]
+        k = i + 1
+        if k >= RSI_WINDOW:
+            rsi[i] = 100.0 if dn == 0 else 100 - 100 / (1 + up / dn)
+        if k < ATR_WINDOW:
+            tr_sum += tr
+            atr = 0.0
+        elif k == ATR_WINDOW:
+            tr_sum += tr
+            atr = tr_sum / ATR_WINDOW
+        else:
+            atr = (atr * (ATR_WINDOW - 1) + tr) / ATR_WINDOW
+        atr_col[i] = atr
+        if k >= MACD_SLOW:
+            m = fast - slow
+            macd_col[i] = m
+            sig = m if sig is None else asg * m + (1 - asg) * sig
+            sig_n += 1
+            if sig_n >= MACD_SIGN:
+                sig_col[i] = sig
+    v = np.asarray(volume, dtype=float)
+    if n >= VOL_WINDOW:
+        out["vol_ma20"][VOL_WINDOW - 1:] = np.lib.stride_tricks.sliding_window_view(v, VOL_WINDOW).mean(axis=1)
+    return out
+
+
+class IndicatorEngine:
+    """
+    Incremental EMA20/50/200, RSI14, MACD(12,26,9), ATR14 and volume MA20 for one (pair, tf).
+    update() either appends a new candle or revises the last (still-open) one:
+    the state before the last candle is kept as a snapshot and restored before
+    re-applying, so intra-candle updates never double count.
+    Warm-up follows `ta` (NaN for EMA/RSI/MACD/vol MA, 0 for ATR).
+
+    `ta` seeds each EMA with the first close of the window it is given, the engine with
+    the first candle it saw. EMA(adjust=False) is linear, so the window-seeded value is
+    E_t + (1-a)^(t-s) * (close_s - E_s) for window start s: the engine keeps E per row
+    for the last HISTORY rows and annotate() anchors the EMAs on df's first row in O(1).
+    """
+
+    def __init__(self):
+        self._st = self._empty()
+        self._rows = {}             # {open_time: (n, close, ema20, ema50, ema200)} raw EMA state per row
+        self._order = deque()       # open_times in _rows, oldest first
+        self._before_last = None    # snapshot taken before the last candle was applied
+        self.open_time = None       # open_time of the last applied candle
+        self.last = dict.fromkeys(COLUMNS, NAN)
+        self.prev = dict.fromkeys(COLUMNS, NAN)
+
+    @staticmethod
+    def _empty():
+        return {"n": 0, "ema20": None, "ema50": None, "ema200": None,
+                "ema_fast": None, "ema_slow": None, "sig": None, "sig_n": 0,
+                "up": 0.0, "dn": 0.0, "prev_close": None,
+                "tr_sum": 0.0, "atr": 0.0, "vols": deque(maxlen=VOL_WINDOW),
+                "out": dict.fromkeys(COLUMNS, NAN)}
+
+    def __len__(self):
+        return self._st["n"]
+
+    # ---------------- snapshot / rollback ----------------
+    def snapshot(self):
+        st = dict(self._st)
+        st["vols"] = deque(self._st["vols"], maxlen=VOL_WINDOW)
+        st["out"] = dict(self._st["out"])
+        return {"st": st, "before_last": self._before_last, "open_time": self.open_time,
+                "prev": dict(self.prev)}
+
+    def rollback(self, snap):
+        st = dict(snap["st"])
+        st["vols"] = deque(snap["st"]["vols"], maxlen=VOL_WINDOW)
+        st["out"] = dict(snap["st"]["out"])
+        self._st = st
+        self._before_last = snap["before_last"]
+        self.open_time = snap["open_time"]
+        self.prev = dict(snap["prev"])
+        self.last = dict(st["out"])
+
+    # ---------------- updates ----------------
+    def update(self, open_time, high, low, close, volume):
+        """Apply a candle; same open_time as the last one replaces it (open candle tick)."""
+        if self.open_time is not None and open_time == self.open_time:
+            self.rollback(self._before_last)
+        elif self.open_time is not None and open_time < self.open_time:
+            raise ValueError(f"out of order candle {open_time} < {self.open_time}")
+        before = self.snapshot()
+        before["before_last"] = None  # only the last candle is ever revised; keep the chain short
+        self.prev = dict(self._st["out"])
+        self._apply(float(high), float(low), float(close), float(volume))
+        st = self._st
+        if open_time not in self._rows:
+            self._order.append(open_time)
+            if len(self._order) > HISTORY:
+                del self._rows[self._order.popleft()]
+        self._rows[open_time] = (st["n"], float(close), st["ema20"], st["ema50"], st["ema200"])
+        self._before_last = before
+        self.open_time = open_time
+        self.last = dict(self._st["out"])
+        return self.last
+
+    def _apply(self, h, l, c, v):
+        st = self._st
+        st["n"] += 1
+        n = st["n"]
+        st["ema20"] = _ema_step(st["ema20"], c, 20)
+        st["ema50"] = _ema_step(st["ema50"], c, 50)
+        st["ema200"] = _ema_step(st["ema200"], c, 200)
+        st["ema_fast"] = _ema_step(st["ema_fast"], c, MACD_FAST)
+        st["ema_slow"] = _ema_step(st["ema_slow"], c, MACD_SLOW)
+
+        pc = st["prev_close"]
+        if pc is None:
+            up_i = dn_i = 0.0
+            tr = h - l
+        else:
+            diff = c - pc
+            up_i = diff if diff > 0 else 0.0
+            dn_i = -diff if diff < 0 else 0.0
+            tr = max(h - l, abs(h - pc), abs(l - pc))
+        st["prev_close"] = c
+
+        # RSI: Wilder smoothing via ewm(alpha=1/14, adjust=False)
+        if n == 1:
+            st["up"], st["dn"] = up_i, dn_i
+        else:
+            a = 1.0 / RSI_WINDOW
+            st["up"] = a * up_i + (1 - a) * st["up"]
+            st["dn"] = a * dn_i + (1 - a) * st["dn"]
+
+        # ATR: mean of first 14 TRs, then Wilder
+        if n < ATR_WINDOW:
+            st["tr_sum"] += tr
+            st["atr"] = 0.0
+        elif n == ATR_WINDOW:
+            st["tr_sum"] += tr
+            st["atr"] = st["tr_sum"] / ATR_WINDOW
+        else:
+            st["atr"] = (st["atr"] * (ATR_WINDOW - 1) + tr) / ATR_WINDOW
+
+        # MACD signal starts at the first valid MACD value
+        macd = NAN
+        if n >= MACD_SLOW:
+            macd = st["ema_fast"] - st["ema_slow"]
+            st["sig"] = _ema_step(st["sig"], macd, MACD_SIGN)
+            st["sig_n"] += 1
+
+        st["vols"].append(v)
+
+        out = st["out"] = {}
+        out["ema20"] = st["ema20"] if n >= 20 else NAN
+        out["ema50"] = st["ema50"] if n >= 50 else NAN
+        out["ema200"] = st["ema200"] if n >= 200 else NAN
+        if n < RSI_WINDOW:
+            out["rsi"] = NAN
+        elif st["dn"] == 0:
+            out["rsi"] = 100.0
+        else:
+            out["rsi"] = 100 - 100 / (1 + st["up"] / st["dn"])
+        out["macd"] = macd if n >= MACD_SLOW else NAN
+        out["macd_signal"] = st["sig"] if st["sig_n"] >= MACD_SIGN else NAN
+        out["atr"] = st["atr"]
+        out["vol_ma20"] = sum(st["vols"]) / VOL_WINDOW if len(st["vols"]) == VOL_WINDOW else NAN
+
+    def feed_df(self, df, start=0):
+        """Feed df rows [start:] (columns open_time/high/low/close/volume)."""
+        t = np.asarray(df["open_time"])
+        h = np.asarray(df["high"]); l = np.asarray(df["low"])
+        c = np.asarray(df["close"]); v = np.asarray(df["volume"])
+        for i in range(start, len(df)):
+            self.update(int(t[i]), h[i], l[i], c[i], v[i])
+
+    def window_ema(self, first_open_time, open_time):
+        """
+        {ema20, ema50, ema200} at open_time as `ta` computes them on a window starting at
+        first_open_time (seeded with that row's close), or None if either row is not kept.
+        """
+        s, t = self._rows.get(first_open_time), self._rows.get(open_time)
+        if s is None or t is None or t[0] < s[0]:
+            return None
+        steps = t[0] - s[0]
+        out = {}
+        for i, (name, span) in enumerate(EMA_SPANS.items(), start=2):
+            if steps + 1 < span:
+                out[name] = NAN
+            else:
+                out[name] = t[i] + (1 - 2.0 / (span + 1)) ** steps * (s[1] - s[i])
+        return out
+
+    def annotate(self, df):
+        """
+        Return df with indicator columns where only the last two rows are filled
+        (all that scoring and cross detection read), taken from the engine, with
+        the EMAs anchored on df's first row (same values as compute_indicators(df)).
+        """
+        n = len(df)
+        times = np.asarray(df["open_time"]) if n else ()
+        cols = {}
+        for name in COLUMNS:
+            cols[name] = np.full(n, np.nan)
+        for row, values in ((-1, self.last), (-2, self.prev)):
+            if n < -row:
+                continue
+            anchored = self.window_ema(int(times[0]), int(times[row]))
+            for name in COLUMNS:
+                cols[name][row] = anchored[name] if anchored is not None and name in anchored else values[name]
+        return df.assign(**cols)
+
+
+class EngineRegistry:
+    """IndicatorEngine per (pair, tf), kept in sync with fetched DataFrames."""
+
+    def __init__(self):
+        self._engines = {}
+        self._lock = threading.Lock()
+
+    def get(self, pair, tf):
+        return self._engines.get((pair, tf))
+
+    def drop(self, pair, tf):
+        with self._lock:
+            self._engines.pop((pair, tf), None)
+
+    def export(self):
+        with self._lock:
+            return copy.deepcopy(self._engines)
+
+    def restore(self, engines):
+        with self._lock:
+            self._engines.update(engines)
+
+    def sync(self, pair, tf, df):
+        """
+        Catch the engine up with df: only rows from the engine's last candle onward
+        are applied (usually 1-2). A new engine or a gap beyond the df window reseeds.
+        annotate(df) then re-anchors the EMAs on df's first row, so on sliding windows
+        every column matches compute_indicators within 1e-6 (RSI/MACD/ATR keep a seed
+        gap below 1e-8) and labels agree; bench.py --check verifies both.
+        """
+        if df is None or not len(df):
+            return None
+        with self._lock:
+            times = np.asarray(df["open_time"])
+            eng = self._engines.get((pair, tf))
+            if eng is None or eng.open_time is None or eng.open_time < times[0] or eng.open_time > times[-1]:
+                eng = IndicatorEngine()
+                eng.feed_df(df)
+                self._engines[(pair, tf)] = eng
+            else:
+                start = int(np.searchsorted(times, eng.open_time))
+                eng.feed_df(df, start)
+            return eng
+
+
+def max_rel_diff(engine_values, ref_row, columns=COLUMNS):
+    """Largest relative |engine - reference| over columns, ignoring warm-up NaNs (bench.py --check)."""
+    worst = 0.0
+    for name in columns:
+        a, b = engine_values[name], float(ref_row[name])
+        if math.isnan(a) and math.isnan(b):
+            continue
+        if math.isnan(a) != math.isnan(b):
+            return float("inf")
+        worst = max(worst, abs(a - b) / max(1.0, abs(b)))
+    return worst
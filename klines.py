@@ -0,0 +1,102 @@
+# klines.py — compact column store for one kline window: int64 times + float64 OHLCV, zero-copy slices
+import numpy as np
+
+# columns kept from the 12-field Binance row (the rest is never read by the analysis)
+COLUMNS = ("open_time", "open", "high", "low", "close", "volume", "close_time")
+ROW_INDEX = {"open_time": 0, "open": 1, "high": 2, "low": 3, "close": 4, "volume": 5, "close_time": 6}
+INT_COLUMNS = ("open_time", "close_time")
+
+
+class _ILoc:
+    __slots__ = ("_k",)
+
+    def __init__(self, k):
+        self._k = k
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self._k[i]
+        return self._k.row(i)
+
+
+class Klines:
+    """
+    Kline window as contiguous NumPy columns (plus any indicator columns added with
+    assign()). Supports the small DataFrame surface the analysis uses -- k["close"]
+    (ndarray), len(k), k.iloc[-1] (row dict), k.iloc[a:b] / k[a:b] (views) -- so
+    analysis, levels and indicator code take it or a DataFrame interchangeably.
+    to_frame() is the pandas adapter.
+    """
+
+    __slots__ = ("cols",)
+
+    def __init__(self, cols):
+        self.cols = cols
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Parse get_klines rows (prices as strings or numbers) straight into columns."""
+        cols = {}
+        for name in COLUMNS:
+            i = ROW_INDEX[name]
+            dtype = np.int64 if name in INT_COLUMNS else np.float64
+            cols[name] = np.array([r[i] for r in rows], dtype=dtype) if rows else np.empty(0, dtype=dtype)
+        return cls(cols)
+
+    @classmethod
+    def from_frame(cls, df):
+        return cls({name: np.ascontiguousarray(df[name].values,
+                                               dtype=np.int64 if name in INT_COLUMNS else np.float64)
+                    for name in COLUMNS if name in df})
+
+    @classmethod
+    def from_columns(cls, columns):
+        """From a {column: array} mapping, e.g. KlineStore.read() memmaps (no copy)."""
+        return cls({name: columns[name] for name in COLUMNS if name in columns})
+
+    # ---------------- DataFrame-like surface ----------------
+    def __len__(self):
+        return len(self.cols["close"])
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.cols[key]
+        if isinstance(key, slice):
+            return Klines({name: arr[key] for name, arr in self.cols.items()})
+        raise TypeError(f"Klines index must be a column name or slice, got {type(key).__name__}")
+
+    def __contains__(self, name):
+        return name in self.cols
+
+    @property
+    def columns(self):
+        return list(self.cols)
+
+    @property
+    def iloc(self):
+        return _ILoc(self)
+
+    def row(self, i):
+        """One candle as {column: python scalar}."""
+        return {name: arr[i].item() for name, arr in self.cols.items()}
+
+    def tail(self, n):
+        return self[-n:] if n else self[0:0]
+
+    def assign(self, **columns):
+        """New Klines sharing the existing columns plus/replacing the given ones."""
+        cols = dict(self.cols)
+        cols.update({k: np.asarray(v) for k, v in columns.items()})
+        return Klines(cols)
+
+    def copy(self):
+        return Klines({name: arr.copy() for name, arr in self.cols.items()})
+
+    @property
+    def nbytes(self):
+        return sum(arr.nbytes for arr in self.cols.values())
+
+    def to_frame(self):
+        """pandas adapter (copies)."""
+        import pandas as pd
+        return pd.DataFrame({name: np.asarray(arr) for name, arr in self.cols.items()})
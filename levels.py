@@ -0,0 +1,127 @@
+# levels.py — incremental per-(pair, tf) support/resistance index with O(log n) nearest-level queries
+import copy
+import threading
+import numpy as np
+
+from analysis import cluster_levels, nearest_level
+
+
+class LevelIndex:
+    """
+    Support/resistance levels of a sliding candle window, equal to
+    get_levels_from_df(window, order, cluster_threshold), maintained incrementally.
+
+    Extrema of bars whose +-order neighbourhood is fully closed are cached by
+    open_time; only the newest bar whose neighbourhood touches the still-open
+    candle is re-checked on every update. Clusters are rebuilt only when the
+    extrema set changes.
+    """
+
+    def __init__(self, order=4, cluster_threshold=0.006):
+        self.order = order
+        self.cluster_threshold = cluster_threshold
+        self._minima = {}          # {open_time: close} confirmed from closed candles
+        self._maxima = {}
+        self._checked_until = None  # last open_time whose extremum status is cached
+        self._key = None
+        self.supports = []          # ascending
+        self.resistances = []       # descending (same as get_levels_from_df)
+        self.rebuilds = 0
+
+    def update(self, times, closes):
+        """Bring the index in line with a window (arrays of open_time and close, last row may be open)."""
+        times = np.asarray(times); closes = np.asarray(closes)
+        n = len(closes); k = self.order; w = 2 * k + 1
+        if n < w:
+            self._minima.clear(); self._maxima.clear(); self._checked_until = None
+            return self._set_levels([], [])
+        # bars before index `order` have a truncated left side in this window -> not extrema
+        first_valid = times[k]
+        for book in (self._minima, self._maxima):
+            for t in [t for t in book if t < first_valid]:
+                del book[t]
+        # cache bars order..n-2-order (neighbourhood fully closed), check bar n-1-order fresh
+        last_cached = n - 2 - k
+        start = k
+        if self._checked_until is not None:
+            start = max(k, int(np.searchsorted(times, self._checked_until, side="right")))
+            if start > k and times[start - 1] != self._checked_until:
+                # history changed under us (gap or reload) -> rebuild from scratch
+                self._minima.clear(); self._maxima.clear(); start = k
+        if start <= last_cached:
+            self._scan(times, closes, start, last_cached, self._minima, self._maxima)
+            self._checked_until = times[last_cached]
+        tail_min, tail_max = {}, {}
+        self._scan(times, closes, n - 1 - k, n - 1 - k, tail_min, tail_max)
+        mins = list(self._minima.values()) + list(tail_min.values())
+        maxs = list(self._maxima.values()) + list(tail_max.values())
+        return self._set_levels(mins, maxs)
+
+    def _scan(self, times, closes, lo, hi, minima, maxima):
+        k = self.order
+        seg = closes[lo - k:hi + k + 1]
+        win = np.lib.stride_tricks.sliding_window_view(seg, 2 * k + 1)
+        mid = closes[lo:hi + 1]
+        for i in np.flatnonzero(mid == win.min(axis=1)) + lo:
+            minima[times[i]] = closes[i]
+        for i in np.flatnonzero(mid == win.max(axis=1)) + lo:
+            maxima[times[i]] = closes[i]
+
+    def _set_levels(self, mins, maxs):
+        key = (tuple(sorted(mins)), tuple(sorted(maxs)))
+        if key != self._key:
+            self._key = key
+            self.supports = sorted(cluster_levels(list(key[0]), threshold=self.cluster_threshold))
+            self.resistances = sorted(cluster_levels(list(key[1]), threshold=self.cluster_threshold), reverse=True)
+            self.rebuilds += 1
+        return self.supports, self.resistances
+
+    # ---------------- queries ----------------
+    def nearest_support(self, price):
+        """Support closest to price (either side), or None; bisection over the sorted levels."""
+        return nearest_level(self.supports, price)
+
+    def nearest_resistance(self, price):
+        """Resistance closest to price (either side), or None."""
+        return nearest_level(self.resistances, price)
+
+    def nearest(self, price):
+        """Closest level of either kind: (level, "support"/"resistance") or (None, None)."""
+        s, r = self.nearest_support(price), self.nearest_resistance(price)
+        if s is None and r is None:
+            return None, None
+        if r is None or (s is not None and abs(price - s) <= abs(r - price)):
+            return s, "support"
+        return r, "resistance"
+
+
+class LevelRegistry:
+    """LevelIndex per (pair, tf)."""
+
+    def __init__(self, order=4, cluster_threshold=0.006):
+        self.order = order
+        self.cluster_threshold = cluster_threshold
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def get(self, pair, tf):
+        return self._indexes.get((pair, tf))
+
+    def export(self):
+        with self._lock:
+            return copy.deepcopy(self._indexes)
+
+    def restore(self, indexes):
+        """Load exported indexes; ones built with other level settings are dropped (rebuilt on next sync)."""
+        with self._lock:
+            self._indexes.update({key: idx for key, idx in indexes.items()
+                                  if (idx.order, idx.cluster_threshold) == (self.order, self.cluster_threshold)})
+
+    def sync(self, pair, tf, df):
+        """Update the (pair, tf) index from df; returns the LevelIndex."""
+        with self._lock:
+            idx = self._indexes.get((pair, tf))
+            if idx is None:
+                idx = self._indexes[(pair, tf)] = LevelIndex(self.order, self.cluster_threshold)
+            idx.update(np.asarray(df["open_time"]), np.asarray(df["close"]))
+            return idx
@@ -0,0 +1,428 @@
+# loadtest.py — record live Binance responses / outgoing messages, replay them (or synthetic scale) offline, fast
+#
+# record:  RECORD_DIR=rec/ python bot.py            (rest.jsonl: get_klines/ticker/exchangeInfo, sends.jsonl)
+# replay:  python loadtest.py replay rec/ [--speed 60] [--chats 200] [--state bot_state.pkl]
+# synth:   python loadtest.py synth --symbols 300 --chats 1000 --hours 6 --speed 600 --burst 50
+import os
+import sys
+import json
+import time
+import bisect
+import random
+import argparse
+import resource
+import threading
+import tracemalloc
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from candles import INTERVAL_MS
+from fakes import SyntheticMarket, FakeClient, StubBot, load_bot_offline
+
+_real_time = time.time
+
+
+# ---------------- recording ----------------
+class Recorder:
+    """Appends Binance REST responses (rest.jsonl) and sent messages (sends.jsonl) under root."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def write(self, name, record):
+        line = json.dumps(dict(record, t=time.time()), separators=(",", ":"))
+        with self._lock, open(os.path.join(self.root, name + ".jsonl"), "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def client(self, inner):
+        return RecordingClient(inner, self)
+
+    def sends(self, send):
+        def recorded_send(chat_id, text, **kwargs):
+            result = send(chat_id, text, **kwargs)
+            self.write("sends", {"chat_id": chat_id, "text": text})
+            return result
+        return recorded_send
+
+
+class RecordingClient:
+    """Passes calls to the real client and records get_klines/get_ticker/get_exchange_info responses."""
+
+    def __init__(self, inner, recorder):
+        self._inner = inner
+        self._recorder = recorder
+
+    def _call(self, method, params):
+        response = getattr(self._inner, method)(**params)
+        self._recorder.write("rest", {"method": method, "params": params, "response": response})
+        return response
+
+    def get_klines(self, **params):
+        return self._call("get_klines", params)
+
+    def get_ticker(self, **params):
+        return self._call("get_ticker", params)
+
+    def get_exchange_info(self):
+        return self._call("get_exchange_info", {})
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+
+def read_jsonl(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# ---------------- replay ----------------
+class RecordedMarket:
+    """
+    SyntheticMarket stand-in serving recorded get_klines rows as of clock(): closed
+    candles use a version recorded after they closed (final), the open candle the
+    latest version recorded so far.
+    """
+
+    def __init__(self, records, clock=time.time):
+        self.clock = clock
+        self._final = defaultdict(dict)                        # {(symbol, tf): {open_time: row}}
+        self._partial = defaultdict(lambda: defaultdict(list))  # {(symbol, tf): {open_time: [(t_ms, row)]}}
+        for rec in records:
+            if rec["method"] != "get_klines":
+                continue
+            key = (rec["params"]["symbol"], rec["params"]["interval"])
+            t_ms = int(rec["t"] * 1000)
+            for row in rec["response"]:
+                if t_ms > row[6]:
+                    self._final[key][row[0]] = row
+                else:
+                    self._partial[key][row[0]].append((t_ms, row))
+        self._times = {key: sorted(set(self._final[key]) | set(self._partial[key]))
+                       for key in set(self._final) | set(self._partial)}
+
+    def series(self):
+        return sorted(self._times)
+
+    def rows(self, symbol, interval, limit=500, start_time=None, end_time=None):
+        key = (symbol, interval)
+        times = self._times.get(key, [])
+        now = int(self.clock() * 1000)
+        out = []
+        for ot in times[bisect.bisect_left(times, start_time or 0):]:
+            if ot > now or (end_time is not None and ot > end_time):
+                break
+            row = self._final[key].get(ot)
+            if row is None or row[6] >= now:   # still open at `now`: latest partial seen by then
+                seen = [r for t, r in self._partial[key].get(ot, ()) if t <= now]
+                row = seen[-1] if seen else row
+            if row is not None:
+                out.append(row)
+        return out[:limit] if start_time is not None else out[-limit:]
+
+
+class ReplayClient(FakeClient):
+    """FakeClient over a RecordedMarket; tickers/exchange info are the latest recorded before clock()."""
+
+    def __init__(self, market, records):
+        symbols = sorted({s for s, _ in market.series()})
+        super().__init__(market, symbols=symbols)
+        self._recorded = {m: sorted(((r["t"], r["response"]) for r in records if r["method"] == m), key=lambda x: x[0])
+                          for m in ("get_ticker", "get_exchange_info")}
+
+    def _latest(self, method, fallback):
+        seen = [resp for t, resp in self._recorded[method] if t <= self.market.clock()]
+        recorded = seen[-1] if seen else (self._recorded[method][0][1] if self._recorded[method] else None)
+        return recorded if recorded is not None else fallback()
+
+    def get_ticker(self, **kwargs):
+        return self._latest("get_ticker", super().get_ticker)
+
+    def get_exchange_info(self):
+        return self._latest("get_exchange_info", super().get_exchange_info)
+
+
+class VirtualClock:
+    """time.time() replacement running `speed` times faster than real time from `start`."""
+
+    def __init__(self, start, speed=60.0):
+        self.start = start
+        self.speed = speed
+        self._t0 = time.monotonic()
+
+    def __call__(self):
+        return self.start + (time.monotonic() - self._t0) * self.speed
+
+    def install(self, botmod, market):
+        """
+        Run the bot on this clock: time.time is replaced process-wide (monotonic timers and
+        sleeps stay real) and the scheduler/outbox wait speed-times shorter.
+        """
+        time.time = self
+        market.clock = self
+        for component in (botmod.scheduler, botmod.outbox):
+            component.clock = self
+            component.speed = self.speed
+        if botmod.market_context is not None:
+            botmod.market_context.clock = self
+
+    @staticmethod
+    def uninstall():
+        time.time = _real_time
+
+
+# ---------------- load run ----------------
+def synth_chats(botmod, count, symbols, seed=0):
+    """`count` chats spread over auto/manual/scalp/levels on random symbols and timeframes."""
+    rng = random.Random(seed)
+    tfs = ["5m", "15m", "1h", "4h"]
+    for chat_id in range(1, count + 1):
+        mode = ["auto", "manual", "scalp", "levels"][chat_id % 4]
+        pair, tf = rng.choice(symbols), rng.choice(tfs)
+        botmod.subs.update(chat_id, mode=mode, send_weak=chat_id % 3 == 0,
+                           pair=pair if mode != "auto" else None,
+                           timeframe=tf if mode in ("manual", "levels") else None,
+                           scalp_enabled=mode == "scalp", levels_enabled=mode == "levels")
+
+
+MENU_SCRIPTS = [
+    ["/start", "🧭 Manual (ручной)", "{pair}", "{tf}"],
+    ["/start", "⚡ Scalp (скальпинг 5m)", "{pair}"],
+    ["/start", "🎯 Levels (уровни)", "{pair}", "{tf}"],
+    ["🤖 Auto (авто)", "🧰 Toggle Weak (вкл/выкл weak)"],
+    ["🛑 Stop (выключить автоскан/скальп)", "🔙 Назад"],
+]
+
+
+class LoadRun:
+    """
+    Drives an offline bot (load_bot_offline) on a VirtualClock and measures:
+    candle close -> message delivered (signal latency), button press -> reply delivered,
+    scheduler lag / late and dropped jobs, peak memory.
+    """
+
+    def __init__(self, botmod, stub, late_after=30.0):
+        self.bot = botmod
+        self.stub = stub
+        self.late_after = late_after          # virtual seconds after close + settle
+        self.runs = defaultdict(set)          # {(tag, pair, tf): {close_time}}
+        self.lags = []                        # virtual seconds, job start - candle close
+        self.origin = defaultdict(list)       # {chat_id: [(kind, text, origin time)]}: "signal" from candle close, "reply" from press
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._instrument()
+
+    def _instrument(self):
+        sched, run = self.bot.scheduler, self.bot.scheduler._run_job
+
+        def run_job(tag, job, pair, tf, close_time):
+            with self._lock:
+                self.runs[(tag, pair, tf)].add(close_time)
+                self.lags.append(sched.clock() - (close_time + 1) / 1000.0)
+            self._local.origin = ("signal", (close_time + 1) / 1000.0)
+            try:
+                return run(tag, job, pair, tf, close_time)
+            finally:
+                self._local.origin = None
+
+        sched._run_job = run_job
+        safe_send = self.bot.safe_send
+
+        def traced_send(chat_id, text, *args, **kwargs):
+            origin = getattr(self._local, "origin", None)
+            if origin is not None:
+                with self._lock:
+                    self.origin[chat_id].append((origin[0], text, origin[1]))
+            return safe_send(chat_id, text, *args, **kwargs)
+
+        self.bot.safe_send = traced_send
+
+    def press(self, chat_id, text, pressed=None):
+        """User message through the bot's handlers; replies queued by the handler are timed from `pressed`."""
+        self._local.origin = ("reply", time.time() if pressed is None else pressed)
+        try:
+            return self.stub.press(chat_id, text)
+        finally:
+            self._local.origin = None
+
+    def run(self, duration, speed, bursts=(), symbols=(), seed=0, trace_memory=False):
+        """
+        bursts: [(virtual offset s, number of users)] pressing through a MENU_SCRIPTS flow at once.
+        trace_memory: also report the peak of Python allocations (tracemalloc; slows the bot down a lot).
+        """
+        rng = random.Random(seed)
+        clock = time.time
+        start = clock()
+        rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if trace_memory:
+            tracemalloc.start()
+        self.bot.scheduler.start()
+        # telebot runs handlers on a small worker pool (2 threads by default)
+        handlers = ThreadPoolExecutor(max_workers=2, thread_name_prefix="handler")
+        pending = sorted(bursts)
+        while clock() < start + duration:
+            while pending and clock() >= start + pending[0][0]:
+                _, users = pending.pop(0)
+                for user in range(users):
+                    chat_id = 10_000_000 + rng.randrange(10 * users)
+                    script = rng.choice(MENU_SCRIPTS)
+                    pair, tf = rng.choice(list(symbols) or self.bot.PAIRS), rng.choice(["5m", "15m", "1h", "4h"])
+                    handlers.submit(self._flow, chat_id, [s.format(pair=pair, tf=tf) for s in script], clock())
+            time.sleep(0.02)
+        handlers.shutdown(wait=True)
+        self.bot.scheduler.stop()
+        self.bot.outbox.flush(timeout=30)
+        end = clock()
+        peak_traced = None
+        if trace_memory:
+            _, peak_traced = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        return self.report(start, end, speed, rss0, peak_traced)
+
+    def _flow(self, chat_id, texts, submitted):
+        # the first press waits for a free handler thread like a real update would
+        for i, text in enumerate(texts):
+            try:
+                self.press(chat_id, text, submitted if i == 0 else None)
+            except Exception as e:
+                print(f"[loadtest] handler error on {text!r}: {e}")
+
+    def report(self, start, end, speed, rss0, peak_traced):
+        # a delivered message may be a digest of several queued texts: each one found in it counts
+        latency = {"signal": [], "reply": []}
+        for ts, chat_id, text in self.stub.sent:
+            queued = self.origin.get(chat_id)
+            if not queued:
+                continue
+            for kind, part, t in queued:
+                if part in text:
+                    latency[kind].append(ts - t)
+            self.origin[chat_id] = [q for q in queued if q[1] not in text]
+        undelivered = sum(len(q) for q in self.origin.values())
+        signal_latency, reply_latency = latency["signal"], latency["reply"]
+        sched = self.bot.scheduler
+        expected = missing = 0
+        settle = sched.settle
+        with sched._cond:
+            jobs = {tag: (keys, trigger) for tag, (job, keys, trigger) in sched._jobs.items()}
+        for tag, (keys, trigger) in jobs.items():
+            for pair, tf in keys:
+                step = INTERVAL_MS[trigger or tf]
+                # closes fully inside the run, leaving late_after for the job to start
+                first = int(start * 1000) // step + 1
+                last = int((end - settle - self.late_after) * 1000) // step
+                closes = {k * step - 1 for k in range(first, last + 1)}
+                expected += len(closes)
+                missing += len(closes - self.runs.get((tag, pair, tf), set()))
+        lags = np.array(self.lags)
+        pct = lambda a, q: float(np.percentile(a, q)) if len(a) else float("nan")
+        return {
+            "virtual_seconds": end - start, "speed": speed,
+            "chats": len(self.bot.subs), "jobs_run": len(self.lags),
+            "messages": len(self.stub.sent), "signals_traced": len(signal_latency), "undelivered": undelivered,
+            "signal_latency_p50": pct(signal_latency, 50), "signal_latency_p99": pct(signal_latency, 99),
+            "reply_latency_p50": pct(reply_latency, 50), "reply_latency_p99": pct(reply_latency, 99),
+            "replies": len(reply_latency),
+            "job_lag_p50": pct(lags, 50), "job_lag_p99": pct(lags, 99),
+            "late_jobs": int((lags > settle + self.late_after).sum()),
+            "expected_jobs": expected, "dropped_jobs": missing,
+            "api_calls": getattr(self.bot.client, "calls", None),
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "rss_growth_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss0) / 1024,
+            "peak_traced_mb": peak_traced / 2**20 if peak_traced is not None else None,
+        }
+
+
+def print_report(r):
+    sec = lambda v, digits=1: "-" if v != v else f"{v:.{digits}f}s"   # nan: no samples
+    print(f"{r['virtual_seconds'] / 3600:.1f}h virtual at {r['speed']:.0f}x, {r['chats']} chats")
+    print(f"jobs: {r['jobs_run']} run, {r['late_jobs']} late, {r['dropped_jobs']}/{r['expected_jobs']} dropped; "
+          f"lag p50 {sec(r['job_lag_p50'])} p99 {sec(r['job_lag_p99'])} (virtual, from candle close)")
+    print(f"messages: {r['messages']}, signal latency close->sent p50 {sec(r['signal_latency_p50'])} "
+          f"p99 {sec(r['signal_latency_p99'])} over {r['signals_traced']} signals (virtual), "
+          f"{r['undelivered']} queued texts never sent")
+    print(f"button replies: {r['replies']}, latency p50 {sec(r['reply_latency_p50'], 2)} "
+          f"p99 {sec(r['reply_latency_p99'], 2)} (virtual)")
+    traced = f", peak traced {r['peak_traced_mb']:.0f} MiB" if r["peak_traced_mb"] is not None else ""
+    print(f"Binance calls: {r['api_calls']}, peak RSS {r['peak_rss_mb']:.0f} MiB (+{r['rss_growth_mb']:.0f}){traced}")
+
+
+def boot(client, market, start, speed, symbols, env=None):
+    """Offline bot on a VirtualClock at `start`, universe = `symbols`."""
+    env = dict({"SNAPSHOT_PATH": "", "LEVEL_TICKS": "0", "UNIVERSE_TOP_N": str(len(symbols))}, **(env or {}))
+    stub = StubBot()
+    botmod = load_bot_offline(client=client, stub=stub, env=env)
+    clock = VirtualClock(start, speed)
+    clock.install(botmod, market)
+    botmod.refresh_universe()
+    return botmod, stub
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Offline load test: recorded or synthetic market, stub Telegram")
+    ap.add_argument("mode", choices=["replay", "synth"])
+    ap.add_argument("record_dir", nargs="?", help="RECORD_DIR of a recorded session (replay)")
+    ap.add_argument("--symbols", type=int, default=100, help="synth: universe size")
+    ap.add_argument("--hours", type=float, default=4.0, help="synth: virtual hours to run")
+    ap.add_argument("--speed", type=float, default=300.0, help="virtual seconds per real second")
+    ap.add_argument("--chats", type=int, default=200, help="chats spread over all modes")
+    ap.add_argument("--state", help="replay: restore chats from this bot snapshot instead of synthesizing them")
+    ap.add_argument("--burst", type=int, default=30, help="users pressing menu buttons at once")
+    ap.add_argument("--burst-every", type=float, default=1800.0, help="virtual seconds between bursts")
+    ap.add_argument("--trace-memory", action="store_true", help="tracemalloc peak too (much slower run)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="write the report JSON here")
+    args = ap.parse_args(argv)
+
+    if args.mode == "replay":
+        if not args.record_dir:
+            ap.error("replay needs the recording directory")
+        records = read_jsonl(os.path.join(args.record_dir, "rest.jsonl"))
+        sends = read_jsonl(os.path.join(args.record_dir, "sends.jsonl"))
+        if not records:
+            ap.error(f"no rest.jsonl records in {args.record_dir}")
+        market = RecordedMarket(records)
+        client = ReplayClient(market, records)
+        start, end = records[0]["t"], records[-1]["t"]
+        symbols = client.symbols
+    else:
+        market = SyntheticMarket(seed=args.seed)
+        symbols = [f"SYM{i}USDT" for i in range(args.symbols)]
+        client = FakeClient(market, symbols=symbols)
+        # start just before a 4h boundary so every timeframe closes during the run
+        start = (int(_real_time()) // (4 * 3600)) * 4 * 3600 - 60
+        end = start + args.hours * 3600
+        sends = []
+    try:
+        botmod, stub = boot(client, market, start, args.speed, symbols)
+        if args.state:
+            import snapshot
+            parts, _ = snapshot.load(args.state, layout=botmod.SNAPSHOT_LAYOUT)
+            botmod.subs.restore(parts["chats"] if parts else {})
+        else:
+            synth_chats(botmod, args.chats, symbols, args.seed)
+        botmod.refresh_jobs()
+        run = LoadRun(botmod, stub)
+        bursts = [(t, args.burst) for t in np.arange(args.burst_every / 2, end - start, args.burst_every)]
+        report = run.run(end - start, args.speed, bursts, symbols, args.seed, args.trace_memory)
+    finally:
+        VirtualClock.uninstall()
+    print_report(report)
+    if sends:
+        recorded = Counter(s["text"] for s in sends)
+        replayed = Counter(text for _, _, text in stub.sent)
+        same = sum((recorded & replayed).values())
+        print(f"recorded session sent {len(sends)} messages; {same} identical texts sent again in the replay")
+        report.update(recorded_messages=len(sends), identical_messages=same)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
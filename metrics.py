@@ -0,0 +1,187 @@
+# metrics.py — per-stage latency histograms, counters and gauges with a Prometheus text exporter
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# seconds; covers in-process stages (sub-ms) up to slow network calls
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count", "max")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, v):
+        for i, b in enumerate(BUCKETS):
+            if v <= b:
+                self.counts[i] += 1
+                break
+        self.sum += v
+        self.count += 1
+        if v > self.max:
+            self.max = v
+
+    def quantile(self, q):
+        """Bucket upper bound containing quantile q (approximate)."""
+        if not self.count:
+            return 0.0
+        target, seen = q * self.count, 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                return BUCKETS[i]
+        return self.max
+
+
+class Metrics:
+    """
+    Thread-safe registry. When disabled, clock() returns 0 and observe()/inc()/set()
+    return immediately, so call sites cost a function call and a branch.
+
+    usage:
+        t0 = stats.clock(); ...; stats.observe("indicators", t0, pair, tf)
+        stats.inc("errors", stage="fetch")
+        stats.set("api_used_weight", 123)
+    """
+
+    def __init__(self, enabled=False, prefix="bot"):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.started = time.time()
+        self._hist = {}       # {(name, labels): _Histogram}
+        self._counters = {}   # {(name, labels): float}
+        self._gauges = {}     # {(name, labels): float}
+        self._lock = threading.Lock()
+
+    def clock(self):
+        return time.perf_counter() if self.enabled else 0.0
+
+    def observe(self, stage, t0, pair=None, tf=None):
+        """Record time since t0 (from clock()) for a pipeline stage."""
+        if not self.enabled:
+            return
+        self.observe_value("stage_seconds", time.perf_counter() - t0, stage=stage, pair=pair or "", tf=tf or "")
+
+    def observe_value(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self._hist.get(key)
+            if h is None:
+                h = self._hist[key] = _Histogram()
+            h.observe(value)
+
+    def inc(self, name, n=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + n
+
+    def set(self, name, value, **labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def reset(self):
+        with self._lock:
+            self._hist.clear(); self._counters.clear(); self._gauges.clear()
+
+    # ---------------- export ----------------
+    @staticmethod
+    def _labels(labels, extra=None):
+        items = list(labels) + (list(extra) if extra else [])
+        if not items:
+            return ""
+        esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+    def render_prometheus(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        p = self.prefix
+        lines = []
+        with self._lock:
+            hist = sorted(self._hist.items()); counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            hist = [(k, (list(h.counts), h.sum, h.count)) for k, h in hist]
+        typed = set()
+        for (name, labels), (counts, total, count) in hist:
+            if name not in typed:
+                lines.append(f"# TYPE {p}_{name} histogram"); typed.add(name)
+            cum = 0
+            for b, c in zip(BUCKETS, counts):
+                cum += c
+                lines.append(f"{p}_{name}_bucket{self._labels(labels, [('le', b)])} {cum}")
+            lines.append(f"{p}_{name}_bucket{self._labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{p}_{name}_sum{self._labels(labels)} {total:.6f}")
+            lines.append(f"{p}_{name}_count{self._labels(labels)} {count}")
+        for (name, labels), v in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {p}_{name}_total counter"); typed.add(name)
+            lines.append(f"{p}_{name}_total{self._labels(labels)} {v}")
+        for (name, labels), v in gauges:
+            if name not in typed:
+                lines.append(f"# TYPE {p}_{name} gauge"); typed.add(name)
+            lines.append(f"{p}_{name}{self._labels(labels)} {v}")
+        lines.append(f"# TYPE {p}_uptime_seconds gauge")
+        lines.append(f"{p}_uptime_seconds {time.time() - self.started:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, top=12):
+        """Short human-readable digest (for the /stats command)."""
+        if not self.enabled:
+            return "Метрики выключены (METRICS=1 чтобы включить)."
+        with self._lock:
+            per_stage = {}
+            for (name, labels), h in self._hist.items():
+                lab = dict(labels)
+                key = (name, lab.get("stage", lab.get("job", "")))
+                agg = per_stage.setdefault(key, _Histogram())
+                for i, c in enumerate(h.counts):
+                    agg.counts[i] += c
+                agg.sum += h.sum; agg.count += h.count; agg.max = max(agg.max, h.max)
+            counters = dict(self._counters); gauges = dict(self._gauges)
+        lines = [f"📈 Stats (uptime {int(time.time() - self.started)}s)"]
+        for (name, stage), h in sorted(per_stage.items(), key=lambda kv: -kv[1].sum)[:top]:
+            lines.append(f"• {stage or name}: n={h.count} avg={h.sum / h.count * 1000:.1f}ms "
+                         f"p90≤{h.quantile(0.9) * 1000:.1f}ms max={h.max * 1000:.1f}ms")
+        for (name, labels), v in sorted(counters.items()):
+            lab = ",".join(f"{k}={val}" for k, val in labels)
+            lines.append(f"• {name}{'[' + lab + ']' if lab else ''}: {v:g}")
+        for (name, labels), v in sorted(gauges.items()):
+            lab = ",".join(f"{k}={val}" for k, val in labels)
+            lines.append(f"• {name}{'[' + lab + ']' if lab else ''}: {v:g}")
+        return "\n".join(lines)
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serve /metrics on a daemon thread; returns the server."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_response(404); self.end_headers(); return
+                body = registry.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics_http", daemon=True).start()
+        return server
+
+
+# process-wide registry (disabled until the bot enables it)
+stats = Metrics()
@@ -0,0 +1,229 @@
+# outbox.py — non-blocking outbound Telegram queue: priorities, per-chat pacing, 429 handling, digests
+import time
+import heapq
+import itertools
+import threading
+
+from metrics import stats
+
+# lower = sent first; menu replies keep their order among themselves (FIFO per priority)
+PRIO_INTERACTIVE = 0
+PRIO_SCALP = 1
+PRIO_LEVELS = 2
+PRIO_SELECTED = 3
+PRIO_AUTO = 4
+
+TELEGRAM_MAX_TEXT = 4096
+DIGEST_SEPARATOR = "\n\n"
+
+
+class _Item:
+    __slots__ = ("chat_id", "text", "kwargs", "priority", "coalesce", "created", "not_before", "attempts", "seq",
+                 "on_sent")
+
+    def __init__(self, chat_id, text, kwargs, priority, coalesce, seq, created, not_before=0.0, on_sent=None):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.priority = priority
+        self.coalesce = coalesce
+        self.created = created
+        self.not_before = not_before
+        self.attempts = 0
+        self.seq = seq
+        self.on_sent = on_sent
+
+
+def retry_after_of(exc):
+    """Seconds Telegram asked us to wait (HTTP 429), or None."""
+    if getattr(exc, "error_code", None) != 429:
+        return None
+    params = (getattr(exc, "result_json", None) or {}).get("parameters") or {}
+    return float(params.get("retry_after", 5))
+
+
+class Outbox:
+    """
+    Messages are queued by callers and sent by one worker thread, so scans never
+    block on Telegram. Pacing: at most one message per `per_chat_interval` per chat
+    and `global_rate` per second overall; a 429 pauses sending for retry_after.
+    Items sharing a `coalesce` key for the same chat are merged into one digest
+    message (held for `coalesce_delay` so a whole scan lands in one message).
+    send(chat_id, text, **kwargs) does the actual API call; on_sent(result) given to
+    put() gets its return value (None if the message was given up on).
+    speed: clock seconds per real second (> 1 when replaying on an accelerated clock).
+    """
+
+    def __init__(self, send, per_chat_interval=1.0, global_rate=25.0, coalesce_delay=2.0,
+                 max_retries=3, retry_delay=4.0, clock=time.time, sleep=time.sleep):
+        self._send = send
+        self.per_chat_interval = per_chat_interval
+        self.global_interval = 1.0 / global_rate if global_rate else 0.0
+        self.coalesce_delay = coalesce_delay
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.clock = clock
+        self.sleep = sleep
+        self.speed = 1.0
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._chat_next = {}       # {chat_id: earliest next send}; past entries pruned every minute
+        self._pruned_at = 0.0
+        self._global_next = 0.0
+        self._paused_until = 0.0   # set by 429
+        self._thread = None
+        self._stop = False
+        self._inflight = 0
+        self.sent = 0
+        self.failed = 0
+        self.merged = 0
+
+    # ---------------- producer side ----------------
+    def put(self, chat_id, text, priority=PRIO_INTERACTIVE, coalesce=None, on_sent=None, **kwargs):
+        """Queue a message; returns immediately."""
+        with self._cond:
+            item = _Item(chat_id, text, kwargs, priority, coalesce, next(self._seq), self.clock(), on_sent=on_sent)
+            if coalesce:
+                item.not_before = item.created + self.coalesce_delay
+            heapq.heappush(self._heap, (priority, item.seq, item))
+            stats.set("outbox_queue", len(self._heap))
+            self._cond.notify()
+        self.start()
+        return True
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap) + self._inflight
+
+    def flush(self, timeout=30.0):
+        """Wait until the queue drained (or timeout). Returns True if empty."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if not self.pending():
+                return True
+            time.sleep(0.05)
+        return not self.pending()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop = False
+            self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+
+    # ---------------- worker ----------------
+    def _next_ready(self, now):
+        """Pop the best item that may be sent now; returns (item, wait_seconds)."""
+        wait = None
+        skipped = []
+        found = None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            item = entry[2]
+            ready_at = max(item.not_before, self._chat_next.get(item.chat_id, 0.0))
+            if ready_at <= now:
+                found = item
+                break
+            skipped.append(entry)
+            wait = ready_at - now if wait is None else min(wait, ready_at - now)
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        return found, wait
+
+    def _take_digest(self, item):
+        """Merge other queued items with the same (chat, coalesce key) into item, up to the size limit."""
+        if not item.coalesce:
+            return item
+        rest, parts, size = [], [item.text], len(item.text)
+        for entry in sorted(self._heap):
+            other = entry[2]
+            if (other.chat_id == item.chat_id and other.coalesce == item.coalesce and not other.kwargs
+                    and other.on_sent is None
+                    and size + len(DIGEST_SEPARATOR) + len(other.text) <= TELEGRAM_MAX_TEXT):
+                parts.append(other.text)
+                size += len(DIGEST_SEPARATOR) + len(other.text)
+                self.merged += 1
+            else:
+                rest.append(entry)
+        if len(parts) > 1:
+            self._heap = rest
+            heapq.heapify(self._heap)
+            item.text = DIGEST_SEPARATOR.join(parts)
+        return item
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stop:
+                        return
+                    now = self.clock()
+                    hold = max(self._paused_until, self._global_next) - now
+                    if hold > 0:
+                        self._cond.wait(hold / self.speed)
+                        continue
+                    item, wait = self._next_ready(now)
+                    if item is not None:
+                        item = self._take_digest(item)
+                        self._inflight += 1
+                        stats.set("outbox_queue", len(self._heap))
+                        break
+                    self._cond.wait((wait if wait is not None else 1.0) / self.speed)
+            try:
+                self._deliver(item)
+            finally:
+                with self._cond:
+                    self._inflight -= 1
+
+    def _deliver(self, item):
+        t0 = stats.clock()
+        on_sent = item.on_sent
+        try:
+            result = self._send(item.chat_id, item.text, **item.kwargs)
+        except Exception as e:
+            stats.inc("errors", stage="telegram_send")
+            retry_after = retry_after_of(e)
+            item.attempts += 1
+            now = self.clock()
+            with self._cond:
+                if retry_after is not None:
+                    # flood control: pause everything, message keeps its place
+                    print(f"[outbox] 429, retry after {retry_after}s")
+                    self._paused_until = now + retry_after
+                    item.attempts -= 1
+                elif item.attempts >= self.max_retries:
+                    print(f"[outbox] failed to send after {item.attempts} attempts: {e}")
+                    self.failed += 1
+                    stats.inc("send_failures")
+                    item = None
+                else:
+                    print(f"[outbox] send error (attempt {item.attempts}): {e}; retry in {self.retry_delay}s")
+                    item.not_before = now + self.retry_delay
+                    # hold the chat too: later messages must not overtake this one (or the placeholder it edits)
+                    self._chat_next[item.chat_id] = max(self._chat_next.get(item.chat_id, 0.0), item.not_before)
+                if item is not None:
+                    heapq.heappush(self._heap, (item.priority, item.seq, item))
+                    self._cond.notify()
+            if item is None and on_sent:
+                on_sent(None)
+            return
+        stats.observe("telegram_send", t0)
+        self.sent += 1
+        now = self.clock()
+        with self._cond:
+            self._chat_next[item.chat_id] = now + self.per_chat_interval
+            self._global_next = now + self.global_interval
+            if now - self._pruned_at > 60:
+                self._chat_next = {c: t for c, t in self._chat_next.items() if t > now}
+                self._pruned_at = now
+        if on_sent:
+            on_sent(result)
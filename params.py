@@ -0,0 +1,52 @@
+# params.py — tunable signal thresholds/weights shared by the live analysis, batch scoring and the backtests
+import json
+
+# the values analyze_df_for_pair was written with; sweep.py searches around them
+DEFAULTS = {
+    "rsi_strong_buy": 35.0,    # RSI below: +1 buy
+    "rsi_buy": 45.0,           # RSI below: +0.5 buy
+    "rsi_sell": 55.0,          # RSI above: +0.5 sell
+    "rsi_strong_sell": 65.0,   # RSI above: +1 sell
+    "vol_weight": 0.7,         # volume above MA20 with price on the right side of EMA20
+    "medium_score": 2.0,       # score >= -> strength 2
+    "strong_score": 4.0,       # score >= -> strength 3
+    "level_order": 4,          # bars each side for a local extremum
+    "level_cluster": 0.006,    # relative distance merging extrema into one level
+    "level_atr_mult": 0.7,     # price within mult*ATR of a level bumps strength
+    "breadth_low": 0.3,        # share of pairs above EMA200 below: market is weak, BUYs lose score
+    "breadth_high": 0.7,       # above: market is strong, SELLs lose score
+    "context_weight": 1.0,     # score removed per unit of positive correlation with BTC/the market
+}
+INT_PARAMS = ("level_order",)
+
+# live parameter set; replaced in place by use() so modules holding a reference see the change
+current = dict(DEFAULTS)
+
+
+def normalize(params):
+    """DEFAULTS overlaid with params; unknown names raise ValueError (typos must not pass silently)."""
+    unknown = set(params) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"unknown signal parameters: {', '.join(sorted(unknown))}")
+    out = dict(DEFAULTS)
+    for k, v in params.items():
+        out[k] = int(v) if k in INT_PARAMS else float(v)
+    return out
+
+
+def load(path):
+    """Parameter set from a JSON file written by save() / `sweep.py --save` ({"params": {...}} or a flat dict)."""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return normalize(data.get("params", data))
+
+
+def save(path, params, **meta):
+    """Write params (plus optional metadata such as the sweep score) as JSON."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"params": normalize(params), **meta}, f, indent=2, sort_keys=True)
+
+
+def use(params):
+    current.clear()
+    current.update(normalize(params))
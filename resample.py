@@ -0,0 +1,84 @@
+# resample.py — higher-timeframe klines built from one base series per symbol (fewer REST calls)
+import threading
+
+from candles import INTERVAL_MS, OPEN_TIME
+
+DAY_MS = INTERVAL_MS["1d"]
+
+
+def derivable(base, interval):
+    """
+    True if `interval` candles can be built exactly from `base` candles.
+    Binance aligns m/h/d candles to UTC multiples of the interval since the epoch;
+    3d/1w have other anchors and are always fetched.
+    """
+    b, s = INTERVAL_MS.get(base), INTERVAL_MS.get(interval)
+    return bool(b and s) and s > b and s % b == 0 and DAY_MS % s == 0
+
+
+def aggregate_rows(rows, interval):
+    """
+    Aggregate base kline rows (sorted, get_klines layout) into `interval` rows:
+    open of the first, max high, min low, close of the last, summed volumes/trades.
+    The last bucket may be incomplete -- it is the still-open candle, as on Binance
+    (close_time is always the bucket end). Missing base candles are simply absent.
+    """
+    step = INTERVAL_MS[interval]
+    out = []
+    cur = None
+    for r in rows:
+        start = r[OPEN_TIME] - r[OPEN_TIME] % step
+        if cur is None or cur[0] != start:
+            cur = [start, float(r[1]), float(r[2]), float(r[3]), float(r[4]), float(r[5]),
+                   start + step - 1, float(r[7]), int(r[8]), float(r[9]), float(r[10]), "0"]
+            out.append(cur)
+            continue
+        cur[2] = max(cur[2], float(r[2]))
+        cur[3] = min(cur[3], float(r[3]))
+        cur[4] = float(r[4])
+        cur[5] += float(r[5])
+        cur[7] += float(r[7])
+        cur[8] += int(r[8])
+        cur[9] += float(r[9])
+        cur[10] += float(r[10])
+    return out
+
+
+class Resampler:
+    """
+    CandleStore front-end: get(symbol, interval, limit) like CandleStore.get, but
+    derivable intervals are refreshed from the symbol's `base` series instead of
+    their own REST request. Each derived series is loaded from REST once (history
+    deeper than the base window); afterwards only its open candle and newly closed
+    ones are rebuilt from base rows. Falls back to REST when the base window does
+    not reach back to the derived series' last candle (e.g. after downtime).
+    """
+
+    def __init__(self, store, base="5m", base_limit=300):
+        self.store = store
+        self.base = base
+        self.base_limit = base_limit
+        self._lock = threading.Lock()
+        self.derived = 0
+        self.fallbacks = 0
+
+    def get(self, symbol, interval, limit=300):
+        if not derivable(self.base, interval) or self.store.streamed(symbol, interval):
+            # streamed series are kept current by their own websocket: no base refresh needed
+            return self.store.get(symbol, interval, limit=limit)
+        rows = self.store.peek(symbol, interval, limit)
+        if rows is None or len(rows) < limit:
+            # first load / deeper history wanted
+            return self.store.get(symbol, interval, limit=limit)
+        # deep enough to cover a whole bucket of the largest derived interval plus the open one
+        depth = max(self.base_limit, INTERVAL_MS[interval] // INTERVAL_MS[self.base] + 2)
+        base_rows = self.store.get(symbol, self.base, limit=depth)
+        start = rows[-1][OPEN_TIME]
+        if not base_rows or base_rows[0][OPEN_TIME] > start:
+            with self._lock:
+                self.fallbacks += 1
+            return self.store.get(symbol, interval, limit=limit)
+        self.store.update(symbol, interval, aggregate_rows([r for r in base_rows if r[OPEN_TIME] >= start], interval))
+        with self._lock:
+            self.derived += 1
+        return self.store.peek(symbol, interval, limit)
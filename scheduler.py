@@ -0,0 +1,157 @@
+# scheduler.py — runs jobs at candle close (plus a settle delay) on a worker pool, once per closed candle
+import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from candles import INTERVAL_MS
+from metrics import stats
+
+
+def last_close(interval, now_ms):
+    """close_time (ms) of the most recent candle of `interval` closed at or before now_ms."""
+    step = INTERVAL_MS[interval]
+    return (now_ms // step) * step - 1
+
+
+class CandleScheduler:
+    """
+    Jobs are registered under a tag with the (pair, tf) keys they cover:
+
+        sched.set_job("selected", check, [("BTCUSDT", "1h"), ...])
+        sched.set_job("levels", lambda p, t: monitor(), [(pair, "4h")], trigger="1m")
+
+    job(pair, tf) runs `settle` seconds after every close of `trigger` (default: the
+    key's own tf). Close events can also be pushed from outside (websocket stream)
+    through candle_closed(); each (tag, pair, tf) processes a given closed candle
+    at most once, whichever source sees it first.
+    speed: clock seconds per real second (> 1 when replaying on an accelerated clock).
+    """
+
+    def __init__(self, settle=3.0, workers=4, clock=time.time):
+        self.settle = settle
+        self.clock = clock
+        self.speed = 1.0
+        self._jobs = {}          # {tag: (job, [(pair, tf)], trigger)}
+        self._processed = {}     # {(tag, pair, tf): close_time of the last candle handled}
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="candle_job")
+        self._thread = None
+        self._stop = False
+        self.fired = 0
+        self.skipped = 0
+
+    # ---------------- jobs ----------------
+    def set_job(self, tag, job, keys, trigger=None):
+        """Add or replace the job for tag. Candles already closed are not replayed for new keys."""
+        keys = list(keys)
+        now_ms = int(self.clock() * 1000)
+        with self._cond:
+            self._jobs[tag] = (job, keys, trigger)
+            old = {k: v for k, v in self._processed.items() if k[0] == tag}
+            for k in old:
+                del self._processed[k]
+            for pair, tf in keys:
+                key = (tag, pair, tf)
+                self._processed[key] = old.get(key, last_close(trigger or tf, now_ms))
+            self._cond.notify()
+
+    def clear(self, *tags):
+        with self._cond:
+            for tag in tags:
+                self._jobs.pop(tag, None)
+            self._processed = {k: v for k, v in self._processed.items() if k[0] not in tags}
+            self._cond.notify()
+
+    def tags(self):
+        with self._cond:
+            return list(self._jobs)
+
+    def export(self):
+        """Processed-candle marks {(tag, pair, tf): close_time}, for snapshots."""
+        with self._cond:
+            return dict(self._processed)
+
+    def restore(self, processed):
+        """Seed processed marks before set_job(), so candles that closed while down run once and nothing repeats."""
+        with self._cond:
+            self._processed.update(processed)
+
+    # ---------------- firing ----------------
+    def candle_closed(self, pair, tf, close_time):
+        """A candle of (pair, tf) closed (e.g. from the stream): run jobs keyed on it that haven't seen it."""
+        with self._cond:
+            due = [(tag, job) for tag, (job, keys, trigger) in self._jobs.items()
+                   if (trigger or tf) == tf and (pair, tf) in keys]
+        for tag, job in due:
+            self._submit(tag, job, pair, tf, close_time)
+
+    def _submit(self, tag, job, pair, tf, close_time):
+        key = (tag, pair, tf)
+        with self._cond:
+            if self._processed.get(key, -1) >= close_time:
+                self.skipped += 1
+                stats.inc("scheduler_skipped", job=tag)
+                return False
+            self._processed[key] = close_time
+            self.fired += 1
+        self._pool.submit(self._run_job, tag, job, pair, tf, close_time)
+        return True
+
+    def _run_job(self, tag, job, pair, tf, close_time):
+        stats.observe_value("scheduler_lag_seconds", max(0.0, self.clock() - (close_time + 1) / 1000.0), job=tag)
+        t0 = stats.clock()
+        try:
+            job(pair, tf)
+        except Exception as e:
+            stats.inc("errors", stage="job_" + tag)
+            print(f"[scheduler] {tag} {pair} {tf} failed: {e}")
+            traceback.print_exc()
+        stats.observe("job_" + tag, t0, pair, tf)
+
+    def run_due(self):
+        """Fire every job whose trigger candle has closed (settle included); returns seconds until the next one."""
+        now = self.clock()
+        now_ms = int((now - self.settle) * 1000)
+        due, wait = [], None
+        with self._cond:
+            for tag, (job, keys, trigger) in self._jobs.items():
+                for pair, tf in keys:
+                    iv = trigger or tf
+                    close_time = last_close(iv, now_ms)
+                    if self._processed.get((tag, pair, tf), -1) < close_time:
+                        due.append((tag, job, pair, tf, close_time))
+                    nxt = (close_time + 1 + INTERVAL_MS[iv]) / 1000.0 + self.settle - now
+                    wait = nxt if wait is None else min(wait, nxt)
+        for item in due:
+            self._submit(*item)
+        return wait
+
+    # ---------------- timer thread ----------------
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop = False
+        self._thread = threading.Thread(target=self._loop, name="candle_scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+
+    def _loop(self):
+        while True:
+            try:
+                wait = self.run_due()
+            except Exception as e:
+                stats.inc("errors", stage="scheduler")
+                print("scheduler error:", e)
+                wait = 3.0
+            with self._cond:
+                if self._stop:
+                    return
+                # woken early by set_job/clear; capped so clock jumps (sleep/NTP) are noticed
+                self._cond.wait(min(max(wait if wait is not None else 60.0, 0.05) / self.speed, 60.0))
+                if self._stop:
+                    return
@@ -0,0 +1,398 @@
+# shards.py — analysis in worker processes: kline windows in shared memory, symbols partitioned across workers
+import time
+import signal
+import itertools
+import threading
+import multiprocessing as mp
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+import numpy as np
+
+from metrics import stats
+from klines import Klines
+
+FLOAT_COLUMNS = ("open", "high", "low", "close", "volume")
+TIME_COLUMNS = ("open_time", "close_time")
+
+
+class ShardError(Exception):
+    """The pool can't take the analysis (no live worker, timeout); run it in-process instead."""
+
+
+class CandleSlab:
+    """
+    Shared-memory table of kline windows: `slots` windows of up to `max_len` candles,
+    float64 OHLCV and int64 open/close times, each column of a slot contiguous. The
+    coordinator write()s a slot; workers attach by name and read() it as a Klines of
+    views into the segment (no copy, read-only).
+    """
+
+    def __init__(self, slots, max_len, name=None):
+        self.slots = slots
+        self.max_len = max_len
+        cells = slots * max_len
+        size = cells * 8 * (len(FLOAT_COLUMNS) + len(TIME_COLUMNS)) + slots * 8
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size if self.owner else 0)
+        buf = self.shm.buf
+        self.floats = np.ndarray((slots, len(FLOAT_COLUMNS), max_len), np.float64, buf, 0)
+        self.times = np.ndarray((slots, len(TIME_COLUMNS), max_len), np.int64, buf, cells * 8 * len(FLOAT_COLUMNS))
+        self.lengths = np.ndarray((slots,), np.int64, buf, cells * 8 * (len(FLOAT_COLUMNS) + len(TIME_COLUMNS)))
+        if not self.owner:
+            for arr in (self.floats, self.times, self.lengths):
+                arr.flags.writeable = False
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, slot, k):
+        """Copy the last max_len candles of k (Klines or DataFrame) into slot; returns the length stored."""
+        n = min(len(k), self.max_len)
+        for i, col in enumerate(FLOAT_COLUMNS):
+            self.floats[slot, i, :n] = np.asarray(k[col], dtype=np.float64)[len(k) - n:]
+        for i, col in enumerate(TIME_COLUMNS):
+            self.times[slot, i, :n] = np.asarray(k[col], dtype=np.int64)[len(k) - n:]
+        self.lengths[slot] = n
+        return n
+
+    def read(self, slot):
+        n = int(self.lengths[slot])
+        cols = {col: self.floats[slot, i, :n] for i, col in enumerate(FLOAT_COLUMNS)}
+        cols.update({col: self.times[slot, i, :n] for i, col in enumerate(TIME_COLUMNS)})
+        return Klines.from_columns(cols)
+
+    def close(self):
+        # numpy views pin the buffer; drop them before closing the mapping
+        self.floats = self.times = self.lengths = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _worker_main(conn, slab_name, slots, max_len, params, use_engine):
+    """Worker process: (task_id, slot, pair, tf, options) in, (task_id, result, seconds) out."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # Ctrl-C is the coordinator's to handle
+    import params as signal_params
+    from analysis import analyze_df_for_pair
+    from indicators import EngineRegistry
+    signal_params.use(params)
+    slab = CandleSlab(slots, max_len, name=slab_name)
+    # symbols stay on one worker, so incremental indicator state stays warm here
+    engines = EngineRegistry() if use_engine else None
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            break
+        if task is None:
+            break
+        task_id, slot, pair, tf, options = task
+        t0 = time.perf_counter()
+        try:
+            k = slab.read(slot)
+            engine = engines.sync(pair, tf, k) if engines is not None else None
+            result = analyze_df_for_pair(k, pair, tf, engine=engine, **options)
+            del k
+        except Exception as e:
+            result = ("HOLD", 0, f"Ошибка анализа: {e}", {})
+        conn.send((task_id, result, time.perf_counter() - t0))
+
+
+class _Worker:
+    __slots__ = ("index", "proc", "conn", "send_lock", "inflight", "dead")
+
+    def __init__(self, index, proc, conn):
+        self.index = index
+        self.proc = proc
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        self.inflight = set()
+        self.dead = False
+
+
+class _Task:
+    __slots__ = ("id", "slot", "pair", "tf", "options", "attempts", "worker", "result", "done")
+
+    def __init__(self, task_id, slot, pair, tf, options):
+        self.id = task_id
+        self.slot = slot
+        self.pair = pair
+        self.tf = tf
+        self.options = options
+        self.attempts = 0
+        self.worker = None
+        self.result = None
+        self.done = threading.Event()
+
+
+class ShardPool:
+    """
+    Runs analyze_df_for_pair in `workers` processes so scans use more than one core:
+
+        pool = ShardPool(4, slots=256, max_len=1000, params=params.current).start()
+        pool.analyze("BTCUSDT", "1h", klines)     # from any thread; blocks until the result
+
+    The coordinator keeps fetching candles; analyze() copies the window into a shared
+    slot (LRU per (pair, tf)) and sends the worker owning the symbol only the slot
+    number. Workers read the slot in place and send back the (label, strength, report,
+    details) tuple. Symbols are assigned to the least loaded worker (by measured
+    analysis time) and stay there; rebalance() evens the load after crashes or universe
+    changes. A worker that dies is restarted and its analyses in flight go to another
+    worker; an analysis that kills `max_attempts` workers is reported as failed.
+    """
+
+    def __init__(self, workers, slots=256, max_len=1000, params=None, use_engine=False, timeout=60.0,
+                 max_attempts=2):
+        self.workers = workers
+        self.params = dict(params or {})
+        self.use_engine = use_engine
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.slab = CandleSlab(slots, max_len)
+        self._ctx = mp.get_context("spawn")   # fork would copy the bot's locks held by other threads
+        self._slots = OrderedDict()           # {(pair, tf): slot}, least recently used first
+        self._free = list(range(slots))
+        self._slot_locks = [threading.Lock() for _ in range(slots)]
+        self._owner = {}                      # {pair: worker index}
+        self._cost = {}                       # {pair: seconds per analysis, moving average}
+        self._tasks = {}                      # {task id: _Task} in flight
+        self._ids = itertools.count()
+        self._workers = []
+        self._lock = threading.RLock()
+        self._stop = False
+        self._collector = None
+        self.analyses = 0
+        self.failed = 0
+        self.restarts = 0
+        self.moved = 0
+
+    # ---------------- lifecycle ----------------
+    def start(self):
+        with self._lock:
+            self._workers = [self._spawn(i) for i in range(self.workers)]
+        self._collector = threading.Thread(target=self._collect, name="shard_results", daemon=True)
+        self._collector.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stop = True
+        for w in self._workers:
+            try:
+                with w.send_lock:
+                    w.conn.send(None)
+            except OSError:
+                pass
+        for w in self._workers:
+            w.proc.join(timeout)
+            if w.proc.is_alive():
+                w.proc.terminate()
+        if self._collector:
+            self._collector.join(timeout)
+        self.slab.close()
+
+    def _spawn(self, index):
+        parent, child = self._ctx.Pipe()
+        proc = self._ctx.Process(target=_worker_main, name=f"shard_{index}", daemon=True,
+                                 args=(child, self.slab.name, self.slab.slots, self.slab.max_len,
+                                       self.params, self.use_engine))
+        proc.start()
+        child.close()
+        return _Worker(index, proc, parent)
+
+    def alive(self):
+        with self._lock:
+            return sum(1 for w in self._workers if not w.dead and w.proc.is_alive())
+
+    # ---------------- analysis ----------------
+    def analyze(self, pair, tf, k, **options):
+        """analyze_df_for_pair(k, pair, tf, **options) on a worker (options must be small and picklable)."""
+        if self._stop or not self.alive():
+            raise ShardError("no live shard workers")
+        slot = self._slot(pair, tf)
+        lock = self._slot_locks[slot]
+        with lock:   # the slot isn't rewritten until its worker answered
+            self.slab.write(slot, k)
+            task = _Task(next(self._ids), slot, pair, tf, options)
+            self._dispatch(task)
+            if not task.done.wait(self.timeout):
+                with self._lock:
+                    self._tasks.pop(task.id, None)
+                    worker = self._workers[task.worker]
+                stats.inc("errors", stage="shard_timeout")
+                print(f"[shards] {pair} {tf} took over {self.timeout:.0f}s on worker {worker.index}, restarting it")
+                worker.proc.kill()    # hung: the collector restarts it
+                raise ShardError(f"{pair} {tf} timed out")
+        with self._lock:
+            self.analyses += 1
+        return task.result
+
+    def _slot(self, pair, tf):
+        key = (pair, tf)
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is not None:
+                self._slots.move_to_end(key)
+                return slot
+            if self._free:
+                slot = self._free.pop()
+            else:
+                # reuse the least recently used window; its lock serializes any analysis still on it
+                _, slot = self._slots.popitem(last=False)
+            self._slots[key] = slot
+            return slot
+
+    def _dispatch(self, task):
+        with self._lock:
+            w = self._owner.get(task.pair)
+            if w is None or self._workers[w].dead:
+                w = self._owner[task.pair] = self._least_loaded()
+            worker = self._workers[w]
+            task.worker = w
+            worker.inflight.add(task.id)
+            self._tasks[task.id] = task
+        try:
+            with worker.send_lock:
+                worker.conn.send((task.id, task.slot, task.pair, task.tf, task.options))
+        except OSError:
+            pass   # worker died: the collector re-dispatches its tasks
+
+    # ---------------- partitioning ----------------
+    def _cost_of(self, pair):
+        cost = self._cost.get(pair)
+        if cost is None:
+            cost = sum(self._cost.values()) / len(self._cost) if self._cost else 1.0
+        return cost
+
+    def _loads(self):
+        loads = {w.index: 0.0 for w in self._workers if not w.dead}
+        for pair, w in self._owner.items():
+            if w in loads:
+                loads[w] += self._cost_of(pair)
+        return loads
+
+    def _least_loaded(self):
+        loads = self._loads()
+        return min(loads, key=loads.get)
+
+    def rebalance(self):
+        """Move symbols from the most to the least loaded worker while that narrows the gap. Returns moves."""
+        moves = 0
+        with self._lock:
+            for _ in range(len(self._owner)):
+                loads = self._loads()
+                if len(loads) < 2:
+                    break
+                hi, lo = max(loads, key=loads.get), min(loads, key=loads.get)
+                gap = loads[hi] - loads[lo]
+                movable = [p for p, w in self._owner.items() if w == hi and self._cost_of(p) < gap]
+                if not movable:
+                    break
+                # the symbol closest to half the gap evens the pair best
+                pair = min(movable, key=lambda p: abs(self._cost_of(p) - gap / 2))
+                self._owner[pair] = lo
+                moves += 1
+            self.moved += moves
+        if moves:
+            stats.inc("shard_moves", moves)
+        return moves
+
+    def retain(self, pairs):
+        """Forget symbols no longer analyzed (their load stops counting) and rebalance."""
+        keep = set(pairs)
+        with self._lock:
+            for pair in [p for p in self._owner if p not in keep]:
+                del self._owner[pair]
+                self._cost.pop(pair, None)
+        return self.rebalance()
+
+    def assignment(self):
+        """{worker index: [symbols]}."""
+        with self._lock:
+            out = {w.index: [] for w in self._workers}
+            for pair, w in self._owner.items():
+                out[w].append(pair)
+            return out
+
+    # ---------------- results / crashes ----------------
+    def _collect(self):
+        while not self._stop:
+            with self._lock:
+                workers = [w for w in self._workers if not w.dead]
+            by_handle = {}
+            for w in workers:
+                by_handle[w.conn] = w
+                by_handle[w.proc.sentinel] = w
+            try:
+                ready = wait(list(by_handle), timeout=0.5)
+            except OSError:
+                continue
+            for handle in ready:
+                w = by_handle[handle]
+                if w.dead:
+                    continue
+                if handle is w.conn:
+                    try:
+                        msg = w.conn.recv()
+                    except (EOFError, OSError):
+                        self._lost(w)
+                        continue
+                    self._complete(w, msg)
+                elif not self._stop:
+                    self._lost(w)
+
+    def _complete(self, worker, msg):
+        task_id, result, seconds = msg
+        stats.observe_value("shard_analysis_seconds", seconds)
+        with self._lock:
+            worker.inflight.discard(task_id)
+            task = self._tasks.pop(task_id, None)
+            if task is not None:
+                prev = self._cost.get(task.pair)
+                self._cost[task.pair] = seconds if prev is None else 0.8 * prev + 0.2 * seconds
+        if task is not None:
+            task.result = result
+            task.done.set()
+
+    def _lost(self, worker):
+        """A worker exited: restart it, give its symbols and analyses in flight to the others."""
+        with self._lock:
+            if worker.dead or self._stop:
+                return
+            worker.dead = True
+            orphans = [self._tasks[t] for t in worker.inflight if t in self._tasks]
+            worker.inflight.clear()
+            for pair in [p for p, w in self._owner.items() if w == worker.index]:
+                del self._owner[pair]
+        worker.proc.join(1.0)
+        print(f"[shards] worker {worker.index} (pid {worker.proc.pid}) exited with code {worker.proc.exitcode}, "
+              f"{len(orphans)} analyses in flight")
+        stats.inc("shard_worker_restarts")
+        fresh = self._spawn(worker.index)
+        with self._lock:
+            self._workers[worker.index] = fresh
+            self.restarts += 1
+        try:
+            worker.conn.close()
+        except OSError:
+            pass
+        for task in orphans:
+            task.attempts += 1
+            if task.attempts >= self.max_attempts:
+                with self._lock:
+                    self._tasks.pop(task.id, None)
+                    self.failed += 1
+                stats.inc("errors", stage="shard_crash")
+                task.result = ("HOLD", 0, f"Ошибка анализа: процесс анализа упал на {task.pair} {task.tf}", {})
+                task.done.set()
+            else:
+                self._dispatch(task)
+        self.rebalance()
+
+    def summary(self):
+        with self._lock:
+            sizes = [len(v) for v in self.assignment().values()]
+            return (f"🧮 Shards: {self.alive()}/{self.workers} workers, symbols per worker {sizes}, "
+                    f"{self.analyses} analyses, {self.failed} failed, {self.restarts} restarts, {self.moved} moved")
@@ -0,0 +1,69 @@
+# snapshot.py — atomic on-disk snapshots of warm bot state (subscriptions, schedules, candles, indicators)
+import os
+import json
+import time
+import pickle
+import hashlib
+
+from metrics import stats
+
+MAGIC = b"BOTSNAP"
+VERSION = 3     # bump whenever the snapshot format or a snapshotted part changes meaning
+
+
+def fingerprint(*objects):
+    """
+    Fingerprint of the state layout of freshly built snapshotted objects (class and attribute
+    names): a class that gains, loses or renames state changes it, so its old pickles are refused.
+    """
+    desc = ";".join(f"{type(o).__module__}.{type(o).__qualname__}:{','.join(sorted(vars(o)))}" for o in objects)
+    return hashlib.sha1(desc.encode()).hexdigest()[:16]
+
+
+def save(path, parts, layout=""):
+    """
+    Write {name: data} to path atomically: written to a temp file, fsynced, then
+    renamed over the old snapshot, so a crash mid-write never leaves a torn file.
+    The file is one JSON header line (version, layout, saved_at), then the pickled parts.
+    Returns bytes written.
+    """
+    t0 = stats.clock()
+    header = json.dumps({"version": VERSION, "layout": layout, "saved_at": time.time()}).encode()
+    blob = MAGIC + b" " + header + b"\n" + pickle.dumps(parts, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    stats.observe("snapshot_save", t0)
+    stats.set("snapshot_bytes", len(blob))
+    return len(blob)
+
+
+def load(path, max_age=None, layout=""):
+    """
+    Returns (parts, saved_at) or (None, None) if there is no usable snapshot
+    (missing, unreadable, other version or layout, or older than max_age seconds).
+    The header is checked before anything is unpickled, so a stale snapshot is never
+    loaded into changed classes. Only load snapshots this bot wrote: unpickling runs code,
+    so the file (and its directory) must not be writable by anyone the bot doesn't trust.
+    """
+    if not path or not os.path.exists(path):
+        return None, None
+    try:
+        with open(path, "rb") as f:
+            magic, _, header = f.readline(4096).partition(b" ")
+            info = json.loads(header) if magic == MAGIC else None
+            if not isinstance(info, dict) or info.get("version") != VERSION or info.get("layout") != layout:
+                found = info.get("version") if isinstance(info, dict) else "?"
+                print(f"[snapshot] ignoring {path}: version {found}, other format or class layout")
+                return None, None
+            if max_age is not None and time.time() - info["saved_at"] > max_age:
+                print(f"[snapshot] {path} is older than {max_age}s, starting cold")
+                return None, None
+            parts = pickle.load(f)
+    except Exception as e:
+        print(f"[snapshot] ignoring unreadable {path}: {e}")
+        return None, None
+    return parts, info["saved_at"]
@@ -0,0 +1,211 @@
+# store.py — on-disk columnar kline store per (symbol, interval), memory-mapped reads
+#
+# layout: <root>/<SYMBOL>/<interval>/<column>.bin, one raw little-endian array per column
+#         (<column>.<gen>.bin after a rewrite) and `manifest` ("<gen> <rows>"), which commits them
+# usage: python store.py import <root> BTCUSDT-5m-2024-01.csv ...   (Binance CSV dumps)
+#        python store.py gaps <root> BTCUSDT 5m
+import os
+import sys
+import threading
+import numpy as np
+
+from candles import INTERVAL_MS
+
+COLUMNS = {"open_time": "<i8", "open": "<f8", "high": "<f8", "low": "<f8",
+           "close": "<f8", "volume": "<f8", "close_time": "<i8"}
+
+
+class KlineStore:
+    """
+    Append-only numeric OHLCV store. Each (symbol, interval) keeps one file per column;
+    reads return np.memmap views (zero-copy). Overlapping candles are deduplicated on
+    write (newest wins). A write is committed by replacing the manifest last, so a crash
+    mid-write leaves the previous series readable: appends extend the column files past
+    the committed length, anything that changes stored rows writes a new generation of
+    column files and switches the manifest to it.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _dir(self, symbol, interval):
+        return os.path.join(self.root, symbol, interval)
+
+    def _path(self, symbol, interval, col, gen=0):
+        return os.path.join(self._dir(symbol, interval), f"{col}.{gen}.bin" if gen else col + ".bin")
+
+    def _manifest(self, symbol, interval):
+        """(generation, committed rows); series written before manifests: gen 0, shortest column."""
+        try:
+            with open(os.path.join(self._dir(symbol, interval), "manifest"), encoding="ascii") as f:
+                gen, rows = map(int, f.read().split())
+        except FileNotFoundError:
+            gen, rows = 0, None
+        sizes = []
+        for col, dt in COLUMNS.items():
+            p = self._path(symbol, interval, col, gen)
+            sizes.append(os.path.getsize(p) // np.dtype(dt).itemsize if os.path.exists(p) else 0)
+        return gen, min(sizes) if rows is None else min(rows, *sizes)
+
+    def _commit(self, symbol, interval, gen, rows):
+        p = os.path.join(self._dir(symbol, interval), "manifest")
+        with open(p + ".tmp", "w", encoding="ascii") as f:
+            f.write(f"{gen} {rows}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(p + ".tmp", p)
+
+    def _series_lock(self, symbol, interval):
+        with self._lock:
+            return self._locks.setdefault((symbol, interval), threading.Lock())
+
+    def symbols(self):
+        """[(symbol, interval)] present on disk."""
+        out = []
+        if not os.path.isdir(self.root):
+            return out
+        for sym in sorted(os.listdir(self.root)):
+            d = os.path.join(self.root, sym)
+            if os.path.isdir(d):
+                out.extend((sym, iv) for iv in sorted(os.listdir(d)) if os.path.isdir(os.path.join(d, iv)))
+        return out
+
+    # ---------------- reads ----------------
+    def length(self, symbol, interval):
+        """Rows committed (bytes of a torn write past the manifest are ignored)."""
+        return self._manifest(symbol, interval)[1]
+
+    def read(self, symbol, interval, start=None, end=None):
+        """
+        Columns for open_time in [start, end] (ms, inclusive) as memmap views.
+        Returns {column: array}; empty arrays when nothing is stored.
+        """
+        gen, n = self._manifest(symbol, interval)
+        if n == 0:
+            return {col: np.empty(0, dtype=dt) for col, dt in COLUMNS.items()}
+        cols = {col: np.memmap(self._path(symbol, interval, col, gen), dtype=dt, mode="r", shape=(n,))
+                for col, dt in COLUMNS.items()}
+        times = cols["open_time"]
+        lo = 0 if start is None else int(np.searchsorted(times, start, side="left"))
+        hi = n if end is None else int(np.searchsorted(times, end, side="right"))
+        return {col: arr[lo:hi] for col, arr in cols.items()}
+
+    def last_open_time(self, symbol, interval):
+        gen, n = self._manifest(symbol, interval)
+        if n == 0:
+            return None
+        t = np.memmap(self._path(symbol, interval, "open_time", gen), dtype=COLUMNS["open_time"], mode="r", shape=(n,))
+        return int(t[-1])
+
+    def tail_rows(self, symbol, interval, limit):
+        """Last `limit` candles in the get_klines row layout (for warm starts)."""
+        n = self.length(symbol, interval)
+        if n == 0:
+            return []
+        c = self.read(symbol, interval)
+        lo = max(0, n - limit)
+        return [[int(c["open_time"][i]), float(c["open"][i]), float(c["high"][i]), float(c["low"][i]),
+                 float(c["close"][i]), float(c["volume"][i]), int(c["close_time"][i]), "0", 0, "0", "0", "0"]
+                for i in range(lo, n)]
+
+    def to_frame(self, symbol, interval, start=None, end=None):
+        """Optional pandas adapter (copies)."""
+        import pandas as pd
+        return pd.DataFrame({k: np.asarray(v) for k, v in self.read(symbol, interval, start, end).items()})
+
+    def gaps(self, symbol, interval):
+        """[(last_open_before_gap, first_open_after_gap, missing_candles)] for holes in the series."""
+        step = INTERVAL_MS[interval]
+        t = self.read(symbol, interval)["open_time"]
+        if len(t) < 2:
+            return []
+        d = np.diff(t)
+        idx = np.flatnonzero(d != step)
+        return [(int(t[i]), int(t[i + 1]), int(d[i] // step) - 1) for i in idx if d[i] > step]
+
+    # ---------------- writes ----------------
+    def write(self, symbol, interval, rows):
+        """
+        Persist kline rows (get_klines layout or dict of columns). Returns rows added/replaced.
+        Only pass closed candles unless you want the open one overwritten later.
+        """
+        new = self._columns(rows)
+        if not len(new["open_time"]):
+            return 0
+        order = np.argsort(new["open_time"], kind="stable")
+        new = {k: v[order] for k, v in new.items()}
+        # duplicate open_time inside the batch: keep the last one
+        keep = np.append(new["open_time"][1:] != new["open_time"][:-1], True)
+        new = {k: v[keep] for k, v in new.items()}
+        with self._series_lock(symbol, interval):
+            os.makedirs(self._dir(symbol, interval), exist_ok=True)
+            gen, n = self._manifest(symbol, interval)
+            last = self.last_open_time(symbol, interval)
+            if last is None or new["open_time"][0] > last:
+                self._append(symbol, interval, gen, n, new)
+            else:
+                # touches stored rows: new generation, the old one stays readable until the manifest switches
+                self._rewrite(symbol, interval, gen, new)
+        return len(new["open_time"])
+
+    def _columns(self, rows):
+        if isinstance(rows, dict):
+            return {col: np.asarray(rows[col], dtype=dt) for col, dt in COLUMNS.items()}
+        idx = {"open_time": 0, "open": 1, "high": 2, "low": 3, "close": 4, "volume": 5, "close_time": 6}
+        return {col: np.array([r[idx[col]] for r in rows], dtype=np.float64 if dt == "<f8" else np.int64).astype(dt)
+                for col, dt in COLUMNS.items()}
+
+    def _append(self, symbol, interval, gen, n, new):
+        for col, dt in COLUMNS.items():
+            with open(self._path(symbol, interval, col, gen), "ab") as f:
+                f.truncate(n * np.dtype(dt).itemsize)   # drop an uncommitted tail of a torn write
+                f.write(np.ascontiguousarray(new[col], dtype=dt).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        self._commit(symbol, interval, gen, n + len(new["open_time"]))
+
+    def _rewrite(self, symbol, interval, gen, new):
+        old = {k: np.array(v) for k, v in self.read(symbol, interval).items()}
+        t = np.concatenate([old["open_time"], new["open_time"]])
+        # stable sort keeps new rows after old ones with the same open_time -> new wins
+        order = np.argsort(t, kind="stable")
+        t = t[order]
+        keep = np.append(t[1:] != t[:-1], True)
+        for col, dt in COLUMNS.items():
+            merged = np.concatenate([old[col], new[col]])[order][keep]
+            with open(self._path(symbol, interval, col, gen + 1), "wb") as f:
+                f.write(np.ascontiguousarray(merged, dtype=dt).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        self._commit(symbol, interval, gen + 1, int(keep.sum()))
+        for col in COLUMNS:
+            try:
+                os.remove(self._path(symbol, interval, col, gen))
+            except FileNotFoundError:
+                pass
+
+def _main(argv):
+    if len(argv) >= 3 and argv[0] == "import":
+        from backtest import load_klines_csv, parse_name
+        store = KlineStore(argv[1])
+        for path in argv[2:]:
+            symbol, interval = parse_name(path)
+            df = load_klines_csv(path)
+            added = store.write(symbol, interval, {c: df[c].values for c in COLUMNS})
+            print(f"{path}: {added} rows -> {symbol} {interval} (total {store.length(symbol, interval)})")
+        return 0
+    if len(argv) == 4 and argv[0] == "gaps":
+        store = KlineStore(argv[1])
+        gaps = store.gaps(argv[2], argv[3])
+        for a, b, missing in gaps:
+            print(f"gap after {a} until {b}: {missing} candles missing")
+        print(f"{store.length(argv[2], argv[3])} rows, {len(gaps)} gaps")
+        return 0
+    print("usage: store.py import <root> files... | store.py gaps <root> SYMBOL TF")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
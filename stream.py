@@ -0,0 +1,300 @@
+# stream.py — Binance combined kline stream ingestion (optional, replaces REST polling)
+import json
+import time
+import queue
+import random
+import asyncio
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+BINANCE_WS_URL = "wss://stream.binance.com:9443"
+
+
+def stream_name(symbol, interval):
+    return f"{symbol.lower()}@kline_{interval}"
+
+
+def tick_stream_name(symbol, kind):
+    return f"{symbol.lower()}@{kind}"
+
+
+def kline_to_row(k):
+    """Convert a stream kline payload ("k" object) to the REST get_klines row layout."""
+    return [k["t"], k["o"], k["h"], k["l"], k["c"], k["v"], k["T"],
+            k.get("q", "0"), k.get("n", 0), k.get("V", "0"), k.get("Q", "0"), k.get("B", "0")]
+
+
+class KlineStream:
+    """
+    Subscribes to combined kline streams for a set of (symbol, interval) pairs
+    and keeps a CandleStore current. Closed candles are put on `self.closed`
+    as (symbol, interval, close_time) so analysis runs on candle close.
+    Reconnects with backoff; after every (re)connect the store is gap-filled via REST.
+    REST backfills (gap fills, series the store doesn't have yet) run on a small thread
+    pool, never on the receive loop; frames of a series being backfilled are buffered
+    (up to `buffer` per series) and applied, with their close events, once it lands.
+    """
+
+    thread_name = "kline_stream"
+
+    def __init__(self, store, base_url=BINANCE_WS_URL, history=300, record_path=None,
+                 max_backoff=60, on_error=None, backfill_workers=2, buffer=500):
+        self.store = store
+        self.base_url = base_url.rstrip("/")
+        self.history = history
+        self.record_path = record_path   # append raw frames here (for replay)
+        self.max_backoff = max_backoff
+        self.on_error = on_error
+        self.closed = queue.Queue()
+        self.connects = 0
+        self.frames = 0
+        self._subs = set()
+        self._subs_changed = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._loop = None
+        self.backfill_workers = backfill_workers
+        self.buffer = buffer
+        self._backfilling = {}       # {(symbol, interval): deque([(row, closed)])} while REST runs
+        self._backfill_lock = threading.Lock()
+        self._backfill_pool = None
+        self.backfills = 0
+
+    # ---------------- public API ----------------
+    def set_subscriptions(self, subs):
+        """Replace the watched set of (symbol, interval); reconnects if it changed."""
+        subs = set(subs)
+        if subs == self._subs:
+            return
+        self._subs = subs
+        self._subs_changed.set()
+
+    def subscriptions(self):
+        return set(self._subs)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._subs_changed.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def url(self, subs=None):
+        names = "/".join(sorted(stream_name(s, i) for s, i in (subs or self._subs)))
+        return f"{self.base_url}/stream?streams={names}"
+
+    def handle_frame(self, raw):
+        """Apply one raw combined-stream frame to the store. Returns the row or None."""
+        msg = json.loads(raw)
+        data = msg.get("data", msg)
+        if data.get("e") != "kline":
+            return None
+        k = data["k"]
+        symbol, interval = k["s"], k["i"]
+        row = kline_to_row(k)
+        self.frames += 1
+        key = (symbol, interval)
+        with self._backfill_lock:
+            pending = self._backfilling.get(key)
+            if pending is not None:
+                pending.append((row, k.get("x")))
+                return row
+            if not self.store.update(symbol, interval, [row], fresh=True):
+                self._start_backfill(key, [(row, k.get("x"))])
+                return row
+        if k.get("x"):
+            self.closed.put((symbol, interval, k["T"]))
+        return row
+
+    def backfilling(self):
+        with self._backfill_lock:
+            return set(self._backfilling)
+
+    def _start_backfill(self, key, rows=()):
+        # caller holds _backfill_lock
+        if key in self._backfilling:
+            return
+        self._backfilling[key] = deque(rows, maxlen=self.buffer)
+        if self._backfill_pool is None:
+            self._backfill_pool = ThreadPoolExecutor(max_workers=self.backfill_workers,
+                                                     thread_name_prefix="stream_backfill")
+        self._backfill_pool.submit(self._backfill, key)
+
+    def _backfill(self, key):
+        symbol, interval = key
+        try:
+            self.store.get(symbol, interval, limit=self.history)
+            self.backfills += 1
+        except Exception as e:
+            print(f"[stream] backfill error {symbol} {interval}: {e}")
+        with self._backfill_lock:
+            pending = self._backfilling.pop(key)
+            # buffered frames are newer than (or equal to) what REST returned; a failed fetch drops them
+            ok = self.store.update(symbol, interval, [row for row, _ in pending], fresh=True) if pending else True
+        if ok:
+            for row, closed in pending:
+                if closed:
+                    self.closed.put((symbol, interval, row[6]))
+
+    # ---------------- internals ----------------
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._main())
+        finally:
+            self._loop.close()
+
+    async def _main(self):
+        import websockets  # deferred: only needed once the stream starts
+        backoff = 1
+        while not self._stop.is_set():
+            subs = set(self._subs)
+            self._subs_changed.clear()
+            if not subs:
+                await asyncio.to_thread(self._subs_changed.wait, 1)
+                continue
+            try:
+                async with websockets.connect(self.url(subs), ping_interval=20, ping_timeout=20,
+                                              close_timeout=2) as ws:
+                    self.connects += 1
+                    self._gap_fill(subs)
+                    backoff = 1
+                    await self._consume(ws)
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                print(f"[stream] connection error: {e}; reconnect in {backoff}s")
+                if self.on_error:
+                    self.on_error(e)
+                await asyncio.sleep(backoff + random.random())
+                backoff = min(backoff * 2, self.max_backoff)
+
+    async def _consume(self, ws):
+        rec = open(self.record_path, "a", encoding="utf-8") if self.record_path else None
+        try:
+            while not self._stop.is_set() and not self._subs_changed.is_set():
+                try:
+                    raw = await asyncio.wait_for(ws.recv(), timeout=1)
+                except asyncio.TimeoutError:
+                    continue
+                if rec:
+                    rec.write(raw if isinstance(raw, str) else raw.decode())
+                    rec.write("\n")
+                try:
+                    self.handle_frame(raw)
+                except Exception as e:
+                    print(f"[stream] bad frame: {e}")
+                    traceback.print_exc()
+        finally:
+            if rec:
+                rec.close()
+
+    def _gap_fill(self, subs):
+        # REST catch-up for candles missed while disconnected, off the receive loop
+        with self._backfill_lock:
+            for key in sorted(subs):
+                self._start_backfill(key)
+
+
+class TickStream(KlineStream):
+    """
+    Best bid/ask ("bookTicker") or trade ("aggTrade") updates for a set of symbols, each
+    passed to engine.on_tick(symbol, bid, ask, event_ms) as soon as it arrives. Same
+    connection handling as KlineStream; subscriptions are plain symbols. bookTicker
+    frames carry no event time, so their latency is measured from receipt.
+    """
+
+    thread_name = "tick_stream"
+
+    def __init__(self, engine, kind="bookTicker", base_url=BINANCE_WS_URL, record_path=None,
+                 max_backoff=60, on_error=None, clock=time.time):
+        super().__init__(None, base_url, record_path=record_path, max_backoff=max_backoff, on_error=on_error)
+        self.engine = engine
+        self.kind = kind
+        self.clock = clock
+
+    def url(self, subs=None):
+        names = "/".join(sorted(tick_stream_name(s, self.kind) for s in (subs or self._subs)))
+        return f"{self.base_url}/stream?streams={names}"
+
+    def handle_frame(self, raw):
+        """Feed one raw frame to the engine. Returns the touches it caused (None if not a tick)."""
+        recv_ms = int(self.clock() * 1000)
+        msg = json.loads(raw)
+        data = msg.get("data", msg)
+        if "b" in data and "a" in data:            # bookTicker
+            bid, ask = float(data["b"]), float(data["a"])
+        elif data.get("e") in ("aggTrade", "trade"):
+            bid = ask = float(data["p"])
+        else:
+            return None
+        self.frames += 1
+        return self.engine.on_tick(data["s"], bid, ask, data.get("E", recv_ms))
+
+    def _gap_fill(self, subs):
+        pass   # ticks have no history to catch up
+
+
+# ---------------- local replay server ----------------
+async def _replay_handler(ws, frames, delay, stamp=False):
+    for raw in frames:
+        if stamp:
+            # event time = send time, so receivers can measure their own latency
+            msg = json.loads(raw)
+            msg.get("data", msg)["E"] = int(time.time() * 1000)
+            raw = json.dumps(msg)
+        await ws.send(raw)
+        if delay:
+            await asyncio.sleep(delay)
+    await ws.close()
+
+
+def serve_replay(frames, host="127.0.0.1", port=0, delay=0.0, stamp=False):
+    """
+    Start a local stand-in WebSocket server that sends `frames` (recorded raw
+    strings) to every client and then closes. Returns (server, loop, thread, port).
+    stamp: set each frame's event time "E" to the moment it is sent.
+    """
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    holder = {}
+
+    async def handler(ws, *_):
+        await _replay_handler(ws, frames, delay, stamp)
+
+    async def boot():
+        import websockets
+        holder["server"] = await websockets.serve(handler, host, port)
+        holder["port"] = holder["server"].sockets[0].getsockname()[1]
+        started.set()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(boot())
+        loop.run_forever()
+
+    t = threading.Thread(target=run, name="replay_server", daemon=True)
+    t.start()
+    started.wait(5)
+    return holder["server"], loop, t, holder["port"]
+
+
+if __name__ == "__main__":
+    import sys
+    # usage: python stream.py frames.jsonl [port] — replay a recorded frame file locally
+    path = sys.argv[1]
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8765
+    with open(path, encoding="utf-8") as f:
+        recorded = [line.strip() for line in f if line.strip()]
+    _, _, thread, port = serve_replay(recorded, port=port, delay=0.05)
+    print(f"Replaying {len(recorded)} frames on ws://127.0.0.1:{port}")
+    while thread.is_alive():
+        time.sleep(1)
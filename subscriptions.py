@@ -0,0 +1,138 @@
+# subscriptions.py — per-chat mode/pair/tf state and an index from (job, pair, tf) to subscribed chats
+import time
+import threading
+
+# job kinds a chat can be subscribed to; each maps to one scheduler tag
+KINDS = ("auto", "selected", "scalp", "levels")
+
+
+def new_chat_state(send_weak=False):
+    return {
+        "mode": None,            # None / "manual" / "auto" / "scalp" / "levels"
+        "pair": None,
+        "timeframe": None,
+        "scalp_enabled": False,
+        "levels_enabled": False,
+        "send_weak": send_weak,
+        "last_weak": {},         # {(kind, pair, tf): ts of the last weak signal sent}
+    }
+
+
+class SubscriptionRegistry:
+    """
+    Chat states plus the reverse index used for fan-out: markets(kind) is what
+    has to be analyzed, subscribers(kind, pair, tf) who receives the result.
+    Work per candle therefore depends on distinct markets, not on chat count.
+
+    Mutate a chat through update(chat_id, **fields) so the index stays in sync.
+    auto_markets: [(pair, tf)] watched by chats in auto mode.
+    """
+
+    def __init__(self, auto_markets, weak_cooldown=60 * 60, default_weak=False):
+        self.auto_markets = list(auto_markets)
+        self.weak_cooldown = weak_cooldown
+        self.default_weak = default_weak
+        self._chats = {}      # {chat_id: state dict}
+        self._index = {}      # {(kind, pair, tf): set(chat_id)}
+        self._keys = {}       # {chat_id: [(kind, pair, tf)]} currently indexed for the chat
+        self._lock = threading.RLock()
+
+    def chat(self, chat_id):
+        """State dict of chat (created on first use). Read it freely, change it via update()."""
+        with self._lock:
+            st = self._chats.get(chat_id)
+            if st is None:
+                st = self._chats[chat_id] = new_chat_state(self.default_weak)
+            return st
+
+    def update(self, chat_id, **fields):
+        with self._lock:
+            st = self.chat(chat_id)
+            st.update(fields)
+            self._reindex(chat_id, st)
+            return st
+
+    def set_auto_markets(self, markets):
+        """Change what auto mode watches (e.g. after a universe refresh) and reindex auto chats."""
+        with self._lock:
+            self.auto_markets = list(markets)
+            for chat_id, st in self._chats.items():
+                if st["mode"] == "auto":
+                    self._reindex(chat_id, st)
+
+    def remove(self, chat_id):
+        with self._lock:
+            self._chats.pop(chat_id, None)
+            self._reindex(chat_id, None)
+
+    def export(self):
+        """{chat_id: state} copies for snapshots."""
+        with self._lock:
+            return {cid: dict(st, last_weak=dict(st["last_weak"])) for cid, st in self._chats.items()}
+
+    def restore(self, states):
+        with self._lock:
+            for chat_id, saved in states.items():
+                st = new_chat_state(self.default_weak)
+                st.update(saved)
+                self._chats[chat_id] = st
+                self._reindex(chat_id, st)
+
+    def chats(self):
+        with self._lock:
+            return list(self._chats)
+
+    def __len__(self):
+        return len(self._chats)
+
+    # ---------------- fan-out ----------------
+    def markets(self, kind):
+        """(pair, tf) keys with at least one subscriber for job kind."""
+        with self._lock:
+            return sorted((p, t) for (k, p, t), ids in self._index.items() if k == kind and ids)
+
+    def subscribers(self, kind, pair, tf):
+        with self._lock:
+            return list(self._index.get((kind, pair, tf), ()))
+
+    def should_send_weak(self, chat_id, kind, pair, tf):
+        """Weak signals are opt-in per chat and rate-limited per (kind, pair, tf)."""
+        with self._lock:
+            st = self._chats.get(chat_id)
+            if st is None or not st["send_weak"]:
+                return False
+            now = time.time()
+            key = (kind, pair, tf)
+            last = st["last_weak"].get(key)
+            if last is not None and now - last <= self.weak_cooldown:
+                return False
+            st["last_weak"][key] = now
+            return True
+
+    # ---------------- internals ----------------
+    def _subscriptions(self, st):
+        keys = []
+        pair, tf = st["pair"], st["timeframe"]
+        if st["mode"] == "auto":
+            keys.extend(("auto", p, t) for p, t in self.auto_markets)
+        if st["mode"] == "manual" and pair and tf:
+            keys.append(("selected", pair, tf))
+        if st["scalp_enabled"] and pair:
+            keys.append(("scalp", pair, "5m"))
+        if st["levels_enabled"] and pair and tf:
+            keys.append(("levels", pair, tf))
+        return keys
+
+    def _reindex(self, chat_id, st):
+        for key in self._keys.pop(chat_id, ()):
+            ids = self._index.get(key)
+            if ids is not None:
+                ids.discard(chat_id)
+                if not ids:
+                    del self._index[key]
+        if st is None:
+            return
+        keys = self._subscriptions(st)
+        for key in keys:
+            self._index.setdefault(key, set()).add(chat_id)
+        self._keys[chat_id] = keys
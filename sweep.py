@@ -0,0 +1,283 @@
+# sweep.py — parallel grid/random search over the signal parameters (params.py) on local kline history
+#
+# usage: python sweep.py --store data/ [--series BTCUSDT-1h,ETHUSDT-4h] --grid rsi_buy=40,45,50 vol_weight=0.5,0.7,1
+#        python sweep.py data/BTCUSDT-1h.csv data/ETHUSDT-4h.csv --random 300 --levels --save best.json
+# the saved JSON is what the bot loads with SIGNAL_PARAMS=best.json (and backtest.py --params)
+import os
+import sys
+import math
+import time
+import random
+import itertools
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+import params as signal_params
+from backtest import LIVE_WINDOW, load_klines_csv, parse_name, indicator_frame, shifted, forward_returns
+from batch import score_arrays
+from levels import LevelIndex
+from store import KlineStore
+
+# random-search candidates per parameter (the defaults are always among them)
+SPACE = {
+    "rsi_strong_buy": [25, 30, 35, 40],
+    "rsi_buy": [40, 45, 50],
+    "rsi_sell": [50, 55, 60],
+    "rsi_strong_sell": [60, 65, 70, 75],
+    "vol_weight": [0.35, 0.5, 0.7, 1.0],
+    "medium_score": [1.5, 2, 2.5],
+    "strong_score": [3, 3.5, 4, 4.5],
+    "level_order": [3, 4, 5, 6],
+    "level_cluster": [0.004, 0.006, 0.008],
+    "level_atr_mult": [0.5, 0.7, 1.0],
+}
+LEVEL_PARAMS = ("level_order", "level_cluster", "level_atr_mult")
+METRICS = ("tstat", "avg", "hit")
+
+
+# ---------------- candidates ----------------
+def valid(p):
+    return (p["rsi_strong_buy"] <= p["rsi_buy"] and p["rsi_sell"] <= p["rsi_strong_sell"]
+            and p["medium_score"] <= p["strong_score"])
+
+
+def grid_candidates(grid, base):
+    """Cartesian product of {name: [values]} over base (names not in grid keep their base value)."""
+    names = sorted(grid)
+    out = []
+    for values in itertools.product(*(grid[n] for n in names)):
+        p = signal_params.normalize({**base, **dict(zip(names, values))})
+        if valid(p):
+            out.append(p)
+    return out
+
+
+def random_candidates(count, base, names, seed=0):
+    """`count` distinct valid sets drawing each of `names` from SPACE; base itself comes first."""
+    rng = random.Random(seed)
+    first = signal_params.normalize(base)
+    out, seen = [first], {tuple(sorted(first.items()))}
+    for _ in range(count * 20):
+        if len(out) >= count:
+            break
+        p = signal_params.normalize({**base, **{n: rng.choice(SPACE[n]) for n in names}})
+        key = tuple(sorted(p.items()))
+        if key not in seen and valid(p):
+            seen.add(key)
+            out.append(p)
+    return out
+
+
+def parse_grid(specs):
+    """["rsi_buy=40,45", ...] -> {"rsi_buy": [40.0, 45.0]}."""
+    grid = {}
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        if name not in signal_params.DEFAULTS or not values:
+            raise SystemExit(f"bad --grid entry {spec!r} (known: {', '.join(signal_params.DEFAULTS)})")
+        grid[name] = [float(v) for v in values.split(",")]
+    return grid
+
+
+# ---------------- per-series state (parameter independent) ----------------
+def level_table(df, order, cluster):
+    """
+    Support and resistance closest to the close (as analyze_df_for_pair picks them) of the
+    trailing LIVE_WINDOW candles at every bar: two (n,) arrays, NaN where absent.
+    """
+    n = len(df)
+    sup = np.full(n, np.nan); res = np.full(n, np.nan)
+    times = df["open_time"].values; closes = df["close"].values
+    idx = LevelIndex(order, cluster)
+    for j in range(LIVE_WINDOW - 1, n):
+        lo = j - LIVE_WINDOW + 1
+        idx.update(times[lo:j + 1], closes[lo:j + 1])
+        s, r = idx.nearest_support(closes[j]), idx.nearest_resistance(closes[j])
+        sup[j] = np.nan if s is None else s
+        res[j] = np.nan if r is None else r
+    return sup, res
+
+
+class Series:
+    """One (symbol, tf) history with everything that does not depend on the swept parameters."""
+
+    def __init__(self, symbol, tf, df, horizon, holdout):
+        self.symbol, self.tf, self.df = symbol, tf, df
+        self.ind = indicator_frame(df)
+        self.prev, self.last, self.n = shifted(self.ind)
+        self.fwd = forward_returns(df["close"].values, [horizon])[horizon]
+        self.split = int(len(df) * (1 - holdout))
+        self._levels = {}   # {(order, cluster): (sup, res)}
+
+    def levels(self, order, cluster):
+        key = (order, cluster)
+        if key not in self._levels:
+            self._levels[key] = level_table(self.df, order, cluster)
+        return self._levels[key]
+
+    def scores(self, p, levels=False):
+        sc = score_arrays(self.prev, self.last, self.n, p)
+        if not levels:
+            return sc["label_code"], sc["strength"]
+        code, strength = sc["label_code"], sc["strength"]
+        sup, res = self.levels(p["level_order"], p["level_cluster"])
+        price = self.ind["close"]; atr = self.ind["atr"]
+        lv = np.where(code < 0, res, sup)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            near = np.where(np.isnan(atr) | (atr == 0), np.abs(price - lv) / lv < 0.004,
+                            np.abs(price - lv) <= p["level_atr_mult"] * atr)
+        # the closest level of the signal's side bumps once, capped at 3 (same as the scalar path)
+        bump = near & ~np.isnan(lv)
+        return code, np.where(code != 0, np.minimum(3, strength + bump), strength)
+
+
+def load_series(files, store, only, horizon, holdout):
+    out = []
+    if store:
+        ks = KlineStore(store)
+        for symbol, tf in ks.symbols():
+            if not only or f"{symbol}-{tf}" in only:
+                out.append(Series(symbol, tf, ks.to_frame(symbol, tf), horizon, holdout))
+    for path in files:
+        symbol, tf = parse_name(path)
+        if not only or f"{symbol}-{tf}" in only:
+            out.append(Series(symbol, tf, load_klines_csv(path), horizon, holdout))
+    return out
+
+
+# ---------------- evaluation ----------------
+def _metrics(rets, prefix):
+    n = len(rets)
+    mean = float(rets.mean()) if n else math.nan
+    std = float(rets.std(ddof=1)) if n > 1 else math.nan
+    return {f"{prefix}signals": n,
+            f"{prefix}hit": float((rets > 0).mean()) if n else math.nan,
+            f"{prefix}avg": mean,
+            f"{prefix}tstat": mean / std * math.sqrt(n) if n > 1 and std > 0 else math.nan}
+
+
+def evaluate(series, p, levels=False, min_strength=2):
+    """
+    Direction-adjusted forward returns of signals with strength >= min_strength, pooled
+    over all series; in-sample (first 1-holdout of each series) and holdout metrics.
+    """
+    ins, outs = [], []
+    for s in series:
+        code, strength = s.scores(p, levels)
+        take = (code != 0) & (strength >= min_strength) & ~np.isnan(s.fwd)
+        bars = np.flatnonzero(take)
+        rets = s.fwd[bars] * code[bars]
+        ins.append(rets[bars < s.split]); outs.append(rets[bars >= s.split])
+    row = dict(p)
+    row.update(_metrics(np.concatenate(ins) if ins else np.empty(0), ""))
+    row.update(_metrics(np.concatenate(outs) if outs else np.empty(0), "oos_"))
+    return row
+
+
+# worker processes load the history and indicators once, then evaluate many candidate chunks
+_worker = {}
+
+
+def _init_worker(files, store, only, horizon, holdout, levels, min_strength):
+    _worker["series"] = load_series(files, store, only, horizon, holdout)
+    _worker["opts"] = (levels, min_strength)
+
+
+def _evaluate_chunk(chunk):
+    levels, min_strength = _worker["opts"]
+    return [evaluate(_worker["series"], p, levels, min_strength) for p in chunk]
+
+
+def run_sweep(candidates, files=(), store=None, only=None, horizon=12, holdout=0.3, levels=False,
+              min_strength=2, workers=None, chunk=None):
+    """Evaluate every candidate (list of parameter dicts); returns the result rows in candidate order."""
+    init = (list(files), store, only, horizon, holdout, levels, min_strength)
+    # same level settings next to each other so a worker's level tables get reused
+    order = sorted(range(len(candidates)), key=lambda i: (candidates[i]["level_order"], candidates[i]["level_cluster"]))
+    ordered = [candidates[i] for i in order]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        _init_worker(*init)
+        rows = _evaluate_chunk(ordered)
+    else:
+        chunk = chunk or max(1, math.ceil(len(ordered) / (workers * 4)))
+        chunks = [ordered[i:i + chunk] for i in range(0, len(ordered), chunk)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init) as pool:
+            rows = [r for part in pool.map(_evaluate_chunk, chunks) for r in part]
+    out = [None] * len(candidates)
+    for i, row in zip(order, rows):
+        out[i] = row
+    return out
+
+
+def rank(rows, metric="tstat", min_signals=50):
+    """Ranked DataFrame: best in-sample `metric` first; sets with fewer than min_signals go last."""
+    table = pd.DataFrame(rows)
+    table["enough"] = table["signals"] >= min_signals
+    table = table.sort_values(["enough", metric], ascending=[False, False], na_position="last", kind="stable")
+    table.insert(0, "rank", range(1, len(table) + 1))
+    return table.drop(columns="enough").reset_index(drop=True)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Search signal thresholds/weights on local kline history")
+    ap.add_argument("files", nargs="*", help="Binance kline CSV files (SYMBOL-TF*.csv)")
+    ap.add_argument("--store", help="KlineStore directory (all SYMBOL/TF series in it)")
+    ap.add_argument("--series", help="comma-separated SYMBOL-TF keys to keep")
+    ap.add_argument("--grid", nargs="+", default=[], metavar="NAME=V1,V2", help="grid over these parameters")
+    ap.add_argument("--random", type=int, default=0, help="random search: number of parameter sets")
+    ap.add_argument("--vary", help="comma-separated parameters drawn in --random (default: all in SPACE)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--base", help="parameter JSON the search starts from (default: params.DEFAULTS)")
+    ap.add_argument("--levels", action="store_true", help="include the levels_mode strength bump (and level_* parameters)")
+    ap.add_argument("--horizon", type=int, default=12, help="forward return horizon in bars")
+    ap.add_argument("--min-strength", type=int, default=2, help="signals counted (strength >= this)")
+    ap.add_argument("--holdout", type=float, default=0.3, help="trailing fraction of each series reported out of sample")
+    ap.add_argument("--metric", choices=METRICS, default="tstat", help="in-sample ranking metric")
+    ap.add_argument("--min-signals", type=int, default=50)
+    ap.add_argument("--workers", type=int, default=0, help="processes (default: CPU count)")
+    ap.add_argument("--top", type=int, default=20)
+    ap.add_argument("--out", help="write the full ranked table to this CSV")
+    ap.add_argument("--save", help="write the best parameter set as JSON (SIGNAL_PARAMS for the bot)")
+    args = ap.parse_args(argv)
+    if not args.files and not args.store:
+        ap.error("give kline CSV files or --store")
+
+    base = signal_params.load(args.base) if args.base else dict(signal_params.DEFAULTS)
+    if args.grid:
+        candidates = grid_candidates(parse_grid(args.grid), base)
+    else:
+        names = args.vary.split(",") if args.vary else [n for n in SPACE if args.levels or n not in LEVEL_PARAMS]
+        candidates = random_candidates(args.random or 100, base, names, args.seed)
+    only = set(args.series.split(",")) if args.series else None
+
+    started = time.perf_counter()
+    rows = run_sweep(candidates, args.files, args.store, only, args.horizon, args.holdout, args.levels,
+                     args.min_strength, args.workers or None)
+    elapsed = time.perf_counter() - started
+    table = rank(rows, args.metric, args.min_signals)
+
+    varied = [c for c in signal_params.DEFAULTS if table[c].nunique() > 1]
+    shown = ["rank"] + varied + [c for c in table.columns if c not in signal_params.DEFAULTS and c != "rank"]
+    with pd.option_context("display.width", 220, "display.max_columns", 40):
+        print(table[shown].head(args.top).to_string(index=False, float_format=lambda x: f"{x:.4f}"))
+    is_base = np.all([table[c] == base[c] for c in signal_params.DEFAULTS], axis=0)
+    if is_base.any():
+        print(f"base parameters rank {int(table['rank'][is_base].iloc[0])} of {len(table)}")
+    print(f"{len(candidates)} parameter sets in {elapsed:.1f}s ({len(candidates) / max(elapsed, 1e-9):.1f}/s)")
+    if args.out:
+        table.to_csv(args.out, index=False)
+    if args.save and len(table):
+        best = table.iloc[0]
+        signal_params.save(args.save, {c: best[c] for c in signal_params.DEFAULTS},
+                           metric=args.metric, score=float(best[args.metric]), signals=int(best["signals"]),
+                           oos_score=float(best["oos_" + args.metric]), horizon=args.horizon,
+                           min_strength=args.min_strength, levels=args.levels)
+        print(f"best parameters -> {args.save}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+# touches.py — tick-driven support/resistance touch alerts (sorted level index, hysteresis, per-level cooldown)
+import time
+import math
+import bisect
+import itertools
+import threading
+from collections import namedtuple
+
+from metrics import stats
+
+# side: "support" / "resistance"; event_ms: exchange (or receive) time of the tick that touched
+Touch = namedtuple("Touch", "symbol tf side level price event_ms detected")
+
+
+class _Level:
+    __slots__ = ("price", "tf", "side", "band", "armed", "last_alert", "disarm_seq")
+
+    def __init__(self, price, tf, side, band):
+        self.price = price
+        self.tf = tf
+        self.side = side
+        self.band = band
+        self.armed = True
+        self.last_alert = None
+        self.disarm_seq = None
+
+
+_seq = itertools.count()
+
+
+class _Book:
+    """
+    Levels of one symbol (all watched timeframes) sorted by price. Disarmed levels also sit
+    in two lists sorted by their re-arm price (above: price + rearm*band, below: price -
+    rearm*band), so a tick re-arms the passed ones with a bisect. A level re-armed from one
+    list leaves a stale entry in the other (told apart by disarm_seq), dropped when reached
+    or when stale entries outnumber the levels.
+    """
+    __slots__ = ("prices", "levels", "max_band", "by_tf", "rearm", "up", "down", "stale")
+
+    def __init__(self, rearm):
+        self.by_tf = {}        # {tf: [_Level]}
+        self.prices = []
+        self.levels = []
+        self.max_band = 0.0
+        self.rearm = rearm
+        self.up = []           # [(re-arm above, seq, _Level)]
+        self.down = []         # [(re-arm below, seq, _Level)]
+        self.stale = 0
+
+    def rebuild(self):
+        self.levels = sorted((lv for lvs in self.by_tf.values() for lv in lvs), key=lambda lv: lv.price)
+        self.prices = [lv.price for lv in self.levels]
+        self.max_band = max((lv.band for lv in self.levels), default=0.0)
+        disarmed = [lv for lv in self.levels if not lv.armed]
+        self.up, self.down, self.stale = [], [], 0
+        for lv in disarmed:
+            self.disarm(lv)
+
+    def disarm(self, lv):
+        lv.armed = False
+        lv.disarm_seq = seq = next(_seq)
+        bisect.insort(self.up, (lv.price + self.rearm * lv.band, seq, lv))
+        bisect.insort(self.down, (lv.price - self.rearm * lv.band, seq, lv))
+
+    def rearm_passed(self, bid, ask):
+        """Re-arm levels price has left far enough behind: O(log n) plus the levels re-armed."""
+        i = bisect.bisect_left(self.up, (bid,))                   # re-arm price < bid
+        j = bisect.bisect_right(self.down, (ask, math.inf))       # re-arm price > ask
+        for _, seq, lv in itertools.chain(self.up[:i], self.down[j:]):
+            if not lv.armed and lv.disarm_seq == seq:
+                lv.armed = True
+                self.stale += 1          # its entry in the other list
+            else:
+                self.stale -= 1
+        del self.up[:i]
+        del self.down[j:]
+        if self.stale > len(self.levels) + 16:
+            self.rebuild()
+
+
+class TouchEngine:
+    """
+    Checks every quote/trade of the watched symbols against their levels:
+
+        engine.set_levels("BTCUSDT", "4h", supports, resistances, band=0.7 * atr)
+        engine.on_tick("BTCUSDT", bid, ask, event_ms)   # -> [Touch], also passed to on_touch
+
+    A level is touched when the bid..ask range comes within `band` of it (a wick through
+    the level counts). Lookup is a bisect into the symbol's sorted levels, so a tick costs
+    O(log n) plus the few levels within the widest band. After a touch the level is disarmed
+    until price moves more than rearm * band away (hysteresis; the re-arm prices are bisected
+    too, disarmed levels cost nothing per tick), and it alerts at most once
+    per `cooldown` seconds. band=None uses rel_band * level (no ATR yet).
+    """
+
+    def __init__(self, on_touch=None, rearm=2.0, cooldown=30 * 60, rel_band=0.004, clock=time.time):
+        self.on_touch = on_touch
+        self.rearm = rearm
+        self.cooldown = cooldown
+        self.rel_band = rel_band
+        self.clock = clock
+        self._books = {}        # {symbol: _Book}
+        self._lock = threading.Lock()
+        self.ticks = 0
+        self.touches = 0
+        self.suppressed = 0     # touches inside a level's cooldown
+
+    # ---------------- levels ----------------
+    def set_levels(self, symbol, tf, supports, resistances, band=None):
+        """
+        Replace the (symbol, tf) levels. A new level inherits the armed/cooldown state of an
+        old one of the same tf and side within its band, so a level that moved slightly on
+        recomputation doesn't alert again.
+        """
+        with self._lock:
+            book = self._books.setdefault(symbol, _Book(self.rearm))
+            old = sorted(book.by_tf.get(tf, ()), key=lambda lv: lv.price)
+            old_prices = [lv.price for lv in old]
+            new = []
+            for side, prices in (("support", supports), ("resistance", resistances)):
+                for p in prices:
+                    lv = _Level(float(p), tf, side, band if band else self.rel_band * p)
+                    i = bisect.bisect_left(old_prices, p - lv.band)
+                    while i < len(old) and old_prices[i] <= p + lv.band:
+                        prev = old[i]
+                        if prev.side == side:
+                            lv.armed = lv.armed and prev.armed
+                            if prev.last_alert is not None:
+                                lv.last_alert = max(lv.last_alert or prev.last_alert, prev.last_alert)
+                        i += 1
+                    new.append(lv)
+            book.by_tf[tf] = new
+            book.rebuild()
+
+    def retain(self, markets):
+        """Drop levels of (symbol, tf) pairs no longer in `markets`."""
+        keep = set(markets)
+        with self._lock:
+            for symbol in list(self._books):
+                book = self._books[symbol]
+                for tf in [tf for tf in book.by_tf if (symbol, tf) not in keep]:
+                    del book.by_tf[tf]
+                if book.by_tf:
+                    book.rebuild()
+                else:
+                    del self._books[symbol]
+
+    def markets(self):
+        with self._lock:
+            return {(s, tf) for s, book in self._books.items() for tf in book.by_tf}
+
+    def symbols(self):
+        with self._lock:
+            return set(self._books)
+
+    # ---------------- ticks ----------------
+    def on_tick(self, symbol, bid, ask=None, event_ms=None):
+        """One best bid/ask (or trade: ask=None) update. Returns the touches it caused."""
+        ask = bid if ask is None else ask
+        now = self.clock()
+        fired = []
+        with self._lock:
+            self.ticks += 1
+            book = self._books.get(symbol)
+            if book is None:
+                return fired
+            # hysteresis: re-arm levels price has left far enough behind (usually none: two compares)
+            if (book.up and book.up[0][0] < bid) or (book.down and book.down[-1][0] > ask):
+                book.rearm_passed(bid, ask)
+            lo = bisect.bisect_left(book.prices, bid - book.max_band)
+            hi = bisect.bisect_right(book.prices, ask + book.max_band, lo)
+            for lv in book.levels[lo:hi]:
+                if not lv.armed or lv.price - lv.band > ask or bid > lv.price + lv.band:
+                    continue
+                book.disarm(lv)
+                if lv.last_alert is not None and now - lv.last_alert < self.cooldown:
+                    self.suppressed += 1
+                    continue
+                lv.last_alert = now
+                price = bid if lv.side == "support" else ask
+                fired.append(Touch(symbol, lv.tf, lv.side, lv.price, price, event_ms, now))
+            self.touches += len(fired)
+        for t in fired:
+            stats.inc("level_touches", side=t.side)
+            if event_ms is not None:
+                stats.observe_value("level_touch_latency_seconds", max(0.0, now - event_ms / 1000.0))
+            if self.on_touch:
+                self.on_touch(t)
+        return fired
+
+    def summary(self):
+        with self._lock:
+            n = sum(len(b.levels) for b in self._books.values())
+            return (f"🎯 Touch engine: {len(self._books)} symbols, {n} levels, {self.ticks} ticks, "
+                    f"{self.touches} touches, {self.suppressed} in cooldown")
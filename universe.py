@@ -0,0 +1,127 @@
+# universe.py — tradable USDT spot symbols ranked from one bulk 24h-ticker request (scan prefilter)
+import time
+import threading
+import numpy as np
+
+from metrics import stats
+
+# leveraged tokens and stable/fiat pairs carry no useful TA signal
+EXCLUDE_SUFFIXES = ("UPUSDT", "DOWNUSDT", "BULLUSDT", "BEARUSDT")
+EXCLUDE_BASES = {"USDC", "FDUSD", "TUSD", "BUSD", "USDP", "DAI", "EUR", "GBP", "AEUR", "EURI", "USDE", "PAX", "UST"}
+
+
+def _pct_rank(x):
+    """Percentile rank 0..1 of each value (ties share the lower rank)."""
+    if len(x) < 2:
+        return np.ones(len(x))
+    x = np.asarray(x)
+    return np.searchsorted(np.sort(x), x, side="left") / (len(x) - 1)
+
+
+def rank_tickers(tickers, tradable=None, quote="USDT", min_quote_volume=1_000_000, weights=(0.5, 0.3, 0.2)):
+    """
+    Stage one of the scan: score every `quote` symbol from 24h tickers.
+    score = weighted percentile ranks of quote volume, range (high-low)/last and |change %|.
+    tradable: optional set of symbols currently TRADING (others are dropped).
+    Returns [(symbol, score, quote_volume, range_pct, change_pct)] best first.
+    """
+    rows = []
+    for t in tickers:
+        sym = t["symbol"]
+        if not sym.endswith(quote) or sym.endswith(EXCLUDE_SUFFIXES) or sym[:-len(quote)] in EXCLUDE_BASES:
+            continue
+        if tradable is not None and sym not in tradable:
+            continue
+        last = float(t["lastPrice"]); qv = float(t["quoteVolume"])
+        if last <= 0 or qv < min_quote_volume or int(t.get("count", 1)) == 0:
+            continue
+        rows.append((sym, qv, (float(t["highPrice"]) - float(t["lowPrice"])) / last * 100,
+                     float(t["priceChangePercent"])))
+    if not rows:
+        return []
+    qv = np.array([r[1] for r in rows]); rng = np.array([r[2] for r in rows]); chg = np.array([r[3] for r in rows])
+    w_vol, w_rng, w_chg = weights
+    score = w_vol * _pct_rank(qv) + w_rng * _pct_rank(rng) + w_chg * _pct_rank(np.abs(chg))
+    order = np.argsort(-score, kind="stable")
+    return [(rows[i][0], float(score[i]), rows[i][1], rows[i][2], rows[i][3]) for i in order]
+
+
+class Universe:
+    """
+    Symbols worth deep analysis. refresh() costs two requests: exchange info (TRADING
+    status, refreshed every `info_ttl` seconds) and the bulk 24h ticker, then keeps
+    the top `top_n` ranked symbols in `symbols`. Symbols that stop trading fall out
+    on the next refresh. On errors the previous list (or `fallback`) is kept.
+    client: governor.BinanceClient or alike (get_ticker(), get_exchange_info()).
+    """
+
+    def __init__(self, client, top_n=30, quote="USDT", min_quote_volume=1_000_000, fallback=(), info_ttl=6 * 60 * 60):
+        self.client = client
+        self.top_n = top_n
+        self.quote = quote
+        self.min_quote_volume = min_quote_volume
+        self.info_ttl = info_ttl
+        self.symbols = list(fallback)
+        self.ranked = []
+        self.tradable = None
+        self.updated = 0.0
+        self._info_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Re-rank the universe; returns (added, removed) symbol lists."""
+        with self._lock:
+            try:
+                if self.tradable is None or time.time() - self._info_at > self.info_ttl:
+                    self.tradable = self._tradable()
+                    self._info_at = time.time()
+                t0 = stats.clock()
+                tickers = self.client.get_ticker()
+                stats.observe("ticker_fetch", t0)
+                stats.inc("api_requests", endpoint="ticker24h")
+            except Exception as e:
+                stats.inc("errors", stage="universe")
+                print(f"[universe] refresh failed, keeping {len(self.symbols)} symbols: {e}")
+                return [], []
+            self.ranked = rank_tickers(tickers, self.tradable, self.quote, self.min_quote_volume)
+            if not self.ranked:
+                print("[universe] no symbols passed the prefilter, keeping previous list")
+                return [], []
+            new = [r[0] for r in self.ranked[:self.top_n]]
+            added = [s for s in new if s not in self.symbols]
+            removed = [s for s in self.symbols if s not in new]
+            self.symbols = new
+            self.updated = time.time()
+            stats.set("universe_ranked", len(self.ranked))
+            return added, removed
+
+    def export(self):
+        with self._lock:
+            return {"symbols": list(self.symbols), "ranked": list(self.ranked), "tradable": self.tradable,
+                    "updated": self.updated, "info_at": self._info_at}
+
+    def restore(self, saved):
+        with self._lock:
+            self.symbols = saved["symbols"] or self.symbols
+            self.ranked = saved["ranked"]
+            self.tradable = saved["tradable"]
+            self.updated = saved["updated"]
+            self._info_at = saved["info_at"]
+
+    def is_tradable(self, symbol):
+        return self.tradable is None or symbol in self.tradable
+
+    def summary(self, top=10):
+        lines = [f"🌐 Universe: {len(self.ranked)} {self.quote} symbols ranked, top {len(self.symbols)} analyzed"]
+        for sym, score, qv, rng, chg in self.ranked[:top]:
+            lines.append(f"• {sym}: score {score:.2f}, vol {qv / 1e6:.0f}M, range {rng:.1f}%, {chg:+.1f}%")
+        return "\n".join(lines)
+
+    def _tradable(self):
+        t0 = stats.clock()
+        info = self.client.get_exchange_info()
+        stats.observe("exchange_info_fetch", t0)
+        stats.inc("api_requests", endpoint="exchange_info")
+        return {s["symbol"] for s in info.get("symbols", [])
+                if s.get("status") == "TRADING" and s.get("quoteAsset") == self.quote
+                and s.get("isSpotTradingAllowed", True)}